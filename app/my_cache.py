@@ -0,0 +1,273 @@
+"""Answer and embedding caches used in front of local search."""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Hashable
+
+import numpy as np
+
+from graphrag.query.llm.base import BaseTextEmbedding
+
+from my_logging import log_event, payload
+
+log = logging.getLogger(__name__)
+
+
+class CachedTextEmbedder(BaseTextEmbedding):
+    """Two-tier query embedding cache: an in-process LRU in front of a SQLite file.
+
+    Keys are the normalized text plus the embedding model name, so the SQLite file can be shared
+    by every worker process and survives restarts. Pass ``db_path=None`` to keep the memory tier only.
+    """
+
+    def __init__(self, embedder: BaseTextEmbedding, db_path: str | None = None, max_entries: int = 1024):
+        self.embedder = embedder
+        self.model = getattr(embedder, "model", "")
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, "
+                "vector BLOB NOT NULL, created REAL NOT NULL)"
+            )
+
+    def embed(self, text: str, **kwargs: Any) -> list[float]:
+        key = self.cache_key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.embedder.embed(text, **kwargs)
+            self._put(key, text, vector)
+        return vector
+
+    async def aembed(self, text: str, **kwargs: Any) -> list[float]:
+        key = self.cache_key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = await self.embedder.aembed(text, **kwargs)
+            self._put(key, text, vector)
+        return vector
+
+    def cache_key(self, text: str) -> str:
+        normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+        return hashlib.sha1(f"{self.model}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        stats = {
+            "memory_entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+        if self.db_path:
+            stats["disk_entries"] = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            stats["disk_bytes"] = os.path.getsize(self.db_path)
+        return stats
+
+    def _get(self, key: str) -> list[float] | None:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+        if self.db_path:
+            row = self._connection().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put(self, key: str, text: str, vector: list[float]) -> None:
+        if not vector:
+            return
+        self._remember(key, vector)
+        if self.db_path:
+            try:
+                self._connection().execute(
+                    "INSERT OR IGNORE INTO embeddings (key, model, text, vector, created) VALUES (?, ?, ?, ?, ?)",
+                    (key, self.model, text, np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+                )
+            except sqlite3.Error:
+                log.exception("写入向量缓存失败")
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread and per process (connections must not cross a fork)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+@dataclass
+class CachedAnswer:
+    """A generated answer stored in the semantic cache."""
+
+    query: str
+    answer: str
+    vector: np.ndarray
+    created: float
+    size: int
+    hits: int = 0
+
+
+@dataclass
+class _Partition:
+    entries: OrderedDict = field(default_factory=OrderedDict)
+    matrix: np.ndarray | None = None
+    keys: list = field(default_factory=list)
+
+
+class SemanticCache:
+    """Reuse answers of semantically equivalent questions.
+
+    Entries are partitioned by a namespace (system prompt, index version, ...) and looked up by
+    cosine similarity of the query embedding. Eviction is TTL first, then LRU until both the
+    entry count and the approximate memory footprint fit their caps.
+    """
+
+    def __init__(
+            self,
+            threshold: float = 0.95,
+            ttl: float = 3600,
+            max_entries: int = 5000,
+            max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._partitions: dict[Hashable, _Partition] = {}
+        self._lru: OrderedDict[tuple[Hashable, int], None] = OrderedDict()
+        self._next_id = 0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, namespace: Hashable, embedding: list[float]) -> CachedAnswer | None:
+        """Return the closest cached answer above the similarity threshold, if any."""
+        partition = self._partitions.get(namespace)
+        vector = _normalize(embedding)
+        if partition is None or vector is None or not partition.entries:
+            self.misses += 1
+            return None
+        self._expire(namespace, partition)
+        if not partition.entries:
+            self.misses += 1
+            return None
+        if partition.matrix is None:
+            partition.keys = list(partition.entries)
+            partition.matrix = np.stack([partition.entries[key].vector for key in partition.keys])
+        scores = partition.matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        key = partition.keys[best]
+        entry = partition.entries[key]
+        entry.hits += 1
+        self._lru.move_to_end((namespace, key))
+        self.hits += 1
+        log_event(log, "语义缓存命中", similarity=round(float(scores[best]), 4), cached_query=payload(entry.query))
+        return entry
+
+    def store(self, namespace: Hashable, query: str, embedding: list[float], answer: str) -> None:
+        """Cache an answer for the given query embedding."""
+        vector = _normalize(embedding)
+        if vector is None or not answer:
+            return
+        size = vector.nbytes + len(answer.encode("utf-8")) + len(query.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        partition = self._partitions.setdefault(namespace, _Partition())
+        key = self._next_id
+        self._next_id += 1
+        partition.entries[key] = CachedAnswer(query=query, answer=answer, vector=vector, created=time.time(), size=size)
+        partition.matrix = None
+        self._lru[(namespace, key)] = None
+        self._bytes += size
+        while len(self._lru) > self.max_entries or self._bytes > self.max_bytes:
+            self._evict(*next(iter(self._lru)))
+
+    def discard(self, predicate) -> None:
+        """Drop every partition whose namespace matches the predicate (e.g. a retired index version)."""
+        for namespace in [namespace for namespace in self._partitions if predicate(namespace)]:
+            for key in list(self._partitions[namespace].entries):
+                self._evict(namespace, key)
+
+    def clear(self) -> None:
+        self._partitions.clear()
+        self._lru.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def _expire(self, namespace: Hashable, partition: _Partition) -> None:
+        deadline = time.time() - self.ttl
+        expired = [key for key, entry in partition.entries.items() if entry.created < deadline]
+        for key in expired:
+            self._evict(namespace, key)
+
+    def _evict(self, namespace: Hashable, key: int) -> None:
+        self._lru.pop((namespace, key), None)
+        partition = self._partitions.get(namespace)
+        if partition is None:
+            return
+        entry = partition.entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            self.evictions += 1
+        partition.matrix = None
+        if not partition.entries:
+            del self._partitions[namespace]
+
+
+def _normalize(embedding: list[float]) -> np.ndarray | None:
+    if embedding is None or len(embedding) == 0:
+        return None
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
@@ -0,0 +1,175 @@
+"""Community hierarchy and query-relevance selection of community reports for global search."""
+
+import logging
+import math
+from collections import defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from graphrag.model import CommunityReport
+from graphrag.query.input.loaders.dfs import read_community_reports
+from graphrag.query.llm.base import BaseTextEmbedding
+
+from my_snapshot import load_text_embeddings, text_key, write_text_embeddings
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CommunityTree:
+    """Community reports of every level up to the configured one, with each community's parent.
+
+    ``selectable`` holds the communities global search batches by default (each entity's
+    deepest community); the other reports only guide the walk down the hierarchy.
+    """
+
+    reports: list[CommunityReport]
+    parents: dict[str, str | None] = field(default_factory=dict)
+    selectable: set[str] = field(default_factory=set)
+
+    def children(self) -> dict[str | None, list[int]]:
+        """Report indices grouped by parent; communities whose parent has no report are roots (None)."""
+        ids = {report.community_id for report in self.reports}
+        grouped: dict[str | None, list[int]] = defaultdict(list)
+        for i, report in enumerate(self.reports):
+            parent = self.parents.get(report.community_id)
+            grouped[parent if parent in ids else None].append(i)
+        return grouped
+
+
+def read_community_tree(
+        report_df: pd.DataFrame,
+        node_df: pd.DataFrame,
+        community_level: int,
+        reports: list[CommunityReport] = (),
+) -> CommunityTree:
+    """Build the hierarchy from the report and node tables.
+
+    A community's parent is the community its nodes belong to one level up. Report objects
+    already read for local/global search are reused so the snapshot stores them once.
+    """
+    report_df = report_df[report_df["level"] <= community_level].copy()
+    report_df["community"] = report_df["community"].astype(str)
+    known = {report.community_id: report for report in reports}
+    missing = report_df[~report_df["community"].isin(known)]
+    read = read_community_reports(
+        df=missing,
+        id_col="community",
+        short_id_col="community",
+        summary_embedding_col=None,
+        content_embedding_col=None,
+    ) if len(missing) else []
+    by_id = {**known, **{report.community_id: report for report in read}}
+    ordered = [by_id[community] for community in report_df["community"] if community in by_id]
+
+    nodes = node_df[["title", "level", "community"]].dropna()
+    nodes = nodes.assign(community=nodes["community"].astype(int).astype(str), level=nodes["level"].astype(int))
+    child = nodes.rename(columns={"community": "child"})
+    parent = nodes.assign(level=nodes["level"] + 1).rename(columns={"community": "parent"})
+    pairs = child.merge(parent, on=["title", "level"])
+    parents = pairs.groupby("child")["parent"].agg(lambda s: s.value_counts().index[0]).to_dict()
+    return CommunityTree(reports=ordered, parents=parents, selectable=set(known) or set(report_df["community"]))
+
+
+def embed_reports(
+        tree: CommunityTree,
+        embed_texts: Callable[[list[str]], list[list[float]]],
+        cache_path: str | None = None,
+        model: str = "",
+) -> tuple[np.ndarray, int]:
+    """Embed every report of ``tree``; returns the row-normalized matrix and how many were embedded.
+
+    Blocking, so run it in a thread (or before forking workers). ``embed_texts`` embeds a list
+    of texts (in bounded batches). Vectors found in ``cache_path`` for the same ``model`` are
+    reused and the file is rewritten with the current reports' vectors.
+    """
+    texts = [f"{report.title}\n{report.summary or report.full_content[:2000]}" for report in tree.reports]
+    keys = [text_key(text) for text in texts]
+    known = load_text_embeddings(cache_path, model) if cache_path else {}
+    missing = {key: text for key, text in zip(keys, texts) if key not in known}
+    if missing:
+        vectors = embed_texts(list(missing.values()))
+        known.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+        if cache_path:
+            try:
+                write_text_embeddings(cache_path, model, {key: known[key] for key in keys})
+            except Exception as e:
+                log.error(f"写入报告向量文件失败: {str(e)}")
+    matrix = np.asarray([known[key] for key in keys], dtype=np.float32).reshape(len(keys), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms), len(missing)
+
+
+class CommunitySelector:
+    """Picks the community reports relevant to a query by walking the hierarchy top-down.
+
+    ``vectors`` are the normalized report embeddings from ``embed_reports``, computed once per
+    index version apart from the query embedding cache; ``text_embedder`` only embeds queries.
+    For a query, the root communities are ranked by cosine similarity and the top ``recall``
+    fraction (at least ``min_keep``, and scoring at least ``min_score``) is kept. Kept
+    communities that are selectable are selected, and their children are ranked the same way
+    at the next step. ``recall=1.0`` selects every selectable report, i.e. the unfiltered
+    report set.
+    """
+
+    def __init__(
+            self,
+            tree: CommunityTree,
+            text_embedder: BaseTextEmbedding,
+            vectors: np.ndarray,
+            recall: float = 0.7,
+            min_score: float = 0.0,
+            min_keep: int = 2,
+            embedded: int = 0,
+    ):
+        self.tree = tree
+        self.text_embedder = text_embedder
+        self.recall = recall
+        self.min_score = min_score
+        self.min_keep = min_keep
+        self.children = tree.children()
+        self.vectors = vectors
+        self.embedded = embedded
+        self.queries = 0
+        self.selected_total = 0
+        self.selectable = [report.community_id in tree.selectable for report in tree.reports]
+
+    def select(self, query: str) -> tuple[list[CommunityReport], dict[str, Any]]:
+        """The selected reports for ``query`` and the walk statistics."""
+        vector = np.asarray(self.text_embedder.embed(query), dtype=np.float32)
+        scores = self.vectors @ (vector / (np.linalg.norm(vector) or 1.0))
+        frontier = self.children.get(None, [])
+        selected: list[int] = []
+        scored = 0
+        while frontier:
+            scored += len(frontier)
+            ranked = sorted(frontier, key=lambda i: scores[i], reverse=True)
+            keep = max(self.min_keep, math.ceil(self.recall * len(ranked)))
+            kept = [i for i in ranked[:keep] if scores[i] >= self.min_score] or ranked[:1]
+            frontier = []
+            for i in kept:
+                if self.selectable[i]:
+                    selected.append(i)
+                frontier.extend(self.children.get(self.tree.reports[i].community_id, []))
+        self.queries += 1
+        self.selected_total += len(selected)
+        stats = {
+            "communities_scored": scored,
+            "communities_selected": len(selected),
+            "communities_total": sum(self.selectable),
+            "top_score": round(float(scores.max()), 3) if len(scores) else None,
+        }
+        return [self.tree.reports[i] for i in selected], stats
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "reports": len(self.tree.reports),
+            "selectable": sum(self.selectable),
+            "embedded_on_load": self.embedded,
+            "queries": self.queries,
+            "avg_selected": round(self.selected_total / self.queries, 1) if self.queries else 0.0,
+        }
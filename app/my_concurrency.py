@@ -0,0 +1,174 @@
+"""AIMD concurrency limit for the global search map calls."""
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+from openai import APITimeoutError, RateLimitError
+
+from my_logging import log_event
+from my_scheduler import LLMOverloaded, on_grant
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class _Slot:
+    started: float = field(default_factory=time.monotonic)
+    throttled: bool = False
+
+    def grant(self) -> None:
+        # restart the clock: time spent queued in the LLMScheduler says nothing about the upstream
+        self.started = time.monotonic()
+
+
+# the limiter slot held by the current task, so the HTTP hook can attribute retried 429s to it
+_current_slot: contextvars.ContextVar[_Slot | None] = contextvars.ContextVar("map_limiter_slot", default=None)
+
+
+class AdaptiveLimiter:
+    """Async semaphore whose limit follows the upstream's capacity (additive increase, multiplicative decrease).
+
+    Used in place of GlobalSearch's fixed ``semaphore`` and shared by every global query. A call
+    that succeeds within ``latency_tolerance`` times the baseline latency, while the limit is
+    nearly used up, raises the limit by ``1 / limit`` (about one slot per round of calls). A call
+    that was throttled (429, including retried ones seen by ``observe_response``), timed out or
+    took longer than the tolerance multiplies the limit by ``backoff``, at most once per baseline
+    latency so one overloaded burst counts once. The baseline is a moving average of the latencies
+    that were not spikes, quick to follow faster calls and slow to follow slower ones.
+
+    Latency is measured from when the ``LLMScheduler`` grants the call, and calls it rejected
+    (``LLMOverloaded``) never reached the upstream, so local queueing leaves the limit alone.
+    """
+
+    def __init__(
+            self,
+            initial: int = 8,
+            min_limit: int = 1,
+            max_limit: int = 32,
+            backoff: float = 0.5,
+            latency_tolerance: float = 2.0,
+            smoothing: float = 0.05,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.active = 0
+        self.baseline: float | None = None
+        self.latency: float | None = None
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.spikes = 0
+        self.decreases = 0
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        await self.acquire()
+        slot = _Slot()
+        _current_slot.set(slot)
+        on_grant.set(slot.grant)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        slot = _current_slot.get() or _Slot()
+        _current_slot.set(None)
+        on_grant.set(None)
+        self.release(time.monotonic() - slot.started, slot.throttled, exc)
+
+    async def acquire(self) -> None:
+        if not self._waiters and self.active < int(self.limit):
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted at the same moment: give the slot back
+                self.active -= 1
+                self._wake()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self, latency: float, throttled: bool = False, exc: BaseException | None = None) -> None:
+        """Free the slot and adjust the limit from the outcome of the call."""
+        self.active -= 1
+        self.calls += 1
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if isinstance(exc, (asyncio.CancelledError, LLMOverloaded)):
+            pass
+        elif throttled or isinstance(exc, RateLimitError):
+            self.throttled += 1
+            self._decrease("throttled", latency)
+        elif isinstance(exc, (APITimeoutError, asyncio.TimeoutError)):
+            self.timeouts += 1
+            self._decrease("timeout", latency)
+        elif exc is None:
+            if self.baseline is not None and latency > self.baseline * self.latency_tolerance:
+                self.spikes += 1
+                self._decrease("latency", latency)
+            else:
+                # follow faster calls quickly and slower ones slowly, so queueing does not become the norm
+                rate = 0.5 if self.baseline is None or latency < self.baseline else self.smoothing
+                self.baseline = latency if self.baseline is None else (1 - rate) * self.baseline + rate * latency
+                # only grow when the current limit is actually the constraint
+                if self.active + 1 >= int(self.limit) or self._waiters:
+                    self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        self._wake()
+
+    @staticmethod
+    async def observe_response(response: httpx.Response) -> None:
+        """Mark the calling task's slot as throttled on a 429; installed as an httpx response hook.
+
+        The OpenAI client and ChatOpenAI retry 429s internally, so the map call may still
+        succeed; the hook is how the limiter learns that the upstream pushed back.
+        """
+        if response.status_code == 429:
+            slot = _current_slot.get()
+            if slot is not None:
+                slot.throttled = True
+
+    def _decrease(self, reason: str, latency: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline or latency):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        previous = self.limit
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        log_event(log, "map 并发下调", reason=reason, limit_before=round(previous, 1), limit=round(self.limit, 1),
+                  latency_ms=round(latency * 1000), baseline_ms=round(self.baseline * 1000) if self.baseline else None)
+
+    def _wake(self) -> None:
+        while self._waiters and self.active < int(self.limit):
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "limit": round(self.limit, 1),
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "baseline_ms": round(self.baseline * 1000, 1) if self.baseline is not None else None,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "timeouts": self.timeouts,
+            "latency_spikes": self.spikes,
+            "decreases": self.decreases,
+        }
@@ -0,0 +1,266 @@
+"""Per-query context budget and compression for local search."""
+
+import copy
+import re
+import threading
+from collections import Counter
+from collections.abc import Iterable
+from typing import Any
+
+import pandas as pd
+
+from graphrag.model import TextUnit
+from graphrag.query.context_builder.builders import LocalContextBuilder
+from graphrag.query.context_builder.conversation_history import ConversationHistory
+from graphrag.vector_stores import BaseVectorStore, VectorStoreSearchResult
+from graphrag.vector_stores.lancedb import LanceDBVectorStore
+
+SOURCES_SECTION = "-----Sources-----"
+
+
+class AdaptiveContext:
+    """Chooses the local context size per query and strips repeated text from the result.
+
+    The entity vector scores decide the size: only entities scoring within ``score_margin`` of
+    the best match (and at least ``min_score``) count as relevant. Scores are cosine similarities
+    whatever the vector store (see ``cosine_score``). Their number, clamped to
+    ``min_entities..max_entities``, is used for ``top_k_mapped_entities`` and
+    ``top_k_relationships``. ``max_tokens`` scales linearly with it from ``min_tokens`` to
+    ``max_tokens``. A single sharp match gets a small context; many near-equal matches get the
+    full budget.
+
+    After the build, the Sources table is compressed. Lines that ``fit`` found in many text units
+    of the corpus (navigation, footers) are removed. Rows left empty, or near-duplicates of an
+    earlier row (character shingle Jaccard of at least ``dedup_threshold``), are dropped.
+    """
+
+    def __init__(
+            self,
+            token_encoder: Any,
+            min_tokens: int = 200,
+            max_tokens: int = 400,
+            min_entities: int = 3,
+            max_entities: int = 10,
+            score_margin: float = 0.08,
+            min_score: float = 0.0,
+            dedup_threshold: float = 0.9,
+            boilerplate_min_units: int = 5,
+            boilerplate_fraction: float = 0.02,
+            totals: "ContextTotals | None" = None,
+    ):
+        self.token_encoder = token_encoder
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.min_entities = min_entities
+        self.max_entities = max_entities
+        self.score_margin = score_margin
+        self.min_score = min_score
+        self.dedup_threshold = dedup_threshold
+        self.boilerplate_min_units = boilerplate_min_units
+        self.boilerplate_fraction = boilerplate_fraction
+        self.totals = totals
+        self.boilerplate: frozenset[str] = frozenset()
+
+    def fit(self, text_units: Iterable[TextUnit]) -> "AdaptiveContext":
+        """Collect the lines repeated across many text units of the index."""
+        counts: Counter[str] = Counter()
+        total = 0
+        for unit in text_units:
+            total += 1
+            counts.update({line for line in map(_normalize, (unit.text or "").split("\n")) if line})
+        threshold = max(self.boilerplate_min_units, self.boilerplate_fraction * total)
+        self.boilerplate = frozenset(line for line, count in counts.items() if count >= threshold)
+        return self
+
+    def plan(self, scores: list[float]) -> tuple[int, int]:
+        """``(entities, max_tokens)`` for a query whose entity matches scored ``scores``."""
+        if not scores:
+            return self.max_entities, self.max_tokens
+        top = max(scores)
+        cutoff = max(top - self.score_margin, self.min_score)
+        relevant = sum(1 for score in scores if score >= cutoff)
+        entities = min(max(relevant, self.min_entities), self.max_entities)
+        span = max(1, self.max_entities - self.min_entities)
+        tokens = self.min_tokens + (self.max_tokens - self.min_tokens) * (entities - self.min_entities) / span
+        return entities, int(tokens)
+
+    def build(
+            self,
+            context_builder: LocalContextBuilder,
+            query: str,
+            conversation_history: ConversationHistory | None,
+            params: dict[str, Any],
+    ) -> tuple[str, dict[str, pd.DataFrame], dict[str, Any]]:
+        """Run ``context_builder`` with a per-query budget, then compress; returns the stats too.
+
+        The entity search that sizes the budget is handed to the build, which would otherwise
+        repeat it (``map_query_to_entities`` asks for ``2 * top_k_mapped_entities`` rows, never
+        more than the ``2 * max_entities`` searched here).
+        """
+        store = context_builder.entity_text_embeddings
+        search_text = _entity_search_text(query, conversation_history, params)
+        results = store.similarity_search_by_text(
+            text=search_text,
+            text_embedder=lambda t: context_builder.text_embedder.embed(t),
+            k=self.max_entities * 2,
+        )
+        entities, max_tokens = self.plan([cosine_score(store, result.score) for result in results])
+        params = {**params, "top_k_mapped_entities": entities, "top_k_relationships": entities, "max_tokens": max_tokens}
+        # per-query shallow copy; the shared builder keeps its own store
+        context_builder = copy.copy(context_builder)
+        context_builder.entity_text_embeddings = PrefetchedSearch(store, search_text, results)
+        context_text, context_records = context_builder.build_context(
+            query=query, conversation_history=conversation_history, **params
+        )
+        compressed, kept_ids, removed_lines, removed_rows = self.compress(context_text)
+        if removed_rows and isinstance(context_records.get("sources"), pd.DataFrame) and "id" in context_records["sources"]:
+            sources = context_records["sources"]
+            context_records["sources"] = sources[sources["id"].astype(str).isin(kept_ids)]
+        stats = {
+            "entities": entities,
+            "budget_tokens": max_tokens,
+            "tokens_before": len(self.token_encoder.encode(context_text)),
+            "tokens_after": len(self.token_encoder.encode(compressed)),
+            "boilerplate_lines": removed_lines,
+            "dropped_rows": removed_rows,
+        }
+        if self.totals is not None:
+            self.totals.record(stats)
+        return compressed, context_records, stats
+
+    def compress(self, context_text: str) -> tuple[str, set[str], int, int]:
+        """Strip boilerplate lines and near-duplicate rows from the Sources table.
+
+        Returns the text, the ids of the rows kept, and the number of lines and rows removed.
+        """
+        lines = context_text.split("\n")
+        if SOURCES_SECTION not in lines:
+            return context_text, set(), 0, 0
+        start = lines.index(SOURCES_SECTION) + 2
+        end = next((i for i in range(start, len(lines)) if _is_section(lines[i])), len(lines))
+        row_start = re.compile(r"^(\d+)\|")
+        rows: list[list[str]] = []
+        for line in lines[start:end]:
+            if row_start.match(line) or not rows:
+                rows.append([line])
+            else:
+                rows[-1].append(line)
+
+        kept: list[list[str]] = []
+        kept_ids: set[str] = set()
+        shingles: list[set[str]] = []
+        removed_lines = removed_rows = 0
+        for row in rows:
+            match = row_start.match(row[0])
+            if match is None:
+                kept.append(row)
+                continue
+            prefix, row[0] = row[0][:match.end()], row[0][match.end():]
+            cleaned = [line for line in row if not line.strip() or _normalize(line) not in self.boilerplate]
+            removed_lines += len(row) - len(cleaned)
+            body = "\n".join(cleaned).strip("\n")
+            row_shingles = _shingles(body)
+            if not body.strip() or any(_jaccard(row_shingles, other) >= self.dedup_threshold for other in shingles):
+                removed_rows += 1
+                continue
+            shingles.append(row_shingles)
+            kept_ids.add(match.group(1))
+            # keep the blank line that separates the table from the next section
+            kept.append([prefix + body] + ([""] if row[-1] == "" and body else []))
+        if not removed_lines and not removed_rows:
+            return context_text, kept_ids, 0, 0
+        lines[start:end] = [line for row in kept for line in row]
+        return "\n".join(lines), kept_ids, removed_lines, removed_rows
+
+
+class PrefetchedSearch:
+    """Vector store view that answers one text search from results already fetched.
+
+    A search for the same text with at most as many rows is served from ``results``; anything
+    else (and every other attribute) goes to the wrapped store.
+    """
+
+    def __init__(self, store: BaseVectorStore, text: str, results: list[VectorStoreSearchResult]):
+        self._store = store
+        self._text = text
+        self._results = results
+
+    def similarity_search_by_text(self, text: str, text_embedder: Any, k: int = 10, **kwargs: Any) -> list[VectorStoreSearchResult]:
+        if text == self._text and k <= len(self._results):
+            return self._results[:k]
+        return self._store.similarity_search_by_text(text, text_embedder, k=k, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._store, name)
+
+
+def cosine_score(store: BaseVectorStore, score: float) -> float:
+    """A search result score as cosine similarity.
+
+    ``NumpyVectorStore`` scores are cosine already. graphrag's LanceDB store reports
+    ``1 - squared L2 distance``, which for unit-length embeddings (as OpenAI-style embedding
+    models return) is ``2 * cos - 1``.
+    """
+    if isinstance(store, LanceDBVectorStore):
+        return (1 + score) / 2
+    return score
+
+
+class ContextTotals:
+    """Running totals of the adaptive context stage, shared by every index generation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.budget_tokens = 0
+        self.boilerplate_lines = 0
+        self.dropped_rows = 0
+
+    def record(self, stats: dict[str, Any]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += stats["tokens_before"]
+            self.tokens_after += stats["tokens_after"]
+            self.budget_tokens += stats["budget_tokens"]
+            self.boilerplate_lines += stats["boilerplate_lines"]
+            self.dropped_rows += stats["dropped_rows"]
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "avg_budget_tokens": round(self.budget_tokens / self.requests, 1) if self.requests else 0.0,
+                "avg_tokens_before": round(self.tokens_before / self.requests, 1) if self.requests else 0.0,
+                "avg_tokens_after": round(self.tokens_after / self.requests, 1) if self.requests else 0.0,
+                "boilerplate_lines": self.boilerplate_lines,
+                "dropped_rows": self.dropped_rows,
+            }
+
+
+def _entity_search_text(query: str, conversation_history: ConversationHistory | None, params: dict[str, Any]) -> str:
+    # the text LocalSearchMixedContext.build_context searches entities with
+    if conversation_history:
+        turns = conversation_history.get_user_turns(params.get("conversation_history_max_turns", 5))
+        return f"{query}\n" + "\n".join(turns)
+    return query
+
+
+def _normalize(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _is_section(line: str) -> bool:
+    return line.startswith("-----") and line.endswith("-----")
+
+
+def _shingles(text: str, size: int = 4) -> set[str]:
+    text = "".join(text.split())
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,190 @@
+"""Query embedding micro-batching across concurrent requests, and batched bulk embedding."""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+import openai
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+from graphrag.query.llm.base import BaseTextEmbedding
+from graphrag.query.llm.oai.embedding import OpenAIEmbedding
+
+log = logging.getLogger(__name__)
+
+
+class MicroBatchEmbedder(BaseTextEmbedding):
+    """Collects single-text embedding calls for up to ``max_wait_ms`` or ``max_batch_size`` texts
+    and sends them to the embedding endpoint as one request.
+
+    Both ``embed`` (called from context builder threads) and ``aembed`` enqueue the text and wait
+    for their own vector. A dispatcher thread forms the batches and up to ``max_concurrent_batches``
+    requests are in flight at once, so texts arriving during a slow request form the next batch.
+    Texts longer than the model's token limit bypass batching and use the wrapped embedder's
+    chunk-and-average path. Vectors are L2-normalized, as ``OpenAIEmbedding.embed`` returns them.
+    """
+
+    def __init__(
+            self,
+            embedder: OpenAIEmbedding,
+            max_batch_size: int = 16,
+            max_wait_ms: float = 5.0,
+            max_concurrent_batches: int = 4,
+    ):
+        self.embedder = embedder
+        self.model = embedder.model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrent_batches = max_concurrent_batches
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue: queue.SimpleQueue | None = None
+        self._pool: ThreadPoolExecutor | None = None
+        self.batches = 0
+        self.texts = 0
+        self.errors = 0
+        self.batch_sizes: Counter[int] = Counter()
+        self._waits: deque[float] = deque(maxlen=2048)
+
+    def embed(self, text: str, **kwargs: Any) -> list[float]:
+        if kwargs or self._too_long(text):
+            return self.embedder.embed(text, **kwargs)
+        return self._submit(text).result()
+
+    async def aembed(self, text: str, **kwargs: Any) -> list[float]:
+        if kwargs or self._too_long(text):
+            return await self.embedder.aembed(text, **kwargs)
+        return await asyncio.wrap_future(self._submit(text))
+
+    def stats(self) -> dict[str, Any]:
+        waits = np.asarray(self._waits) * 1000
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "errors": self.errors,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_wait_ms": {
+                "p50": round(float(np.percentile(waits, 50)), 2) if len(waits) else 0.0,
+                "p95": round(float(np.percentile(waits, 95)), 2) if len(waits) else 0.0,
+                "max": round(float(waits.max()), 2) if len(waits) else 0.0,
+            },
+        }
+
+    def _too_long(self, text: str) -> bool:
+        # cheap upper bound first: a token is never shorter than one character
+        return len(text) > self.embedder.max_tokens and len(self.embedder.token_encoder.encode(text)) > self.embedder.max_tokens
+
+    def _submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._ensure_started().put((text, future, time.perf_counter()))
+        return future
+
+    def _ensure_started(self) -> queue.SimpleQueue:
+        # the dispatcher thread does not survive a fork; each process starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_concurrent_batches, thread_name_prefix="embedding-batch"
+                )
+                threading.Thread(
+                    target=self._dispatch, args=(self._queue, self._pool), name="embedding-batcher", daemon=True
+                ).start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _dispatch(self, pending: queue.SimpleQueue, pool: ThreadPoolExecutor) -> None:
+        while True:
+            batch = [pending.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            pool.submit(self._send, batch)
+
+    def _send(self, batch: list[tuple[str, Future, float]]) -> None:
+        start = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        with self._lock:
+            self.batches += 1
+            self.texts += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self._waits.extend(start - enqueued for _, _, enqueued in batch)
+        try:
+            vectors = dict(zip(texts, self._embed_batch(texts)))
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            log.error(f"批量向量化失败（{len(texts)} 条）: {str(e)}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            future.set_result(vectors[text])
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return embed_batch(self.embedder, texts)
+
+
+def embed_batch(embedder: OpenAIEmbedding, texts: list[str]) -> list[list[float]]:
+    """Embed ``texts`` in one request, retried like ``OpenAIEmbedding``; vectors are L2-normalized."""
+    retryer = Retrying(
+        stop=stop_after_attempt(embedder.max_retries),
+        wait=wait_exponential_jitter(max=10),
+        reraise=True,
+        retry=retry_if_exception_type(embedder.retry_error_types),
+    )
+    for attempt in retryer:
+        with attempt:
+            response = embedder.sync_client.embeddings.create(input=texts, model=embedder.model)
+    data = sorted(response.data, key=lambda item: item.index)
+    matrix = np.asarray([item.embedding for item in data], dtype=np.float64)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.tolist()
+
+
+def embed_documents(embedder: OpenAIEmbedding, texts: list[str], batch_size: int = 16) -> list[list[float]]:
+    """Embed many texts synchronously, ``batch_size`` per request and one request at a time.
+
+    For bulk work at index load time, so it neither competes with query embeddings for the
+    micro-batcher nor passes through the query cache. Texts longer than the model's token
+    limit use the embedder's chunk-and-average path. A batch the endpoint rejects (HTTP 400,
+    e.g. more inputs than the model accepts per request) is retried at half the size, and the
+    smaller size is kept for the remaining batches.
+    """
+    vectors: list[list[float] | None] = [None] * len(texts)
+    short = []
+    for i, text in enumerate(texts):
+        if len(text) > embedder.max_tokens and len(embedder.token_encoder.encode(text)) > embedder.max_tokens:
+            vectors[i] = embedder.embed(text)
+        else:
+            short.append(i)
+    size = max(1, batch_size)
+    start = 0
+    while start < len(short):
+        batch = short[start:start + size]
+        try:
+            batch_vectors = embed_batch(embedder, [texts[i] for i in batch])
+        except openai.BadRequestError as e:
+            if len(batch) == 1:
+                raise
+            size = len(batch) // 2
+            log.warning(f"向量接口拒绝了 {len(batch)} 条的批次，批大小减半为 {size} 后重试: {str(e)}")
+            continue
+        for i, vector in zip(batch, batch_vectors):
+            vectors[i] = vector
+        start += len(batch)
+    return vectors
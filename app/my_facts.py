@@ -0,0 +1,269 @@
+"""Contact facts extracted from claims, and a matcher that answers contact questions without the LLM."""
+
+import re
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Any
+
+import pandas as pd
+
+PHONE_PATTERNS = [
+    re.compile(r"(?<![\d+])(?:\+?86[- ]?)?1[3-9]\d[- ]?\d{4}[- ]?\d{4}(?!\d)"),  # mobile
+    re.compile(r"(?<![\d+])[48]00[- ]?\d{3}[- ]?\d{4}(?!\d)"),  # 400/800 hotlines
+    re.compile(r"(?<![\d+])(?:\(0\d{2,3}\)|0\d{2,3})[- ]?\d{7,8}(?!\d)"),  # landline with area code
+    re.compile(r"(?<!\d)\+\d{1,3}[- ]\d{2,4}[- ]\d{3,4}[- ]?\d{3,4}(?!\d)"),  # international
+]
+EMAIL_PATTERN = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}")
+WEBSITE_PATTERN = re.compile(r"(?:https?://|www\.)[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+(?:/[^\s，。,;；)）\]]*)?")
+ADDRESS_PATTERNS = [
+    re.compile(
+        r"(?:地址|address(?: is)?|located at|位于)\s*[:：]?\s*"
+        r"([^\n。;；]{4,80}?)(?=\s*(?:[。;；\n]|$|[,，]?\s*(?:phone|tel|email|电话|邮箱|网址)))",
+        re.IGNORECASE,
+    ),
+    re.compile(r"[一-龥]{2,8}(?:省|市)[一-龥A-Za-z0-9\-#]{4,40}?(?:号|室|楼|栋|层|园|大厦|中心)"),
+]
+
+FACT_LABELS = {"phone": "联系电话", "email": "电子邮箱", "address": "地址", "website": "网址"}
+
+# question keywords per fact kind; "contact" asks for phone and email together
+INTENT_KEYWORDS = {
+    "phone": ["电话", "手机", "热线", "座机", "号码", "致电", "phone", "telephone", "tel", "hotline", "call"],
+    "email": ["邮箱", "邮件", "电邮", "email", "e-mail", "mail"],
+    "address": ["地址", "厂址", "address"],
+    "website": ["网址", "官网", "网站", "website", "url", "site"],
+    "contact": ["联系方式", "怎么联系", "如何联系", "联系你们", "联系我们", "contact"],
+}
+# generic location words ("在哪里", "where") only ask for the address right after the company itself,
+# at the end of the question: "公司在哪里" does, "产品在哪里生产" and "哪里可以维修" do not
+LOCATION_PATTERNS = [
+    re.compile(r"(?:你们|贵司|贵公司|公司|总部|工厂|厂家|门店|办公室|办公地点)(?:的|具体|现在|目前)*"
+               r"(?:在哪里?|在哪儿|在什么(?:地方|位置)|位置在哪里?|位于哪里?|位置)[呢啊呀吗]?[?？。!！]*$"),
+    re.compile(r"where\s+(?:is|are)\s+(?:you|your\s+(?:company|office|headquarters|factory|store)|the\s+(?:company|office))"
+               r"(?:\s+located)?\s*\??$"),
+]
+# words that carry no request of their own; what is left after removing them, the intent keywords
+# and the subject decides how confidently the question asks for the fact alone
+FILLER_WORDS = [
+    "请问", "你好", "您好", "你们", "您们", "我们", "贵公司", "贵司", "公司", "总部", "官方", "客服", "联系", "咨询",
+    "具体", "一下", "告诉", "给我", "我", "能", "可以", "有没有", "有", "是", "多少", "什么", "哪里", "在哪", "哪儿",
+    "在", "的", "吗", "呢", "啊", "呀", "吧", "和", "及", "或", "位置", "地方", "位于", "号", "码",
+    "what", "is", "are", "your", "the", "company", "office", "please", "number", "can", "i", "get", "have",
+    "do", "you", "where", "located", "and", "or", "s", "me", "give", "tell",
+]
+# questions containing these ask for more than a fact and always go to local search
+COMPLEX_MARKERS = [
+    "为什么", "怎么样", "如何使用", "区别", "比较", "价格", "多少钱", "买", "功能", "参数", "推荐", "介绍", "原理",
+    "why", "how to", "compare", "price", "buy",
+]
+
+
+@dataclass(frozen=True)
+class Fact:
+    subject: str
+    kind: str
+    value: str
+
+
+@dataclass
+class FactAnswer:
+    text: str
+    subject: str
+    kinds: list[str]
+    confidence: float
+
+
+def extract_facts(covariate_df: pd.DataFrame) -> list[Fact]:
+    """Contact facts found in the claim rows.
+
+    The ``claim_contact_details`` column is used when the index has it; the description and
+    source text are scanned as well, since the default claim pipeline keeps only those.
+    """
+    columns = [col for col in ("claim_contact_details", "description", "source_text") if col in covariate_df.columns]
+    facts = []
+    for row in covariate_df[["subject_id", *columns]].itertuples(index=False):
+        subject = str(row[0] or "").strip()
+        if not subject:
+            continue
+        text = "\n".join(_text(value) for value in row[1:])
+        facts.extend(Fact(subject, kind, value) for kind, value in find_contacts(text))
+    return facts
+
+
+def find_contacts(text: str) -> list[tuple[str, str]]:
+    found = []
+    for pattern in PHONE_PATTERNS:
+        found += [("phone", match.group(0).strip()) for match in pattern.finditer(text)]
+    found += [("email", match.group(0).lower()) for match in EMAIL_PATTERN.finditer(text)]
+    found += [("website", match.group(0).rstrip("./").lower()) for match in WEBSITE_PATTERN.finditer(text)]
+    for pattern in ADDRESS_PATTERNS:
+        found += [("address", (match.group(1) if match.groups() else match.group(0)).strip(" ,，:："))
+                  for match in pattern.finditer(text)]
+    return found
+
+
+class FactIndex:
+    """Contact facts of one index version, grouped by subject and kind with their support counts.
+
+    ``entity_names`` are used to notice questions about an entity that has no contact facts;
+    those are left to local search rather than answered with another subject's details.
+    """
+
+    def __init__(self, facts: Iterable[Fact], entity_names: Iterable[str] = ()):
+        self.values: dict[str, dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+        keys: dict[tuple[str, str, str], str] = {}
+        for fact in facts:
+            # count "0731-1234567" and "0731 1234567" as one value, shown as first seen
+            key = (fact.subject, fact.kind, _value_key(fact.kind, fact.value))
+            self.values[fact.subject][fact.kind][keys.setdefault(key, fact.value)] += 1
+        self.values = {subject: dict(kinds) for subject, kinds in self.values.items()}
+        for kinds in self.values.values():
+            if "address" in kinds:
+                kinds["address"] = _merge_contained(kinds["address"])
+        totals = {subject: sum(sum(c.values()) for c in kinds.values()) for subject, kinds in self.values.items()}
+        self.primary = max(totals, key=totals.get) if totals else None
+        self.primary_share = totals[self.primary] / sum(totals.values()) if totals else 0.0
+        self._subjects = sorted(self.values, key=len, reverse=True)
+        self._entity_names = sorted({name for name in entity_names if len(name) >= 2} - set(self.values), key=len, reverse=True)
+
+    def __len__(self) -> int:
+        return sum(sum(sum(c.values()) for c in kinds.values()) for kinds in self.values.values())
+
+    def mentioned_subject(self, question: str) -> tuple[str | None, bool]:
+        """The subject with facts named in the question, and whether another entity is named instead."""
+        folded = question.casefold()
+        subject = next((s for s in self._subjects if s.casefold() in folded), None)
+        if subject is not None:
+            return subject, False
+        return None, any(name.casefold() in folded for name in self._entity_names)
+
+
+class FactMatcher:
+    """Keyword intent matcher that answers short contact questions from a ``FactIndex``.
+
+    A question is answered only when it is at most ``max_chars`` long, asks for a contact kind,
+    has no marker of a broader question, and the match is confident enough. The confidence is
+    the share of the question explained by the intent keywords, the subject and filler words,
+    times the subject certainty (1 when named; the square root of the main subject's share of
+    the contact facts when the question names no one), lowered when the top values tie.
+    Everything below ``min_confidence`` falls back to local search.
+    """
+
+    def __init__(self, max_chars: int = 40, min_confidence: float = 0.7, max_values: int = 3):
+        self.max_chars = max_chars
+        self.min_confidence = min_confidence
+        self.max_values = max_values
+        self.questions = 0
+        self.answered = 0
+        self.low_confidence = 0
+
+    def intents(self, question: str) -> list[str]:
+        folded = question.casefold()
+        if len(question) > self.max_chars or any(marker in folded for marker in COMPLEX_MARKERS):
+            return []
+        kinds = [kind for kind, words in INTENT_KEYWORDS.items() if any(_has_word(folded, word) for word in words)]
+        if "address" not in kinds and any(pattern.search(folded.strip()) for pattern in LOCATION_PATTERNS):
+            kinds.append("address")
+        if "contact" in kinds:
+            kinds.remove("contact")
+            kinds += [kind for kind in ("phone", "email") if kind not in kinds]
+        return kinds
+
+    def answer(self, index: FactIndex | None, question: str) -> FactAnswer | None:
+        self.questions += 1
+        kinds = self.intents(question)
+        if not kinds or index is None or index.primary is None:
+            return None
+        subject, other_entity = index.mentioned_subject(question)
+        if other_entity:
+            self.low_confidence += 1
+            return None
+        # unnamed subjects mean the site owner, i.e. the subject most contact facts belong to
+        confidence = _intent_coverage(question, subject) * (1.0 if subject is not None else index.primary_share ** 0.5)
+        subject = subject or index.primary
+        lines = []
+        for kind in kinds:
+            counts = index.values[subject].get(kind)
+            if not counts:
+                continue
+            ranked = counts.most_common()
+            top = ranked[0][1]
+            values = [value for value, count in ranked if count * 3 >= top][:self.max_values]
+            if len(ranked) > 1 and ranked[1][1] == top:
+                confidence *= 0.9
+            lines.append(f"{FACT_LABELS[kind]}：{'、'.join(values)}")
+        if not lines or len(lines) < len(kinds) / 2 or confidence < self.min_confidence:
+            self.low_confidence += 1
+            return None
+        self.answered += 1
+        text = f"{subject}\n\n" + "\n".join(f"- {line}" for line in lines)
+        return FactAnswer(text, subject, kinds, round(confidence, 2))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "questions": self.questions,
+            "answered": self.answered,
+            "low_confidence": self.low_confidence,
+            "answer_rate": self.answered / self.questions if self.questions else 0.0,
+        }
+
+
+def _text(value: Any) -> str:
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    if isinstance(value, str):
+        return value
+    try:
+        return "\n".join(str(item) for item in value)
+    except TypeError:
+        return str(value)
+
+
+def _value_key(kind: str, value: str) -> str:
+    if kind == "phone":
+        return re.sub(r"\D", "", value)
+    return "".join(value.split()).casefold()
+
+
+def _merge_contained(counts: Counter) -> Counter:
+    """Fold values contained in a longer one ("长沙市…100号" into "湖南省长沙市…100号") into it."""
+    merged: Counter = Counter()
+    values = sorted(counts, key=lambda value: len(_value_key("address", value)), reverse=True)
+    for value in values:
+        key = _value_key("address", value)
+        target = next((kept for kept in merged if key in _value_key("address", kept)), value)
+        merged[target] += counts[value]
+    return merged
+
+
+def _intent_coverage(question: str, subject: str | None) -> float:
+    """Share of the question's characters taken up by intent keywords, the subject and filler words.
+
+    Every occurrence counts, overlapping ones included: in "怎么联系你们" both "怎么联系" and
+    "联系你们" are intent keywords and together cover the whole question.
+    """
+    folded = question.casefold()
+    counted = [not re.match(r"[\W_]", char) for char in folded]
+    total = sum(counted)
+    if not total:
+        return 0.0
+    words = {word for words in INTENT_KEYWORDS.values() for word in words} | set(FILLER_WORDS)
+    if subject is not None:
+        words.add(subject.casefold())
+    covered = [False] * len(folded)
+    for word in words:
+        if word.isascii():
+            pattern = rf"(?<![a-z]){re.escape(word)}(?![a-z])"
+        else:
+            pattern = f"(?={re.escape(word)})"
+        for match in re.finditer(pattern, folded):
+            covered[match.start():match.start() + len(word)] = [True] * len(word)
+    return sum(1 for is_counted, is_covered in zip(counted, covered) if is_counted and is_covered) / total
+
+
+def _has_word(folded: str, word: str) -> bool:
+    # ASCII keywords must be whole words ("tel" should not match "hotel"); CJK ones are substrings
+    if word.isascii():
+        return re.search(rf"(?<![a-z]){re.escape(word)}(?![a-z])", folded) is not None
+    return word in folded
@@ -0,0 +1,265 @@
+"""GlobalSearch with off-loop context building, map-phase progress events and a streamed reduce."""
+
+import asyncio
+import copy
+import logging
+import threading
+import time
+from collections.abc import AsyncGenerator
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any
+
+from graphrag.query.context_builder.conversation_history import (
+    ConversationHistory,
+)
+from graphrag.query.llm.base import BaseLLM
+from graphrag.query.llm.text_utils import num_tokens
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.search import GlobalSearch as BaseGlobalSearch
+
+from my_community import CommunitySelector
+from my_concurrency import AdaptiveLimiter
+from my_logging import log_event
+from my_scheduler import Priority, priority
+
+log = logging.getLogger(__name__)
+
+
+class EarlyStop:
+    """When the map phase may stop waiting and hand the answers collected so far to the reduce.
+
+    The reduce starts before every map call has finished once at least ``min_fraction`` of the
+    calls are done and they produced ``min_key_points`` key points scoring at least
+    ``min_score``, or once ``deadline`` seconds have passed with at least one call done. The
+    remaining calls are cancelled. Running totals are shared by every engine using the policy.
+    """
+
+    def __init__(self, min_key_points: int = 8, min_score: int = 60, min_fraction: float = 0.5, deadline: float = 20.0):
+        self.min_key_points = min_key_points
+        self.min_score = min_score
+        self.min_fraction = min_fraction
+        self.deadline = deadline
+        self.queries = 0
+        self.stopped_early = 0
+        self.skipped_calls = 0
+        self.saved_seconds = 0.0
+
+    def key_points(self, result: SearchResult) -> int:
+        """Key points of one map answer scoring at least ``min_score``."""
+        if not isinstance(result.response, list):
+            return 0
+        return sum(
+            1 for point in result.response
+            if isinstance(point, dict) and isinstance(point.get("score"), (int, float)) and point["score"] >= self.min_score
+        )
+
+    def reason(self, completed: int, total: int, key_points: int, elapsed: float) -> str | None:
+        """Why the reduce can start now, or None to keep waiting."""
+        if completed >= total:
+            return "complete"
+        if completed >= self.min_fraction * total and key_points >= self.min_key_points:
+            return "key_points"
+        if completed and elapsed >= self.deadline:
+            return "deadline"
+        return None
+
+    def record(self, stats: dict[str, Any]) -> None:
+        self.queries += 1
+        if stats["skipped"]:
+            self.stopped_early += 1
+            self.skipped_calls += stats["skipped"]
+            self.saved_seconds += stats["saved_seconds_est"]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queries": self.queries,
+            "stopped_early": self.stopped_early,
+            "skipped_calls": self.skipped_calls,
+            "saved_seconds_est": round(self.saved_seconds, 1),
+        }
+
+
+@dataclass
+class MapProgress:
+    """Emitted by astream_search while the map phase is running (also as a periodic heartbeat)."""
+
+    completed: int
+    total: int
+
+
+@dataclass
+class SearchUsage:
+    """Emitted by astream_search after the last reduce token: LLM calls and prompt tokens of the search."""
+
+    llm_calls: int
+    prompt_tokens: int
+
+
+class _CountingLLM:
+    """Passes streamed calls through and counts them with their system prompt tokens, as the baseline reduce does."""
+
+    def __init__(self, llm: BaseLLM, token_encoder: Any):
+        self.llm = llm
+        self.token_encoder = token_encoder
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    async def astream_generate(self, messages: list[dict], **kwargs: Any) -> AsyncGenerator[str, None]:
+        self.calls += 1
+        self.prompt_tokens += sum(
+            num_tokens(message["content"], self.token_encoder) for message in messages if message["role"] == "system"
+        )
+        async for token in self.llm.astream_generate(messages, **kwargs):
+            yield token
+
+
+class GlobalSearch(BaseGlobalSearch):
+    """Global search whose stream reports map progress before streaming the reduce tokens.
+
+    With a ``community_selector`` only the reports relevant to the query are batched for the
+    map phase instead of every report. A ``map_limiter`` replaces the fixed
+    ``concurrent_coroutines`` semaphore around the map calls; one limiter can be shared by
+    every engine so concurrent global queries draw on the same limit. With ``early_stop`` the
+    reduce may start before the slowest map calls finish (see ``EarlyStop``). ``context_lock``
+    serialises the context build with any other builder that touches the same report objects.
+    """
+
+    def __init__(
+            self,
+            *args,
+            executor: Executor | None = None,
+            heartbeat_interval: float = 5.0,
+            community_selector: CommunitySelector | None = None,
+            map_limiter: AdaptiveLimiter | None = None,
+            early_stop: EarlyStop | None = None,
+            context_lock: "threading.Lock | None" = None,
+            **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if map_limiter is not None:
+            # _map_response_single_batch wraps each map call in ``async with self.semaphore``
+            self.semaphore = map_limiter
+        self.executor = executor
+        self.heartbeat_interval = heartbeat_interval
+        self.community_selector = community_selector
+        self.early_stop = early_stop
+        # build_community_context seeds and shuffles the module-level random generator and writes
+        # "occurrence weight" onto the report objects, which the local builder shares: pass its lock
+        self._context_lock = context_lock or threading.Lock()
+
+    def _build_context(self, conversation_history: ConversationHistory | None = None, reports: list | None = None):
+        with self._context_lock:
+            context_builder = self.context_builder
+            if reports is not None:
+                context_builder = copy.copy(context_builder)
+                context_builder.community_reports = reports
+            return context_builder.build_context(
+                conversation_history=conversation_history, **self.context_builder_params
+            )
+
+    async def abuild_context(self, conversation_history: ConversationHistory | None = None, query: str | None = None):
+        """Select the reports relevant to ``query`` (when a selector is set) and build their batches on the executor."""
+        loop = asyncio.get_running_loop()
+        reports = None
+        if self.community_selector is not None and query:
+            reports, stats = await loop.run_in_executor(self.executor, self.community_selector.select, query)
+            log_event(log, "全局检索社区筛选", **stats)
+        return await loop.run_in_executor(self.executor, self._build_context, conversation_history, reports)
+
+    async def astream_search(
+            self,
+            query: str,
+            conversation_history: ConversationHistory | None = None,
+    ) -> AsyncGenerator:
+        """Yield the context records, MapProgress events during the map fan-out, the reduce tokens, then SearchUsage."""
+        context_chunks, context_records = await self.abuild_context(conversation_history, query)
+        yield context_records
+
+        # map calls queue behind interactive LLM calls in the shared scheduler
+        with priority(Priority.MAP):
+            tasks = [
+                asyncio.create_task(self._map_response_single_batch(context_data=data, query=query, **self.map_llm_params))
+                for data in context_chunks
+            ]
+        pending = set(tasks)
+        start = time.monotonic()
+        key_points = 0
+        reason = None
+        try:
+            yield MapProgress(completed=0, total=len(tasks))
+            while pending:
+                timeout = self.heartbeat_interval
+                if self.early_stop is not None:
+                    # wake at the deadline; past it (with nothing done yet) the first answer ends the wait
+                    remaining = start + self.early_stop.deadline - time.monotonic()
+                    if remaining > 0:
+                        timeout = min(timeout, remaining)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                yield MapProgress(completed=len(tasks) - len(pending), total=len(tasks))
+                if self.early_stop is None:
+                    continue
+                key_points += sum(self.early_stop.key_points(task.result()) for task in done)
+                reason = self.early_stop.reason(len(tasks) - len(pending), len(tasks), key_points, time.monotonic() - start)
+                if reason is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        # cancelled stragglers are left out; the reduce ranks whatever key points arrived
+        map_responses = [task.result() for task in tasks if task not in pending]
+        if self.early_stop is not None and tasks:
+            elapsed = time.monotonic() - start
+            stats = {
+                "reason": reason,
+                "total": len(tasks),
+                "completed": len(map_responses),
+                "skipped": len(pending),
+                "key_points": key_points,
+                "map_seconds": round(elapsed, 2),
+                # time the skipped calls would have needed at the completion rate seen so far
+                "saved_seconds_est": round(len(pending) * elapsed / max(1, len(map_responses)), 2),
+            }
+            self.early_stop.record(stats)
+            log_event(log, "全局检索 map 阶段结束", **stats)
+        # per-query copy whose LLM counts the reduce call (none when no key point scored)
+        reducer = copy.copy(self)
+        reducer.llm = _CountingLLM(self.llm, self.token_encoder)
+        async for response in reducer._stream_reduce_response(
+                map_responses=map_responses,
+                query=query,
+                **self.reduce_llm_params,
+        ):
+            yield response
+        yield SearchUsage(
+            llm_calls=sum(response.llm_calls for response in map_responses) + reducer.llm.calls,
+            prompt_tokens=sum(response.prompt_tokens for response in map_responses) + reducer.llm.prompt_tokens,
+        )
+
+    async def asearch(
+            self,
+            query: str,
+            conversation_history: ConversationHistory | None = None,
+            **kwargs: Any,
+    ) -> SearchResult:
+        """Collect the streamed answer into a single result."""
+        start_time = time.time()
+        context_records = None
+        usage = SearchUsage(llm_calls=0, prompt_tokens=0)
+        tokens = []
+        async for response in self.astream_search(query=query, conversation_history=conversation_history):
+            if isinstance(response, str):
+                tokens.append(response)
+            elif isinstance(response, SearchUsage):
+                usage = response
+            elif context_records is None and isinstance(response, dict):
+                context_records = response
+        return SearchResult(
+            response="".join(tokens),
+            context_data=context_records or {},
+            context_text="",
+            completion_time=time.time() - start_time,
+            llm_calls=usage.llm_calls,
+            prompt_tokens=usage.prompt_tokens,
+        )
@@ -0,0 +1,245 @@
+"""Token-budgeted conversation history with a cached running summary of older turns."""
+
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from graphrag.query.llm.base import BaseLLM
+
+from my_logging import log_event
+from my_prompt import HISTORY_SUMMARY_PROMPT
+from my_scheduler import Priority, priority
+
+log = logging.getLogger(__name__)
+
+# chat formats add a few tokens of framing per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@dataclass
+class Compaction:
+    """The compacted turns plus the token accounting for one request."""
+
+    turns: list[dict]
+    tokens_before: int
+    tokens_after: int
+    summarized: int = 0
+    summary_cached: bool = False
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class HistoryCompactor:
+    """Fits the history turns of a request into ``budget_tokens``.
+
+    Leading system messages and the final (current) message are always kept and are not counted
+    against the budget. When the turns in between do not fit, the oldest ones are replaced by a
+    running summary, inserted as a system message, and only the most recent turns that fit in
+    ``recent_tokens`` are kept verbatim.
+
+    Summaries are keyed by a hash chain over the summarized turns, so a conversation that grows
+    by one exchange reuses the summary of its earlier prefix: a later turn either fits with the
+    same split point (cache hit, no LLM call) or extends the cached summary with just the turns
+    that aged out since. The request never waits for a summary: without a cached one the older
+    turns are dropped for this turn, and the summary is generated in a background task at
+    ``Priority.BATCH`` (behind interactive and map calls) for the following turns to reuse.
+    Requests needing the same summary share one background call; if it fails, the older turns
+    stay dropped.
+
+    Token counts are cached per message content, so a growing conversation only tokenizes its
+    new messages; those, and the summary prompt, are tokenized in a worker thread rather than on
+    the event loop.
+    """
+
+    def __init__(
+            self,
+            llm: BaseLLM,
+            token_encoder: Any,
+            budget_tokens: int = 3000,
+            recent_tokens: int | None = None,
+            summary_max_tokens: int = 300,
+            summary_input_message_tokens: int = 1000,
+            max_entries: int = 1024,
+            max_counts: int = 65536,
+    ):
+        self.llm = llm
+        self.token_encoder = token_encoder
+        self.budget_tokens = budget_tokens
+        # leave headroom below the budget so the next few turns fit without a new summary
+        self.recent_tokens = recent_tokens if recent_tokens is not None else budget_tokens // 2
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_input_message_tokens = summary_input_message_tokens
+        self.max_entries = max_entries
+        self._summaries: OrderedDict[str, str] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self.max_counts = max_counts
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self.requests = 0
+        self.compacted = 0
+        self.summary_calls = 0
+        self.summary_hits = 0
+        self.summary_failures = 0
+        self.tokens_before = 0
+        self.tokens_saved = 0
+
+    async def compact(self, turns: list[dict]) -> Compaction:
+        self.requests += 1
+        head = 0
+        while head < len(turns) - 1 and turns[head]["role"] == "system":
+            head += 1
+        system, middle, last = turns[:head], turns[head:-1], turns[-1:]
+        counts = await self.counts(system + last + middle)
+        fixed, counts = sum(counts[:len(system) + len(last)]), counts[len(system) + len(last):]
+        before = fixed + sum(counts)
+        self.tokens_before += before
+        if sum(counts) <= self.budget_tokens:
+            return Compaction(turns, before, before)
+
+        chain = self._chain(system, middle)
+        # the earliest split point whose remaining turns fit; a cached summary at or after it is reused as is
+        fits = len(middle)
+        while fits > 0 and sum(counts[fits - 1:]) + self.summary_max_tokens <= self.budget_tokens:
+            fits -= 1
+        split = next((k for k in range(fits, len(middle) + 1) if chain[k] in self._summaries), None)
+        cached = split is not None
+        if cached:
+            self.summary_hits += 1
+            summary = self._get(chain[split])
+        else:
+            split = fits
+            while split < len(middle) and sum(counts[split:]) > self.recent_tokens:
+                split += 1
+            self._summarize_later(chain, middle, split)
+            summary = ""
+
+        recent = middle[split:]
+        compacted = list(system)
+        if summary:
+            compacted.append({"role": "system", "content": f"此前对话摘要：\n{summary}"})
+        compacted += recent + last
+        after = sum(await self.counts(compacted))
+        self.compacted += 1
+        self.tokens_saved += before - after
+        log_event(
+            log, "对话历史压缩",
+            messages_before=len(turns),
+            messages_after=len(compacted),
+            summarized=split,
+            summary_cached=cached,
+            tokens_before=before,
+            tokens_after=after,
+            tokens_saved=before - after,
+        )
+        return Compaction(compacted, before, after, summarized=split, summary_cached=cached)
+
+    def count(self, message: dict) -> int:
+        return len(self.token_encoder.encode(message.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+
+    async def counts(self, messages: list[dict]) -> list[int]:
+        """Token counts of ``messages``, tokenizing the ones not seen before off the event loop."""
+        keys = [hashlib.sha1((message.get("content") or "").encode()).digest() for message in messages]
+        known = {}
+        missing = {}
+        for key, message in zip(keys, messages):
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                known[key] = self._counts[key]
+            else:
+                missing[key] = message
+        if missing:
+            known.update(await asyncio.to_thread(lambda: {key: self.count(message) for key, message in missing.items()}))
+            for key in missing:
+                self._counts[key] = known[key]
+            while len(self._counts) > self.max_counts:
+                self._counts.popitem(last=False)
+        return [known[key] for key in keys]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "summaries": len(self._summaries),
+            "requests": self.requests,
+            "compacted": self.compacted,
+            "summary_calls": self.summary_calls,
+            "summary_hits": self.summary_hits,
+            "summary_failures": self.summary_failures,
+            "summaries_pending": len(self._pending),
+            "tokens_saved": self.tokens_saved,
+            "saved_rate": self.tokens_saved / self.tokens_before if self.tokens_before else 0.0,
+        }
+
+    def _summarize_later(self, chain: list[str], middle: list[dict], split: int) -> None:
+        key = chain[split]
+        if key in self._pending:
+            return
+        # the request goes on to use (and the local search may rewrite) its own message dicts
+        task = asyncio.create_task(self._extend_summary(chain, [dict(message) for message in middle[:split]], split))
+        self._pending[key] = task
+
+        def done(task: asyncio.Task) -> None:
+            self._pending.pop(key, None)
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                self.summary_failures += 1
+                log.warning(f"对话历史摘要失败，较早的 {split} 条消息继续直接丢弃: {str(task.exception())}")
+
+        task.add_done_callback(done)
+
+    async def _extend_summary(self, chain: list[str], middle: list[dict], split: int) -> str:
+        # continue from the longest prefix that already has a summary
+        start = next((k for k in range(split - 1, 0, -1) if chain[k] in self._summaries), 0)
+        previous = self._get(chain[start]) if start else ""
+        prompt = await asyncio.to_thread(self._prompt, previous, middle[start:split])
+        self.summary_calls += 1
+        with priority(Priority.BATCH):
+            summary = await self.llm.agenerate(
+                messages=[{"role": "user", "content": prompt}],
+                streaming=False,
+                max_tokens=self.summary_max_tokens,
+                temperature=0.0,
+            )
+        summary = (summary or "").strip()
+        if not summary:
+            raise ValueError("empty summary")
+        self._put(chain[split], summary)
+        return summary
+
+    def _prompt(self, previous: str, messages: list[dict]) -> str:
+        lines = [f"{message['role']}: {self._clip(message.get('content') or '')}" for message in messages]
+        return HISTORY_SUMMARY_PROMPT.format(
+            previous_summary=previous or "（无）",
+            conversation="\n\n".join(lines),
+            max_tokens=self.summary_max_tokens,
+        )
+
+    def _clip(self, text: str) -> str:
+        tokens = self.token_encoder.encode(text)
+        if len(tokens) <= self.summary_input_message_tokens:
+            return text
+        return self.token_encoder.decode(tokens[:self.summary_input_message_tokens]) + "……"
+
+    @staticmethod
+    def _chain(system: list[dict], middle: list[dict]) -> list[str]:
+        """``chain[k]`` identifies the system messages plus the first ``k`` history turns."""
+        digest = hashlib.sha1(json.dumps(system, ensure_ascii=False, sort_keys=True).encode())
+        chain = [digest.hexdigest()]
+        for message in middle:
+            digest.update(json.dumps([message.get("role"), message.get("content")], ensure_ascii=False).encode())
+            chain.append(digest.copy().hexdigest())
+        return chain
+
+    def _get(self, key: str) -> str:
+        self._summaries.move_to_end(key)
+        return self._summaries[key]
+
+    def _put(self, key: str, summary: str) -> None:
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
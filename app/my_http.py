@@ -0,0 +1,101 @@
+"""Shared pooled HTTP clients for the chat, embedding and web search backends."""
+
+import logging
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+except ImportError:
+    h2 = None
+
+log = logging.getLogger(__name__)
+
+
+class SharedHttpClients:
+    """One async and one sync httpx client shared by every upstream API client.
+
+    Each backend host gets its own mounted transport, so ``max_connections_per_host`` and the
+    keep-alive pool apply per host; any other host (e.g. a web search API) uses a default
+    transport with the same limits. HTTP/2 is negotiated over TLS when ``h2`` is installed. The
+    sync client serves the embedding calls made from worker threads.
+    """
+
+    def __init__(
+            self,
+            base_urls: list[str],
+            max_connections_per_host: int = 64,
+            max_keepalive_per_host: int = 32,
+            keepalive_expiry: float = 60.0,
+            connect_timeout: float = 5.0,
+            read_timeout: float = 120.0,
+            pool_timeout: float = 30.0,
+            http2: bool = True,
+    ):
+        self.http2 = http2 and h2 is not None
+        if http2 and h2 is None:
+            log.info("未安装 h2，上游连接使用 HTTP/1.1")
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_keepalive_per_host,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+        self.hosts = sorted({self._origin(url) for url in base_urls if url})
+        self.async_transports = {host: self._async_transport() for host in self.hosts}
+        self.async_transports["default"] = self._async_transport()
+        self.sync_transports = {host: self._sync_transport() for host in self.hosts}
+        self.sync_transports["default"] = self._sync_transport()
+        self.async_client = httpx.AsyncClient(
+            transport=self.async_transports["default"],
+            mounts={host: self.async_transports[host] for host in self.hosts},
+            timeout=self.timeout,
+        )
+        self.sync_client = httpx.Client(
+            transport=self.sync_transports["default"],
+            mounts={host: self.sync_transports[host] for host in self.hosts},
+            timeout=self.timeout,
+        )
+
+    def openai_clients(self, api_key: str, base_url: str | None, max_retries: int) -> tuple[OpenAI, AsyncOpenAI]:
+        """OpenAI clients on the shared pools, for ``set_clients`` on ChatOpenAI / OpenAIEmbedding."""
+        kwargs = {"api_key": api_key, "base_url": base_url or None, "timeout": self.timeout, "max_retries": max_retries}
+        return (
+            OpenAI(http_client=self.sync_client, **kwargs),
+            AsyncOpenAI(http_client=self.async_client, **kwargs),
+        )
+
+    def stats(self) -> dict[str, Any]:
+        """Connections (active/idle) and requests waiting for a connection, per host pool."""
+        return {
+            "http2": self.http2,
+            "async": {host: _pool_stats(transport) for host, transport in self.async_transports.items()},
+            "sync": {host: _pool_stats(transport) for host, transport in self.sync_transports.items()},
+        }
+
+    async def aclose(self) -> None:
+        await self.async_client.aclose()
+        self.sync_client.close()
+
+    def _async_transport(self) -> httpx.AsyncHTTPTransport:
+        return httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+
+    def _sync_transport(self) -> httpx.HTTPTransport:
+        return httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+
+def _pool_stats(transport: httpx.AsyncHTTPTransport | httpx.HTTPTransport) -> dict[str, int]:
+    pool = transport._pool
+    connections = pool.connections
+    idle = sum(1 for connection in connections if connection.is_idle())
+    # httpcore keeps in-flight and queued requests in one list; queued ones have no connection yet
+    waiting = sum(1 for request in getattr(pool, "_requests", []) if request.is_queued())
+    return {"active": len(connections) - idle, "idle": idle, "waiting": waiting}
@@ -0,0 +1,93 @@
+"""Index generations: one loaded index version plus the search engines built on top of it."""
+
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+log = logging.getLogger(__name__)
+
+
+class IndexGeneration:
+    """Reference-counted holder for the engines of one index version.
+
+    Requests acquire the generation that is current when they start and release it when their
+    response (including a streamed body) is finished. A retired generation is closed, and its
+    engines dropped, once the last in-flight request releases it; refcounting then frees the
+    index. Requests still running when the drain timeout expires are only logged, never cut off.
+    """
+
+    def __init__(
+            self,
+            version: str,
+            local_search_engine: Any,
+            global_search_engine: Any,
+            question_generator: Any,
+            load_time: float = 0.0,
+            memory_bytes: int = 0,
+            fact_index: Any = None,
+    ):
+        self.version = version
+        self.local_search_engine = local_search_engine
+        self.global_search_engine = global_search_engine
+        self.question_generator = question_generator
+        self.load_time = load_time
+        self.memory_bytes = memory_bytes
+        self.fact_index = fact_index
+        self.created = time.time()
+        self.active = 0
+        self.retired = False
+        self.closed = False
+        self._drain_handle: asyncio.TimerHandle | None = None
+
+    def acquire(self) -> "IndexGeneration":
+        self.active += 1
+        return self
+
+    def release(self) -> None:
+        self.active -= 1
+        if self.retired and self.active <= 0:
+            self.close()
+
+    async def release_after(self, iterator: AsyncIterator) -> AsyncIterator:
+        """Pass a streamed body through and release the generation when it ends or is abandoned."""
+        try:
+            async for item in iterator:
+                yield item
+        finally:
+            self.release()
+
+    def retire(self, drain_timeout: float | None = None) -> None:
+        """Stop handing out this generation; close it once drained."""
+        self.retired = True
+        if self.active <= 0:
+            self.close()
+        elif drain_timeout:
+            self._drain_handle = asyncio.get_running_loop().call_later(drain_timeout, self._drain_expired)
+
+    def _drain_expired(self) -> None:
+        self._drain_handle = None
+        if not self.closed:
+            log.warning("索引版本 %s 超过等待时间仍有 %d 个请求，待其结束后释放", self.version, self.active)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self._drain_handle is not None:
+            self._drain_handle.cancel()
+        self.closed = True
+        self.local_search_engine = None
+        self.global_search_engine = None
+        self.question_generator = None
+        log.info("索引版本 %s 已释放", self.version)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "version": self.version,
+            "active_requests": self.active,
+            "load_seconds": round(self.load_time, 3),
+            "memory_mb": round(self.memory_bytes / 2 ** 20, 1),
+            "facts": len(self.fact_index) if self.fact_index is not None else 0,
+            "age_seconds": round(time.time() - self.created, 1),
+        }
@@ -0,0 +1,125 @@
+"""Chat model that records the token usage, including prefix-cache hits, reported by the backend."""
+
+import logging
+from collections.abc import AsyncGenerator
+from typing import Any
+
+from graphrag.query.llm.base import BaseLLMCallback
+from graphrag.query.llm.oai.chat_openai import ChatOpenAI
+
+from my_logging import log_event
+from my_scheduler import reported_usage
+
+log = logging.getLogger(__name__)
+
+
+def cached_prompt_tokens(usage: Any) -> int | None:
+    """Prompt tokens served from the provider's prefix cache, or None if the backend does not say.
+
+    OpenAI-style backends report ``prompt_tokens_details.cached_tokens``; DeepSeek-style ones
+    report ``prompt_cache_hit_tokens``.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None and getattr(details, "cached_tokens", None) is not None:
+        return details.cached_tokens
+    extra = getattr(usage, "model_extra", None) or {}
+    if extra.get("prompt_cache_hit_tokens") is not None:
+        return extra["prompt_cache_hit_tokens"]
+    return None
+
+
+class UsageTrackingChatOpenAI(ChatOpenAI):
+    """ChatOpenAI that asks for usage on streamed calls and keeps running totals.
+
+    With ``stream_usage`` the streamed request sets ``stream_options.include_usage`` and the
+    trailing usage chunk is read instead of being skipped. Every call that reports usage is
+    logged with its prompt, cached and completion tokens, and published through
+    ``reported_usage`` so the scheduler can settle the call's token reservation.
+    """
+
+    def __init__(self, *args: Any, stream_usage: bool = True, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.stream_usage = stream_usage
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.calls_reporting_cache = 0
+
+    async def _agenerate(
+            self,
+            messages: str | list[Any],
+            streaming: bool = True,
+            callbacks: list[BaseLLMCallback] | None = None,
+            **kwargs: Any,
+    ) -> str:
+        if streaming:
+            return "".join([delta async for delta in self._astream_generate(messages, callbacks=callbacks, **kwargs)])
+        response = await self.async_client.chat.completions.create(  # type: ignore
+            model=self._model(),
+            messages=messages,  # type: ignore
+            stream=False,
+            **kwargs,
+        )
+        self.record(response.usage)
+        return response.choices[0].message.content or ""
+
+    async def _astream_generate(
+            self,
+            messages: str | list[Any],
+            callbacks: list[BaseLLMCallback] | None = None,
+            **kwargs: Any,
+    ) -> AsyncGenerator[str, None]:
+        if self.stream_usage:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        response = await self.async_client.chat.completions.create(  # type: ignore
+            model=self._model(),
+            messages=messages,  # type: ignore
+            stream=True,
+            **kwargs,
+        )
+        async for chunk in response:
+            if not chunk:
+                continue
+            if getattr(chunk, "usage", None):
+                self.record(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content if chunk.choices[0].delta and chunk.choices[0].delta.content else ""
+            yield delta
+            if callbacks:
+                for callback in callbacks:
+                    callback.on_llm_new_token(delta)
+
+    def record(self, usage: Any) -> None:
+        if usage is None:
+            return
+        cached = cached_prompt_tokens(usage)
+        reported_usage.set((usage.prompt_tokens or 0, usage.completion_tokens or 0))
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        if cached is not None:
+            self.calls_reporting_cache += 1
+            self.cached_tokens += cached
+        log_event(
+            log, "大模型用量",
+            prompt_tokens=usage.prompt_tokens,
+            cached_tokens=cached,
+            completion_tokens=usage.completion_tokens,
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "calls_reporting_cache": self.calls_reporting_cache,
+            "cached_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+        }
+
+    def _model(self) -> str:
+        if not self.model:
+            raise ValueError("model is required")
+        return self.model
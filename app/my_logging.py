@@ -0,0 +1,146 @@
+"""Structured, queue-based logging: records are formatted and written off the event loop."""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any
+
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+_payload_sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("payload_sampled", default=False)
+
+_payload_sample_rate = 0.0
+_payload_max_chars = 20_000
+_listener: logging.handlers.QueueListener | None = None
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues the record as is; message interpolation and formatting happen on the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the request id lives in a context variable, so read it here on the calling thread
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request id and structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update((key, value) for key, value in fields.items() if value is not None)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text layout with structured fields appended as key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None) or {}
+        extras = [f"{key}={value}" for key, value in fields.items() if value is not None]
+        if getattr(record, "request_id", None):
+            extras.insert(0, f"request_id={record.request_id}")
+        return f"{text} {' '.join(extras)}" if extras else text
+
+
+def setup_logging(
+        level: str = "INFO",
+        fmt: str = "json",
+        payload_sample_rate: float = 0.0,
+        payload_max_chars: int = 20_000,
+        library_level: str = "WARNING",
+) -> None:
+    """Route all logging through a queue to a single stderr writer thread.
+
+    ``library_level`` applies to the graphrag and httpx loggers, which otherwise log every map
+    response and upstream request at INFO.
+    """
+    global _payload_sample_rate, _payload_max_chars, _listener
+    _payload_sample_rate = payload_sample_rate
+    _payload_max_chars = payload_max_chars
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    queue_handler = _DeferredQueueHandler(log_queue)
+    root.addHandler(queue_handler)
+    # the writer thread does not survive fork(); prefork workers start their own
+    os.register_at_fork(after_in_child=lambda: _restart_listener(queue_handler, stream_handler))
+    root.setLevel(level)
+    for name in ("graphrag", "httpx", "httpcore", "openai"):
+        logging.getLogger(name).setLevel(library_level)
+
+
+def _restart_listener(queue_handler: logging.handlers.QueueHandler, handler: logging.Handler) -> None:
+    global _listener
+    queue_handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def start_request(request_id: str) -> None:
+    """Tag the current task's records with ``request_id`` and decide whether to capture its payloads."""
+    request_id_var.set(request_id)
+    _payload_sampled_var.set(_payload_sample_rate > 0 and random.random() < _payload_sample_rate)
+
+
+def payload(value: Any) -> Any:
+    """``value`` (strings truncated) if the current request is sampled for payload capture, else None.
+
+    ``value`` may be a zero-argument callable, so a payload that has to be built (e.g. copied out
+    of the request) is only built for sampled requests.
+    """
+    if not _payload_sampled_var.get():
+        return None
+    if callable(value):
+        value = value()
+    if isinstance(value, str) and len(value) > _payload_max_chars:
+        return value[:_payload_max_chars] + f"...(+{len(value) - _payload_max_chars})"
+    return value
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """Log ``event`` with structured ``fields``; fields that are None are dropped."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+class Timer:
+    """Milliseconds since construction, for duration fields."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000, 1)
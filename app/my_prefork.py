@@ -0,0 +1,165 @@
+"""Pre-fork multi-process serving: load the index once in the parent, fork uvicorn workers that share it."""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from collections.abc import Callable
+
+import uvicorn
+
+log = logging.getLogger(__name__)
+
+# pid of the supervising parent, inherited by the workers; None when not serving prefork
+_supervisor_pid: int | None = None
+
+
+def supervisor_pid() -> int | None:
+    """The prefork parent of this worker, or None in single-process mode."""
+    return _supervisor_pid
+
+
+def request_reload() -> None:
+    """Ask the prefork parent to reload the index and replace every worker (SIGHUP)."""
+    os.kill(_supervisor_pid, signal.SIGHUP)
+
+
+def serve_prefork(
+        app,
+        host: str,
+        port: int,
+        workers: int,
+        preload: Callable[[], None] | None = None,
+        version: Callable[[], str] | None = None,
+        watch_interval: float = 0.0,
+        **uvicorn_kwargs,
+) -> None:
+    """Run ``workers`` uvicorn processes on one listening socket.
+
+    ``preload`` runs in the parent before forking, so whatever it loads is shared copy-on-write by
+    every worker. The parent freezes the GC afterwards so collections in the workers do not write
+    to (and thereby copy) the pages holding those objects, then supervises the workers and
+    restarts any that die until it receives SIGINT/SIGTERM.
+
+    Reloads are coordinated by the parent, since a worker reloading on its own would serve a
+    private copy (or leave the others on the old index). On SIGHUP, or when ``version()`` has
+    changed and read the same on two polls ``watch_interval`` seconds apart, the parent runs
+    ``preload`` again, forks a fresh set of workers and sends SIGTERM to the old ones, which
+    finish their in-flight requests while the new ones accept connections. If the preload
+    fails, the old workers keep serving.
+    """
+    global _supervisor_pid
+    if preload is not None:
+        preload()
+    gc.collect()
+    gc.freeze()
+    _supervisor_pid = os.getpid()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children: dict[int, int] = {}
+    retiring: set[int] = set()
+    stopping = False
+    reload_requested = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # worker: restore default signal handling and let uvicorn install its own
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            config = uvicorn.Config(app, host=host, port=port, **uvicorn_kwargs)
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            finally:
+                os._exit(0)
+        children[pid] = slot
+        log.info("worker %d 已启动 (pid=%d)", slot, pid)
+
+    def terminate(pids) -> None:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        terminate(list(children) + list(retiring))
+
+    def hangup(signum, frame):
+        nonlocal reload_requested
+        reload_requested = True
+
+    def roll() -> None:
+        log.info("正在重新加载索引并替换 worker")
+        try:
+            if preload is not None:
+                preload()
+        except Exception:
+            log.exception("重新加载索引失败，继续使用当前 worker")
+            return
+        gc.collect()
+        gc.freeze()
+        old = dict(children)
+        children.clear()
+        retiring.update(old)
+        for slot in sorted(old.values()):
+            spawn(slot)
+        terminate(old)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, hangup)
+    for slot in range(workers):
+        spawn(slot)
+
+    current = version() if version is not None and watch_interval > 0 else None
+    pending = None
+    next_poll = time.monotonic() + watch_interval
+    while children or retiring:
+        if reload_requested and not stopping:
+            reload_requested = False
+            pending = None
+            roll()
+            current = version() if current is not None else None
+        if current is not None and not stopping and time.monotonic() >= next_poll:
+            next_poll = time.monotonic() + watch_interval
+            try:
+                seen = version()
+            except Exception:
+                log.exception("读取索引版本失败")
+                seen = current
+            if seen == current:
+                pending = None
+            elif seen == pending:
+                reload_requested = True
+            else:
+                pending = seen
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        if pid in retiring:
+            retiring.discard(pid)
+            continue
+        slot = children.pop(pid, None)
+        if slot is None:
+            continue
+        if not stopping:
+            log.warning("worker %d (pid=%d) 退出，状态 %d，正在重启", slot, pid, status)
+            time.sleep(1)
+            spawn(slot)
+    sock.close()
+    log.info("所有 worker 已退出")
@@ -1,10 +1,6 @@
-"""Local search system prompts."""
-
-LOCAL_SEARCH_SYSTEM_PROMPT = """
----Role---
-
-{role}
+"""Local search system prompts and the conversation history summary prompt."""
 
+LOCAL_SEARCH_INSTRUCTIONS = """
 ---Goal---
 
 Generate a response of the target length and format that responds to the user's question, summarizing all information in the input data tables appropriate for the response length and format, and incorporating any relevant general knowledge.
@@ -25,8 +21,37 @@ When answering questions, the responses must be comprehensive, precise, and conc
 
 Add sections and commentary to the response as appropriate for the length and format. Style the response in markdown.
 
----Data tables---
+"""
+
+LOCAL_SEARCH_ROLE_SECTION = """---Role---
+
+{role}
+"""
+
+LOCAL_SEARCH_CONTEXT_SECTION = """---Data tables---
 
 {context_data}
+"""
+
+# role first and data tables last, rendered into a single system message
+LOCAL_SEARCH_SYSTEM_PROMPT = (
+    "\n" + LOCAL_SEARCH_ROLE_SECTION + LOCAL_SEARCH_INSTRUCTIONS + LOCAL_SEARCH_CONTEXT_SECTION + "\n"
+)
+
+
+HISTORY_SUMMARY_PROMPT = """
+请把下面的对话内容与已有摘要合并为一份新的对话摘要，供后续回答参考。
+
+要求：
+- 保留用户的身份、需求、提到的产品和型号、联系方式，以及助手已经给出的关键结论
+- 省略寒暄、重复内容和大段原文，只保留要点
+- 使用中文，不超过 {max_tokens} 个 token，直接输出摘要正文
+
+---已有摘要---
+
+{previous_summary}
+
+---新增对话---
 
+{conversation}
 """
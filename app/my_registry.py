@@ -0,0 +1,149 @@
+"""Index registry: lazily loaded index generations for many sites, evicted LRU under a memory budget."""
+
+import asyncio
+import logging
+import sys
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import numpy as np
+
+from my_index import IndexGeneration
+
+log = logging.getLogger(__name__)
+
+
+class IndexRegistry:
+    """Generations keyed by index directory.
+
+    A directory is loaded on its first request; concurrent first requests (and reloads) for the
+    same directory share one load. After each load the least recently used generations are
+    retired until the estimated memory of the loaded indexes fits ``memory_budget`` (0 disables
+    eviction). Retired generations are closed once their in-flight requests finish.
+    """
+
+    def __init__(
+            self,
+            load: Callable[[str], Awaitable[IndexGeneration]],
+            fingerprint: Callable[[str], str],
+            memory_budget: int = 0,
+            drain_timeout: float | None = None,
+            on_retire: Callable[[IndexGeneration], None] | None = None,
+    ):
+        self._load = load
+        self._fingerprint = fingerprint
+        self.memory_budget = memory_budget
+        self.drain_timeout = drain_timeout
+        self.on_retire = on_retire
+        self._generations: OrderedDict[str, IndexGeneration] = OrderedDict()
+        self._loading: dict[str, asyncio.Task] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def loaded(self) -> dict[str, IndexGeneration]:
+        return dict(self._generations)
+
+    def memory_bytes(self) -> int:
+        return sum(generation.memory_bytes for generation in self._generations.values())
+
+    async def acquire(self, input_dir: str) -> IndexGeneration:
+        """Return the current generation for ``input_dir`` (loading it if needed), already acquired."""
+        while True:
+            generation = self._generations.get(input_dir)
+            if generation is None:
+                generation = await asyncio.shield(self._start_load(input_dir))
+            # the generation may have been replaced or evicted while this request waited
+            if self._generations.get(input_dir) is generation:
+                self._generations.move_to_end(input_dir)
+                return generation.acquire()
+
+    async def reload(self, input_dir: str, force: bool = False) -> IndexGeneration:
+        """Load a new version of ``input_dir`` and swap it in, unless the files are unchanged."""
+        current = self._generations.get(input_dir)
+        if not force and current is not None and input_dir not in self._loading:
+            version = await asyncio.to_thread(self._fingerprint, input_dir)
+            if version == current.version:
+                log.info("索引 %s 版本未变化: %s", input_dir, version)
+                return current
+        return await asyncio.shield(self._start_load(input_dir))
+
+    def _start_load(self, input_dir: str) -> asyncio.Task:
+        task = self._loading.get(input_dir)
+        if task is None:
+            task = asyncio.create_task(self._load_and_install(input_dir))
+            self._loading[input_dir] = task
+            task.add_done_callback(lambda _: self._loading.pop(input_dir, None))
+        return task
+
+    async def _load_and_install(self, input_dir: str) -> IndexGeneration:
+        log.info("正在加载索引: %s", input_dir)
+        generation = await self._load(input_dir)
+        self.loads += 1
+        previous = self._generations.pop(input_dir, None)
+        self._generations[input_dir] = generation
+        if previous is not None:
+            self._retire(previous)
+        log.info(
+            "索引 %s 已加载: 版本 %s，耗时 %.2f 秒，估算内存 %.1f MB",
+            input_dir, generation.version, generation.load_time, generation.memory_bytes / 2 ** 20,
+        )
+        self._evict(keep=input_dir)
+        return generation
+
+    def _evict(self, keep: str) -> None:
+        if self.memory_budget <= 0:
+            return
+        while self.memory_bytes() > self.memory_budget:
+            victim = next((input_dir for input_dir in self._generations if input_dir != keep), None)
+            if victim is None:
+                log.warning("索引 %s 单独已超出内存预算 %.1f MB", keep, self.memory_budget / 2 ** 20)
+                return
+            log.info("内存超出预算，淘汰最久未使用的索引: %s", victim)
+            self._retire(self._generations.pop(victim))
+            self.evictions += 1
+
+    def _retire(self, generation: IndexGeneration) -> None:
+        generation.retire(drain_timeout=self.drain_timeout)
+        if self.on_retire is not None:
+            self.on_retire(generation)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "loaded": {input_dir: generation.stats() for input_dir, generation in self._generations.items()},
+            "loading": list(self._loading),
+            "memory_mb": round(self.memory_bytes() / 2 ** 20, 1),
+            "memory_budget_mb": round(self.memory_budget / 2 ** 20, 1),
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+def estimate_index_bytes(*collections: Any) -> int:
+    """Rough resident size of loaded index objects (lists of model objects or dicts of such lists).
+
+    Counts each object, its strings, nested lists/dicts and embedding vectors; it is meant for
+    comparing indexes against a budget, not as an exact measurement.
+    """
+    total = 0
+    for collection in collections:
+        items = collection.values() if isinstance(collection, dict) else [collection]
+        for objects in items:
+            for obj in objects or []:
+                total += sys.getsizeof(obj) + sum(_value_bytes(value) for value in vars(obj).values())
+    return total
+
+
+def _value_bytes(value: Any) -> int:
+    if value is None or isinstance(value, (bool, int, float)):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], float):
+            # list of Python floats: pointer plus float object per element
+            return sys.getsizeof(value) + 24 * len(value)
+        return sys.getsizeof(value) + sum(_value_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_value_bytes(k) + _value_bytes(v) for k, v in value.items())
+    return sys.getsizeof(value)
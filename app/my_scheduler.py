@@ -0,0 +1,290 @@
+"""Admission control and priority scheduling for upstream LLM calls."""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections.abc import AsyncGenerator, Callable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+from graphrag.query.llm.base import BaseLLM, BaseLLMCallback
+
+log = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Scheduling classes; lower values are served first."""
+
+    INTERACTIVE = 0
+    MAP = 1
+    BATCH = 2
+
+
+# priority of LLM calls made in the current task; tasks created inside inherit it
+llm_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+# called when the scheduler grants an LLM call made in the current task, e.g. to start a latency clock
+on_grant: contextvars.ContextVar[Callable[[], None] | None] = contextvars.ContextVar("llm_on_grant", default=None)
+
+
+# (prompt, completion) tokens the backend reported for the last LLM call made in the current task
+reported_usage: contextvars.ContextVar[tuple[int, int] | None] = contextvars.ContextVar("llm_reported_usage", default=None)
+
+
+@contextmanager
+def priority(value: Priority):
+    """Run the LLM calls made (and tasks created) inside the block at ``value`` priority."""
+    token = llm_priority.set(value)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+class LLMOverloaded(Exception):
+    """Raised when a call is rejected because the queue is full or its queue deadline passed."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+class LLMScheduler:
+    """Shared gate in front of the chat model.
+
+    At most ``max_concurrency`` calls run at once and, when ``tokens_per_minute`` is set, calls
+    reserve their estimated prompt plus completion tokens from a token bucket refilled at that
+    rate. Waiting calls are served strictly by priority class, FIFO within a class. Each class
+    has a queue deadline after which the call fails with ``LLMOverloaded``; interactive calls
+    are also rejected immediately once ``max_queue`` interactive calls are waiting. Waiting map
+    and batch calls do not count towards that limit, since interactive calls are served before
+    them.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 16,
+            tokens_per_minute: int = 0,
+            max_queue: int = 256,
+            queue_timeouts: dict[Priority, float] | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.queue_timeouts = queue_timeouts or {
+            Priority.INTERACTIVE: 30.0,
+            Priority.MAP: 60.0,
+            Priority.BATCH: 120.0,
+        }
+        self.active = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._queue: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._hold_time = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+
+    def admit(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Fail fast at request entry when the calls queued ahead of ``priority`` already fill the queue."""
+        ahead = self._queued_ahead(priority)
+        if ahead >= self.max_queue:
+            self.rejected += 1
+            raise LLMOverloaded("LLM queue is full", self.retry_after(ahead))
+
+    def retry_after(self, queued: int | None = None) -> int:
+        """Seconds until ``queued`` calls (default: the whole queue) are expected to drain."""
+        queued = len(self._queue) if queued is None else queued
+        return max(1, math.ceil(queued * self._hold_time / max(1, self.max_concurrency)))
+
+    def _queued_ahead(self, priority: Priority) -> int:
+        return sum(1 for waiter in self._queue if waiter.priority <= priority)
+
+    async def acquire(self, tokens: int, priority: Priority) -> None:
+        self._refill()
+        if not self._queue and self.active < self.max_concurrency and self._has_tokens(tokens):
+            self._start(tokens)
+            return
+        if priority == Priority.INTERACTIVE:
+            self.admit()
+        waiter = _Waiter(priority, next(self._seq), tokens, asyncio.get_running_loop().create_future(), time.monotonic())
+        heapq.heappush(self._queue, waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeouts[priority])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # granted at the same moment: give the slot back
+                self.release(tokens)
+            else:
+                waiter.future.cancel()
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            raise LLMOverloaded(f"LLM queue deadline exceeded ({priority.name})", self.retry_after()) from None
+        self.wait_total += time.monotonic() - waiter.enqueued
+
+    def release(self, refund_tokens: int = 0, hold_time: float | None = None) -> None:
+        # a negative refund charges a call that used more than it reserved
+        self.active -= 1
+        if self.tokens_per_minute:
+            self._tokens = min(float(self.tokens_per_minute), self._tokens + refund_tokens)
+        if hold_time is not None:
+            self._hold_time = 0.9 * self._hold_time + 0.1 * hold_time
+        self._dispatch()
+
+    def _start(self, tokens: int) -> None:
+        self.active += 1
+        self.admitted += 1
+        if self.tokens_per_minute:
+            self._tokens -= tokens
+
+    def _has_tokens(self, tokens: int) -> bool:
+        # a call larger than the whole bucket runs once the bucket is full
+        return not self.tokens_per_minute or self._tokens >= min(tokens, self.tokens_per_minute)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute / 60
+            self._tokens = min(float(self.tokens_per_minute), self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+
+    def _dispatch(self) -> None:
+        self._refill()
+        while self._queue and self.active < self.max_concurrency:
+            head = self._queue[0]
+            if not self._has_tokens(head.tokens):
+                self._schedule_refill(min(head.tokens, self.tokens_per_minute))
+                return
+            heapq.heappop(self._queue)
+            self._start(head.tokens)
+            head.future.set_result(None)
+
+    def _schedule_refill(self, needed: int) -> None:
+        if self._timer is not None:
+            return
+        delay = (needed - self._tokens) / (self.tokens_per_minute / 60)
+
+        def fire():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(max(delay, 0.01), fire)
+
+    def stats(self) -> dict[str, Any]:
+        self._refill()
+        return {
+            "active": self.active,
+            "queued": {p.name.lower(): sum(1 for w in self._queue if w.priority == p) for p in Priority},
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_queue_wait_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "avg_call_seconds": round(self._hold_time, 2),
+            "tokens_available": round(self._tokens) if self.tokens_per_minute else None,
+        }
+
+
+class ScheduledLLM(BaseLLM):
+    """Chat model wrapper that runs every async call through an ``LLMScheduler``.
+
+    The priority comes from ``llm_priority``. The reservation is the prompt tokens plus the
+    requested ``max_tokens``, with the prompt estimated from its length at ``chars_per_token``
+    so that nothing is tokenized on the event loop. When the call finishes the reservation is
+    settled against the usage the backend reported through ``reported_usage``, or against the
+    same estimate (one token per streamed delta) if it reported none: unused tokens are
+    refunded and any excess is charged. The ``on_grant`` callback,
+    if set, runs once the call leaves the queue. Sync calls are passed through unscheduled.
+    """
+
+    def __init__(self, llm: BaseLLM, scheduler: LLMScheduler, chars_per_token: float = 2.0,
+                 default_max_tokens: int = 1000):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.chars_per_token = chars_per_token
+        self.default_max_tokens = default_max_tokens
+
+    def generate(self, messages: str | list[Any], streaming: bool = True,
+                 callbacks: list[BaseLLMCallback] | None = None, **kwargs: Any) -> str:
+        return self.llm.generate(messages, streaming=streaming, callbacks=callbacks, **kwargs)
+
+    def stream_generate(self, messages: str | list[Any],
+                        callbacks: list[BaseLLMCallback] | None = None, **kwargs: Any):
+        return self.llm.stream_generate(messages, callbacks=callbacks, **kwargs)
+
+    async def agenerate(self, messages: str | list[Any], streaming: bool = True,
+                        callbacks: list[BaseLLMCallback] | None = None, **kwargs: Any) -> str:
+        prompt_tokens, reserved = self._reserve(messages, kwargs)
+        await self.scheduler.acquire(reserved, llm_priority.get())
+        self._granted()
+        reported_usage.set(None)
+        start = time.monotonic()
+        response = ""
+        try:
+            response = await self.llm.agenerate(messages, streaming=streaming, callbacks=callbacks, **kwargs)
+            return response
+        finally:
+            used = self._used(prompt_tokens, self._estimate(response or ""))
+            self.scheduler.release(reserved - used, time.monotonic() - start)
+
+    async def astream_generate(self, messages: str | list[Any],
+                               callbacks: list[BaseLLMCallback] | None = None, **kwargs: Any) -> AsyncGenerator[str, None]:
+        prompt_tokens, reserved = self._reserve(messages, kwargs)
+        await self.scheduler.acquire(reserved, llm_priority.get())
+        self._granted()
+        reported_usage.set(None)
+        start = time.monotonic()
+        completion = 0
+        try:
+            async for token in self.llm.astream_generate(messages, callbacks=callbacks, **kwargs):
+                completion += 1
+                yield token
+        finally:
+            # one streamed delta is roughly one token
+            used = self._used(prompt_tokens, completion)
+            self.scheduler.release(reserved - used, time.monotonic() - start)
+
+    @staticmethod
+    def _granted() -> None:
+        callback = on_grant.get()
+        if callback is not None:
+            callback()
+
+    @staticmethod
+    def _used(prompt_tokens: int, completion_tokens: int) -> int:
+        usage = reported_usage.get()
+        if usage is not None:
+            return sum(usage)
+        return prompt_tokens + completion_tokens
+
+    def _estimate(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def _reserve(self, messages: str | list[Any], kwargs: dict) -> tuple[int, int]:
+        if isinstance(messages, str):
+            prompt_tokens = self._estimate(messages)
+        else:
+            prompt_tokens = sum(self._estimate(str(message.get("content", ""))) for message in messages)
+        return prompt_tokens, prompt_tokens + int(kwargs.get("max_tokens") or self.default_max_tokens)
@@ -3,13 +3,19 @@
 
 """LocalSearch implementation."""
 
+import asyncio
 import logging
+import re
+import threading
 import time
 from collections.abc import AsyncGenerator
+from concurrent.futures import Executor
+from functools import partial
 from typing import Any
-import json
+import pandas as pd
 import tiktoken
 
+from graphrag.model import Entity
 from graphrag.query.context_builder.builders import LocalContextBuilder
 from graphrag.query.context_builder.conversation_history import (
     ConversationHistory,
@@ -17,8 +23,14 @@ from graphrag.query.context_builder.conversation_history import (
 from graphrag.query.llm.base import BaseLLM, BaseLLMCallback
 from graphrag.query.llm.text_utils import num_tokens
 from graphrag.query.structured_search.base import BaseSearch, SearchResult
+from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
 
+from my_context import AdaptiveContext
+from my_logging import log_event, payload
 from my_prompt import (
+    LOCAL_SEARCH_CONTEXT_SECTION,
+    LOCAL_SEARCH_INSTRUCTIONS,
+    LOCAL_SEARCH_ROLE_SECTION,
     LOCAL_SEARCH_SYSTEM_PROMPT,
 )
 
@@ -27,11 +39,71 @@ DEFAULT_LLM_PARAMS = {
     "temperature": 0.0,
 }
 
+DEFAULT_ROLE = 'You are a helpful assistant responding to questions about data in the tables provided.'
+
 log = logging.getLogger(__name__)
 
 
+def sort_context_tables(context_text: str, column_delimiter: str = "|") -> str:
+    """Order the rows of every ``-----Section-----`` table by their numeric id.
+
+    Rows that tie on rank (and rows built from sets upstream) otherwise come out in an order
+    that varies between processes, so the same retrieval would render different prompt bytes.
+    A row starts with ``<id><delimiter>``; other lines (multi-line text) belong to the row above.
+    """
+    row_start = re.compile(rf"^(\d+){re.escape(column_delimiter)}")
+    lines: list[str] = []
+    rows: list[list[str]] = []
+
+    def flush():
+        trailing = []
+        while rows and len(rows[-1]) > 1 and rows[-1][-1] == "":
+            trailing.append(rows[-1].pop())
+        for row in sorted(rows, key=lambda row: int(row_start.match(row[0]).group(1))):
+            lines.extend(row)
+        lines.extend(trailing)
+        rows.clear()
+
+    for line in context_text.split("\n"):
+        if line.startswith("-----") and line.endswith("-----"):
+            flush()
+            lines.append(line)
+        elif row_start.match(line):
+            rows.append([line])
+        elif rows:
+            rows[-1].append(line)
+        else:
+            lines.append(line)
+    flush()
+    return "\n".join(lines)
+
+
+class ThreadSafeMixedContext(LocalSearchMixedContext):
+    """LocalSearchMixedContext that can be shared by several context-building threads.
+
+    The upstream community step temporarily writes a "matches" attribute onto the shared
+    community report objects, so concurrent builds would race on it; serialise that step only.
+    Pass the global search engine's ``community_lock`` when both use the same reports, since the
+    global build reads and writes the same attributes.
+    """
+
+    def __init__(self, *args, community_lock: "threading.Lock | None" = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._community_lock = community_lock or threading.Lock()
+
+    def _build_community_context(self, selected_entities: list[Entity], **kwargs) -> tuple[str, dict[str, pd.DataFrame]]:
+        with self._community_lock:
+            return super()._build_community_context(selected_entities=selected_entities, **kwargs)
+
+
 class LocalSearch(BaseSearch):
-    """Search orchestration for local search mode."""
+    """Search orchestration for local search mode.
+
+    ``prompt_layout="prefix"`` sends the static instructions first, then the role and the data
+    tables as a second system message, followed by the conversation, so the leading tokens are
+    byte-identical across requests and can hit the provider's prefix cache. ``"legacy"`` renders
+    everything into the original single system prompt.
+    """
 
     def search(self, query: str, conversation_history: ConversationHistory | None = None, **kwargs) -> SearchResult:
         pass
@@ -46,6 +118,9 @@ class LocalSearch(BaseSearch):
             callbacks: list[BaseLLMCallback] | None = None,
             llm_params: dict[str, Any] = DEFAULT_LLM_PARAMS,
             context_builder_params: dict | None = None,
+            executor: Executor | None = None,
+            prompt_layout: str = "legacy",
+            adaptive_context: AdaptiveContext | None = None,
     ):
         super().__init__(
             llm=llm,
@@ -57,6 +132,39 @@ class LocalSearch(BaseSearch):
         self.system_prompt = system_prompt
         self.callbacks = callbacks
         self.response_type = response_type
+        self.executor = executor
+        self.prompt_layout = prompt_layout
+        self.adaptive_context = adaptive_context
+        self.instructions = LOCAL_SEARCH_INSTRUCTIONS.format(response_type=response_type)
+
+    async def aembed_query(self, query: str) -> list[float]:
+        """Embed the query on the executor; the context builder's embedder memoizes it for the following build."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.context_builder.text_embedder.embed, query)
+
+    async def abuild_context(
+            self,
+            query: str,
+            conversation_history: ConversationHistory | None = None,
+    ) -> tuple[str | list[str], dict[str, pd.DataFrame]]:
+        """Run the blocking context builder (query embedding, vector lookup, ranking, token counting) on the executor."""
+        loop = asyncio.get_running_loop()
+        if self.adaptive_context is not None:
+            context_text, context_records, stats = await loop.run_in_executor(
+                self.executor,
+                partial(self.adaptive_context.build, self.context_builder, query, conversation_history, self.context_builder_params),
+            )
+            log_event(log, "本地检索上下文", **stats)
+            return context_text, context_records
+        return await loop.run_in_executor(
+            self.executor,
+            partial(
+                self.context_builder.build_context,
+                query=query,
+                conversation_history=conversation_history,
+                **self.context_builder_params,
+            ),
+        )
 
     async def asearch(
             self,
@@ -67,10 +175,9 @@ class LocalSearch(BaseSearch):
         """Build local search context that fits a single context window and generate answer for the user query."""
         start_time = time.time()
         search_prompt = ""
-        context_text, context_records = self.context_builder.build_context(
+        context_text, context_records = await self.abuild_context(
             query=query,
             conversation_history=conversation_history,
-            **self.context_builder_params,
         )
         try:
             messages = self.reformat_message(context_text=context_text, message=kwargs['messages'])
@@ -106,10 +213,9 @@ class LocalSearch(BaseSearch):
             **kwargs
     ) -> AsyncGenerator:
         """Build local search context that fits a single context window and generate answer for the user query."""
-        context_text, context_records = self.context_builder.build_context(
+        context_text, context_records = await self.abuild_context(
             query=query,
             conversation_history=conversation_history,
-            **self.context_builder_params,
         )
         messages = self.reformat_message(context_text=context_text, message=kwargs['messages'])
         yield context_records
@@ -121,8 +227,10 @@ class LocalSearch(BaseSearch):
             yield response
 
     def reformat_message(self, context_text: str, message: list) -> list:
+        if self.prompt_layout == "prefix":
+            return self._prefix_layout(context_text, message)
         content = next((msg['content'] for msg in message if msg['role'] == 'system'), None)
-        role = content or 'You are a helpful assistant responding to questions about data in the tables provided.'
+        role = content or DEFAULT_ROLE
         search_prompt = self.system_prompt.format(
             context_data=context_text, response_type=self.response_type, role=role
         )
@@ -132,6 +240,32 @@ class LocalSearch(BaseSearch):
                 break
         else:
             message.insert(0, {"role": "system", "content": search_prompt})
-        log.info("请求信息:\n" + json.dumps(message, indent=4, ensure_ascii=False))
-        log.info("从向量数据库检索到的信息:\n" + context_text)
+        log_event(
+            log, "本地检索提示词",
+            messages=len(message),
+            prompt_chars=len(search_prompt),
+            context_chars=len(context_text),
+            context=payload(context_text),
+            payload=payload(message),
+        )
+        return message
+
+    def _prefix_layout(self, context_text: str, message: list) -> list:
+        # instructions, then the role (from the first system message), then the tables; the rest of the conversation follows unchanged
+        index = next((i for i, msg in enumerate(message) if msg['role'] == 'system'), None)
+        role = (message[index]['content'] if index is not None else None) or DEFAULT_ROLE
+        rest = [msg for i, msg in enumerate(message) if i != index]
+        context_text = sort_context_tables(context_text)
+        message[:] = [
+            {"role": "system", "content": self.instructions + LOCAL_SEARCH_ROLE_SECTION.format(role=role)},
+            {"role": "system", "content": LOCAL_SEARCH_CONTEXT_SECTION.format(context_data=context_text)},
+        ] + rest
+        log_event(
+            log, "本地检索提示词",
+            messages=len(message),
+            prompt_chars=len(message[0]['content']) + len(message[1]['content']),
+            context_chars=len(context_text),
+            context=payload(context_text),
+            payload=payload(message),
+        )
         return message
@@ -0,0 +1,162 @@
+"""Coalescing of identical in-flight requests onto one shared response stream."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import unicodedata
+from collections.abc import AsyncIterator, Callable, Hashable
+from typing import Any
+
+log = logging.getLogger(__name__)
+
+
+def request_key(mode: str, version: str, messages: list[dict]) -> str:
+    """Key for a chat request: search mode, index version and the whitespace/NFKC-normalized messages."""
+    normalized = [
+        (message["role"], " ".join(unicodedata.normalize("NFKC", message["content"]).split()))
+        for message in messages
+    ]
+    return hashlib.sha1(json.dumps([mode, version, normalized], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class SharedStream:
+    """Runs one source iterator in a background task and fans its items out to subscribers.
+
+    Every item is kept until the stream ends, so a subscriber that joins late first replays what
+    was already emitted and then follows live. The source is cancelled if every subscriber leaves
+    before it finishes.
+    """
+
+    def __init__(self, source: AsyncIterator, on_done: Callable[[], None]):
+        self.items: list[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(source))
+        # also runs when the task is cancelled before it started, so the flight is always removed
+        self._task.add_done_callback(self._finish)
+
+    async def _run(self, source: AsyncIterator) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+
+    def _finish(self, task: asyncio.Task) -> None:
+        if task.cancelled() and self.error is None:
+            self.error = RuntimeError("shared stream cancelled")
+        self.done = True
+        self._notify()
+        self._on_done()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self) -> "Subscription":
+        """A subscription, counted from now on rather than from its first iteration."""
+        return Subscription(self)
+
+    async def _follow(self) -> AsyncIterator:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+    def _unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self._task.cancel()
+
+
+class Subscription:
+    """One subscriber's view of a ``SharedStream``.
+
+    The subscriber is counted as soon as the subscription is created, because the response
+    body that wraps it may only be iterated later. It is released when the stream ends, when
+    iteration fails or is cancelled, on ``aclose``, or when the subscription is garbage
+    collected without ever being iterated.
+    """
+
+    def __init__(self, stream: SharedStream):
+        self._stream = stream
+        self._iterator: AsyncIterator | None = None
+        self._released = False
+        stream.subscribers += 1
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._released:
+            raise StopAsyncIteration
+        if self._iterator is None:
+            self._iterator = self._stream._follow()
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            self.release()
+            raise
+
+    async def aclose(self) -> None:
+        if self._iterator is not None:
+            await self._iterator.aclose()
+        self.release()
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._stream._unsubscribe()
+
+    def __del__(self) -> None:
+        try:
+            self.release()
+        except RuntimeError:
+            # event loop already closed; nothing left to cancel
+            pass
+
+
+class SingleFlight:
+    """At most one in-flight stream per key; identical requests subscribe to the running one."""
+
+    def __init__(self):
+        self._flights: dict[Hashable, SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def stream(self, key: Hashable, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Subscribe to the flight for ``key``, starting it with ``factory()`` if none is running."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = SharedStream(factory(), on_done=lambda: self._finish(key, flight))
+            self._flights[key] = flight
+            self.leaders += 1
+        else:
+            self.followers += 1
+            log.info("合并相同的进行中请求，当前订阅数 %d", flight.subscribers + 1)
+        return flight.subscribe()
+
+    def _finish(self, key: Hashable, flight: SharedStream) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict[str, Any]:
+        requests = self.leaders + self.followers
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesced_rate": self.followers / requests if requests else 0.0,
+        }
@@ -0,0 +1,175 @@
+"""Compiled index snapshots: materialized query objects that load much faster than the parquet tables.
+
+A snapshot directory holds these files:
+
+- ``manifest.json``: format version, community level and the size/mtime fingerprint of every
+  source parquet file. A snapshot is only used when all of them still match.
+- ``objects.pickle``: the entity, relationship, report, text unit and claim objects produced by
+  the ``read_indexer_*`` adapters, with entity embeddings stripped out, the index of contact
+  facts extracted from the claims and the community report hierarchy.
+- ``entity_embeddings.arrow``: the entity description embeddings as an Arrow IPC file, memory
+  mapped on load so the vectors are shared page cache rather than Python float lists.
+- ``report_embeddings.arrow``: embeddings of the community report texts used by global search
+  prefiltering, keyed by a hash of the text and tagged with the embedding model. It is not tied
+  to the manifest, so a rebuilt index only re-embeds the reports whose text changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from contextlib import contextmanager
+from typing import Any
+
+import numpy as np
+import pyarrow as pa
+
+from graphrag.model import Entity
+
+SNAPSHOT_FORMAT = 4
+MANIFEST_FILE = "manifest.json"
+OBJECTS_FILE = "objects.pickle"
+EMBEDDINGS_FILE = "entity_embeddings.arrow"
+REPORT_EMBEDDINGS_FILE = "report_embeddings.arrow"
+
+log = logging.getLogger(__name__)
+
+
+def parquet_fingerprints(input_dir: str) -> dict[str, list[int]]:
+    """Size and modification time of every parquet file in the index directory."""
+    fingerprints = {}
+    for name in sorted(os.listdir(input_dir)):
+        if name.endswith(".parquet"):
+            stat = os.stat(os.path.join(input_dir, name))
+            fingerprints[name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprints
+
+
+@contextmanager
+def stage(timings: dict[str, float], name: str):
+    """Record the wall time of a loading stage into ``timings``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def load_snapshot(snapshot_dir: str, fingerprints: dict, community_level: int) -> dict[str, Any] | None:
+    """Load a snapshot if it exists and matches the current parquet files, else return None."""
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if (
+                manifest.get("format") != SNAPSHOT_FORMAT
+                or manifest.get("community_level") != community_level
+                or manifest.get("fingerprints") != fingerprints
+        ):
+            log.info("索引快照已过期，将从 parquet 重新加载")
+            return None
+        with open(os.path.join(snapshot_dir, OBJECTS_FILE), "rb") as f:
+            objects = pickle.load(f)
+        _attach_embeddings(objects["entities"], os.path.join(snapshot_dir, EMBEDDINGS_FILE))
+        return objects
+    except Exception:
+        log.exception("读取索引快照失败，将从 parquet 重新加载")
+        return None
+
+
+def write_snapshot(snapshot_dir: str, fingerprints: dict, community_level: int, objects: dict[str, Any]) -> None:
+    """Write a snapshot atomically: data files first, the manifest last."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    entities: list[Entity] = objects["entities"]
+    ids = [entity.id for entity in entities if entity.description_embedding is not None]
+    vectors = [entity.description_embedding for entity in entities if entity.description_embedding is not None]
+    dim = len(vectors[0]) if vectors else 1
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim)
+    table = pa.table({
+        "id": pa.array(ids, pa.string()),
+        "vector": pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel(), pa.float32()), dim),
+    })
+    _replace(os.path.join(snapshot_dir, EMBEDDINGS_FILE), lambda f: _write_ipc(f, table))
+
+    embeddings = [entity.description_embedding for entity in entities]
+    try:
+        for entity in entities:
+            entity.description_embedding = None
+        _replace(os.path.join(snapshot_dir, OBJECTS_FILE), lambda f: pickle.dump(objects, f, protocol=5))
+    finally:
+        for entity, embedding in zip(entities, embeddings):
+            entity.description_embedding = embedding
+
+    manifest = {"format": SNAPSHOT_FORMAT, "community_level": community_level, "fingerprints": fingerprints}
+    _replace(manifest_path, lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+
+
+def text_key(text: str) -> str:
+    """Key of a text in the report embedding file."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_text_embeddings(path: str, model: str) -> dict[str, np.ndarray]:
+    """Vectors by text key from an embedding file written for ``model``; empty if missing or stale."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        if (table.schema.metadata or {}).get(b"model", b"").decode("utf-8") != model or table.num_rows == 0:
+            return {}
+        column = table.column("vector").combine_chunks()
+        matrix = column.flatten().to_numpy().reshape(-1, column.type.list_size)
+        return dict(zip(table.column("key").to_pylist(), matrix))
+    except Exception:
+        log.exception("读取报告向量文件失败，将重新向量化")
+        return {}
+
+
+def write_text_embeddings(path: str, model: str, vectors: dict[str, np.ndarray]) -> None:
+    """Write the embedding file atomically, replacing any previous one."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    keys = list(vectors)
+    dim = len(vectors[keys[0]]) if keys else 1
+    matrix = np.asarray([vectors[key] for key in keys], dtype=np.float32).reshape(len(keys), dim)
+    table = pa.table({
+        "key": pa.array(keys, pa.string()),
+        "vector": pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel(), pa.float32()), dim),
+    }).replace_schema_metadata({"model": model})
+    _replace(path, lambda f: _write_ipc(f, table))
+
+
+def _attach_embeddings(entities: list[Entity], path: str) -> None:
+    # zero-copy float32 rows backed by the memory-mapped Arrow file
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    if table.num_rows == 0:
+        for entity in entities:
+            entity.description_embedding = None
+        return
+    chunks = table.column("vector").chunks
+    vector_column = chunks[0] if len(chunks) == 1 else table.column("vector").combine_chunks()
+    dim = vector_column.type.list_size
+    matrix = vector_column.flatten().to_numpy(zero_copy_only=len(chunks) == 1).reshape(-1, dim)
+    rows = {entity_id: index for index, entity_id in enumerate(table.column("id").to_pylist())}
+    for entity in entities:
+        index = rows.get(entity.id)
+        entity.description_embedding = matrix[index] if index is not None else None
+
+
+def _write_ipc(f, table: pa.Table) -> None:
+    with pa.ipc.new_file(f, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _replace(path: str, write) -> None:
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
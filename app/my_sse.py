@@ -0,0 +1,125 @@
+"""Fast SSE framing for streamed chat completion chunks."""
+
+import asyncio
+import json
+import time
+from collections.abc import AsyncIterator
+from json.encoder import encode_basestring_ascii
+from typing import Any
+
+
+class SSEEncoder:
+    """Pre-rendered ``chat.completion.chunk`` envelope for one streamed response.
+
+    The JSON around the delta is rendered once; each token frame is the prefix, the escaped
+    token and the suffix, as bytes. The output matches ``json.dumps(build_response(...))`` for
+    the same ``created`` timestamp.
+    """
+
+    def __init__(self, chunk_id: str, model: str, created: int | None = None):
+        envelope = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": created if created is not None else int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": None}],
+        }
+        rendered = json.dumps(envelope)
+        prefix, suffix = rendered.split('"content": ""', 1)
+        self._prefix = f'data: {prefix}"content": '.encode()
+        self._suffix = f"{suffix}\n\n".encode()
+        envelope["choices"][0].update(delta={}, finish_reason="stop")
+        self.stop = f"data: {json.dumps(envelope)}\n\n".encode()
+        self.done = b"data: [DONE]\n\n"
+
+    def delta(self, text: str) -> bytes:
+        return self._prefix + encode_basestring_ascii(text).encode() + self._suffix
+
+    @staticmethod
+    def comment(text: str) -> bytes:
+        return f": {text}\n\n".encode()
+
+
+async def coalesce_tokens(pieces: AsyncIterator, max_delay: float, max_bytes: int) -> AsyncIterator[Any]:
+    """Merge consecutive string pieces into one until ``max_delay`` seconds or ``max_bytes`` UTF-8 bytes.
+
+    Non-string items flush the buffer and pass through unchanged. With ``max_delay`` at 0 only the
+    pieces that have already arrived are merged, so no text is held back; with both limits at 0
+    the pieces are passed through as is.
+    """
+    if max_delay <= 0 and max_bytes <= 0:
+        async for piece in pieces:
+            yield piece
+        return
+
+    # a reader task drains ``pieces`` into a queue, so buffered text can be flushed on time
+    # while the upstream is between tokens without wrapping every read in a future
+    queue: asyncio.Queue = asyncio.Queue()
+    end = object()
+    cancelled = object()
+
+    async def pump():
+        try:
+            async for item in pieces:
+                queue.put_nowait(item)
+        except Exception as e:
+            # re-raised on the consumer side
+            queue.put_nowait(e)
+        else:
+            queue.put_nowait(end)
+
+    def stopped(task: asyncio.Future) -> None:
+        # a cancelled upstream ends the stream as cancelled rather than leaving the consumer waiting
+        if task.cancelled():
+            queue.put_nowait(cancelled)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.ensure_future(pump())
+    reader.add_done_callback(stopped)
+    buffer: list[str] = []
+    size = 0
+    deadline = 0.0
+    try:
+        while True:
+            if not queue.empty():
+                item = queue.get_nowait()
+            elif buffer:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                    continue
+            else:
+                item = await queue.get()
+            if item is end:
+                break
+            if item is cancelled:
+                raise asyncio.CancelledError()
+            if isinstance(item, BaseException):
+                # the text that arrived before the failure is still sent
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                raise item
+            if not isinstance(item, str):
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                yield item
+                continue
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(item)
+            if max_bytes > 0:
+                size += len(item.encode())
+                if size >= max_bytes:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+            if buffer and max_delay > 0 and loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        reader.cancel()
@@ -0,0 +1,293 @@
+"""Entity embedding vector stores used by local search."""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any
+
+import numpy as np
+import pyarrow as pa
+
+from graphrag.model import Entity
+from graphrag.model.types import TextEmbedder
+from graphrag.vector_stores import BaseVectorStore, VectorStoreDocument, VectorStoreSearchResult
+from graphrag.vector_stores.lancedb import LanceDBVectorStore
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+log = logging.getLogger(__name__)
+
+
+def entity_documents(entities: list[Entity]) -> list[VectorStoreDocument]:
+    """Entity description embeddings as vector store documents (same layout as store_entity_semantic_embeddings)."""
+    return [
+        VectorStoreDocument(
+            id=entity.id,
+            text=entity.description,
+            vector=entity.description_embedding,
+            attributes=(
+                {"title": entity.title, **entity.attributes}
+                if entity.attributes
+                else {"title": entity.title}
+            ),
+        )
+        for entity in entities
+    ]
+
+
+class IncrementalLanceDBVectorStore(LanceDBVectorStore):
+    """LanceDB store that only rewrites the rows whose content changed since the last load.
+
+    A sidecar manifest next to the collection records a content hash per document id. When the
+    collection exists and nothing changed it is simply opened; otherwise only new, changed and
+    deleted rows are touched. A missing collection or manifest falls back to a full rebuild.
+    """
+
+    def connect(self, **kwargs: Any) -> Any:
+        super().connect(**kwargs)
+        self.db_uri = kwargs.get("db_uri", "./lancedb")
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.db_uri, f"{self.collection_name}.hashes.json")
+
+    def sync_documents(self, documents: list[VectorStoreDocument]) -> dict[str, int]:
+        """Bring the collection in line with ``documents``; returns per-operation row counts."""
+        hashes = {str(document.id): _content_hash(document) for document in documents if document.vector is not None}
+        previous = self._read_manifest()
+        exists = self.collection_name in self.db_connection.table_names()
+
+        if previous is None or not exists:
+            self.document_collection = self.db_connection.create_table(
+                self.collection_name,
+                data=[_row(document) for document in documents if document.vector is not None] or None,
+                schema=None if hashes else _empty_schema(),
+                mode="overwrite",
+            )
+            self._write_manifest(hashes)
+            stats = {"rebuilt": len(hashes)}
+            log.info("向量库 %s 全量重建: %s", self.collection_name, stats)
+            return stats
+
+        added = [key for key in hashes if key not in previous]
+        updated = [key for key in hashes if key in previous and previous[key] != hashes[key]]
+        deleted = [key for key in previous if key not in hashes]
+        self.document_collection = self.db_connection.open_table(self.collection_name)
+        stats = {
+            "added": len(added),
+            "updated": len(updated),
+            "deleted": len(deleted),
+            "unchanged": len(hashes) - len(added) - len(updated),
+        }
+        if added or updated or deleted:
+            stale = updated + deleted
+            for start in range(0, len(stale), 500):
+                ids = ", ".join("'" + key.replace("'", "''") + "'" for key in stale[start:start + 500])
+                self.document_collection.delete(f"id IN ({ids})")
+            changed = set(added + updated)
+            rows = [_row(document) for document in documents if str(document.id) in changed and document.vector is not None]
+            if rows:
+                self.document_collection.add(rows)
+            self._write_manifest(hashes)
+        log.info("向量库 %s 增量同步: %s", self.collection_name, stats)
+        return stats
+
+    def _read_manifest(self) -> dict[str, str] | None:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, hashes: dict[str, str]) -> None:
+        tmp_path = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(hashes, f)
+        os.replace(tmp_path, self.manifest_path)
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """In-memory cosine similarity index over a contiguous, row-normalized embedding matrix.
+
+    Search is an exact matrix product plus ``argpartition`` top-k. Collections with at least
+    ``ann_threshold`` rows additionally get an approximate index (hnswlib HNSW, or faiss IVF when
+    hnswlib is not installed) which serves unfiltered searches; without either package the exact
+    search is always used. ``dtype="float16"`` halves the matrix memory; scoring is then done in
+    float32 blocks. Scores are cosine similarities, so the ranking matches LanceDB's L2 search
+    on normalized embeddings.
+    """
+
+    def __init__(
+            self,
+            collection_name: str,
+            dtype: str = "float32",
+            ann_threshold: int = 50_000,
+            ann_ef_search: int = 64,
+            **kwargs: Any,
+    ):
+        super().__init__(collection_name=collection_name, **kwargs)
+        self.dtype = np.dtype(dtype)
+        self.ann_threshold = ann_threshold
+        self.ann_ef_search = ann_ef_search
+        self.documents: list[VectorStoreDocument] = []
+        self.matrix = np.zeros((0, 0), dtype=self.dtype)
+        self.ann_index = None
+        self._rows: dict[str, int] = {}
+        self._filter_rows: np.ndarray | None = None
+
+    def connect(self, **kwargs: Any) -> None:
+        """Nothing to connect to; the collection lives in process memory."""
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def load_documents(self, documents: list[VectorStoreDocument], overwrite: bool = True) -> None:
+        documents = [document for document in documents if document.vector is not None]
+        if not overwrite:
+            documents = self.documents + documents
+        self.documents = documents
+        self._rows = {str(document.id): row for row, document in enumerate(documents)}
+        self._filter_rows = None
+        if not documents:
+            self.matrix = np.zeros((0, 0), dtype=self.dtype)
+            self.ann_index = None
+            return
+        matrix = np.asarray([document.vector for document in documents], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        self.matrix = np.ascontiguousarray(matrix, dtype=self.dtype)
+        self.ann_index = self._build_ann(matrix) if len(documents) >= self.ann_threshold else None
+        log.info(
+            "内存向量库 %s 已加载: %d 条, 维度 %d, %s, 近似索引 %s",
+            self.collection_name, len(documents), matrix.shape[1], self.dtype,
+            type(self.ann_index).__name__ if self.ann_index is not None else "无",
+        )
+
+    def filter_by_id(self, include_ids: list[str] | list[int]) -> Any:
+        if not include_ids:
+            self._filter_rows = None
+        else:
+            rows = [self._rows[str(key)] for key in include_ids if str(key) in self._rows]
+            self._filter_rows = np.asarray(rows, dtype=np.int64)
+        self.query_filter = self._filter_rows
+        return self.query_filter
+
+    def similarity_search_by_vector(
+            self, query_embedding: list[float], k: int = 10, **kwargs: Any
+    ) -> list[VectorStoreSearchResult]:
+        return self.search_batch([query_embedding], k)[0]
+
+    def similarity_search_by_text(
+            self, text: str, text_embedder: TextEmbedder, k: int = 10, **kwargs: Any
+    ) -> list[VectorStoreSearchResult]:
+        query_embedding = text_embedder(text)
+        if query_embedding is not None and len(query_embedding):
+            return self.similarity_search_by_vector(query_embedding, k)
+        return []
+
+    def search_batch(self, query_embeddings: list, k: int = 10) -> list[list[VectorStoreSearchResult]]:
+        """Top-k documents for each of several query vectors in one pass."""
+        if not self.documents or k <= 0:
+            return [[] for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries /= np.where(norms == 0, 1, norms)
+        if self.ann_index is not None and self._filter_rows is None:
+            rows, scores = self._search_ann(queries, min(k, len(self.documents)))
+        else:
+            rows, scores = self._search_exact(queries, k)
+        return [
+            [
+                VectorStoreSearchResult(document=self.documents[row], score=float(score))
+                for row, score in zip(query_rows, query_scores)
+                if row >= 0
+            ]
+            for query_rows, query_scores in zip(rows, scores)
+        ]
+
+    def _search_exact(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        candidates = self._filter_rows
+        scores = self._scores(queries, candidates)
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), scores[:, :0]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        rows = candidates[top] if candidates is not None else top
+        return rows, top_scores
+
+    def _scores(self, queries: np.ndarray, candidates: np.ndarray | None, block: int = 65_536) -> np.ndarray:
+        matrix = self.matrix if candidates is None else self.matrix[candidates]
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+        # numpy has no fast half-precision matmul; upcast one block of rows at a time
+        return np.concatenate(
+            [queries @ matrix[start:start + block].astype(np.float32).T for start in range(0, len(matrix), block)],
+            axis=1,
+        )
+
+    def _build_ann(self, matrix: np.ndarray):
+        count, dim = matrix.shape
+        if hnswlib is not None:
+            index = hnswlib.Index(space="ip", dim=dim)
+            index.init_index(max_elements=count, ef_construction=200, M=16)
+            index.add_items(matrix, np.arange(count))
+            index.set_ef(self.ann_ef_search)
+            return index
+        if faiss is not None:
+            nlist = max(1, int(4 * np.sqrt(count)))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(matrix)
+            index.add(matrix)
+            index.nprobe = max(1, nlist // 16)
+            return index
+        log.info("未安装 hnswlib/faiss，向量库 %s 使用精确检索", self.collection_name)
+        return None
+
+    def _search_ann(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if hnswlib is not None and isinstance(self.ann_index, hnswlib.Index):
+            self.ann_index.set_ef(max(self.ann_ef_search, k))
+            rows, distances = self.ann_index.knn_query(queries, k=k)
+            return rows.astype(np.int64), 1 - distances
+        scores, rows = self.ann_index.search(queries, k)
+        return rows, scores
+
+
+def _content_hash(document: VectorStoreDocument) -> str:
+    digest = hashlib.sha1()
+    digest.update((document.text or "").encode("utf-8"))
+    # float32 so parquet (float64 lists) and snapshot (float32 arrays) loads hash identically
+    digest.update(np.asarray(document.vector, dtype=np.float32).tobytes())
+    digest.update(json.dumps(document.attributes, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _row(document: VectorStoreDocument) -> dict[str, Any]:
+    return {
+        "id": str(document.id),
+        "text": document.text,
+        "vector": np.asarray(document.vector, dtype=np.float64).tolist(),
+        "attributes": json.dumps(document.attributes),
+    }
+
+
+def _empty_schema() -> pa.Schema:
+    return pa.schema([
+        pa.field("id", pa.string()),
+        pa.field("text", pa.string()),
+        pa.field("vector", pa.list_(pa.float64())),
+        pa.field("attributes", pa.string()),
+    ])
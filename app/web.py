@@ -1,16 +1,21 @@
+import asyncio
 import os
+import hashlib
 import time
 import uuid
 import json
 import re
+import threading
 import pandas as pd
 import tiktoken
 import logging
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Union
 from contextlib import asynccontextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv(".env")
@@ -25,24 +30,43 @@ from graphrag.query.indexer_adapters import (
     read_indexer_text_units,
 )
 
-from graphrag.query.input.loaders.dfs import store_entity_semantic_embeddings
-from graphrag.query.llm.oai.chat_openai import ChatOpenAI
 from graphrag.query.llm.oai.embedding import OpenAIEmbedding
 from graphrag.query.llm.oai.typing import OpenaiApiType
 from graphrag.query.question_gen.local_gen import LocalQuestionGen
-from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
-from my_search import LocalSearch
+from my_search import LocalSearch, ThreadSafeMixedContext
+from my_cache import CachedTextEmbedder, SemanticCache
+from my_community import CommunitySelector, embed_reports, read_community_tree
+from my_concurrency import AdaptiveLimiter
+from my_context import AdaptiveContext, ContextTotals
+from my_facts import FactIndex, FactMatcher, extract_facts
+from my_history import HistoryCompactor
+from my_embedding import MicroBatchEmbedder, embed_documents
+from my_singleflight import SingleFlight, request_key
+from my_scheduler import LLMOverloaded, LLMScheduler, Priority, ScheduledLLM
+from my_http import SharedHttpClients
+from my_llm import UsageTrackingChatOpenAI
+from my_logging import Timer, log_event, payload, setup_logging, start_request
+from my_prefork import request_reload, serve_prefork, supervisor_pid
+from my_sse import SSEEncoder, coalesce_tokens
 from graphrag.query.structured_search.global_search.community_context import GlobalCommunityContext
-from graphrag.query.structured_search.global_search.search import GlobalSearch
-from graphrag.vector_stores.lancedb import LanceDBVectorStore
-
-# 设置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from my_global_search import EarlyStop, GlobalSearch, MapProgress
+from my_index import IndexGeneration
+from my_registry import IndexRegistry, estimate_index_bytes
+from my_snapshot import REPORT_EMBEDDINGS_FILE, load_snapshot, parquet_fingerprints, stage, write_snapshot
+from my_vector_store import IncrementalLanceDBVectorStore, NumpyVectorStore, entity_documents
+
+# 设置日志：日志记录经队列交给后台线程格式化和写出，不阻塞事件循环；请求日志只记录长度和 id，按采样率记录完整内容
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "json"),
+    payload_sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0")),
+    payload_max_chars=int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "20000")),
+    library_level=os.getenv("LOG_LIBRARY_LEVEL", "WARNING"),
+)
 logger = logging.getLogger(__name__)
 
 # 设置常量和配置
 INPUT_DIR = os.getenv('INPUT_DIR')
-LANCEDB_URI = f"{INPUT_DIR}/lancedb"
 COMMUNITY_REPORT_TABLE = "create_final_community_reports"
 ENTITY_TABLE = "create_final_nodes"
 ENTITY_EMBEDDING_TABLE = "create_final_entities"
@@ -51,11 +75,177 @@ COVARIATE_TABLE = "create_final_covariates"
 TEXT_UNIT_TABLE = "create_final_text_units"
 COMMUNITY_LEVEL = 2
 PORT = 8012
+LOCAL_MODEL_ID = "graphrag-www_hnpamd_com_1"
+GLOBAL_MODEL_ID = "graphrag-global-search"
+FULL_MODEL_ID = "full-model"
+# 大模型调度：并发上限、每分钟 token 预算（0 表示不限制）、排队上限（超出时直接返回 429）、各优先级的最长排队秒数、失败重试次数
+# 多 worker 时并发和 token 预算按 worker 数平分
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "256"))
+LLM_QUEUE_TIMEOUT_INTERACTIVE = float(os.getenv("LLM_QUEUE_TIMEOUT_INTERACTIVE", "30"))
+LLM_QUEUE_TIMEOUT_MAP = float(os.getenv("LLM_QUEUE_TIMEOUT_MAP", "60"))
+# 后台类调用（对话历史摘要）排在交互和 map 调用之后，在后台生成、不阻塞请求，超时则该摘要放弃，较早的对话轮次继续直接丢弃
+LLM_QUEUE_TIMEOUT_BATCH = float(os.getenv("LLM_QUEUE_TIMEOUT_BATCH", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# 上游 HTTP 连接池（大模型、向量接口和 Tavily 共用）：每个主机的连接数和保活连接数、保活秒数、连接/读取/等待连接超时秒数、是否启用 HTTP/2（需安装 h2）
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "64"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "32"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "true").lower() == "true"
+# 多站点索引注册表：JSON 文件，模型 id -> {"input_dir": 索引目录, "mode": local/global/full}；未配置时三个模型都使用 INPUT_DIR
+INDEX_REGISTRY_FILE = os.getenv("INDEX_REGISTRY_FILE", "")
+# 已加载索引的估算内存上限（MB），超出时淘汰最久未使用的索引，0 表示不限制
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "0"))
+# 全局检索 map 阶段的 SSE 心跳间隔（秒），避免客户端和代理超时断开
+MAP_HEARTBEAT_INTERVAL = float(os.getenv("MAP_HEARTBEAT_INTERVAL", "5"))
+# 全局检索 map 阶段的自适应并发（AIMD）：延迟平稳时逐步提高并发，遇到 429、超时或延迟超过基线的倍数时按比例下调；
+# 所有全局查询共享同一个并发上限。关闭时固定使用 MAP_CONCURRENCY_MAX
+MAP_CONCURRENCY_ADAPTIVE = os.getenv("MAP_CONCURRENCY_ADAPTIVE", "true").lower() == "true"
+MAP_CONCURRENCY_INITIAL = int(os.getenv("MAP_CONCURRENCY_INITIAL", "8"))
+MAP_CONCURRENCY_MIN = int(os.getenv("MAP_CONCURRENCY_MIN", "2"))
+MAP_CONCURRENCY_MAX = int(os.getenv("MAP_CONCURRENCY_MAX", "32"))
+MAP_CONCURRENCY_BACKOFF = float(os.getenv("MAP_CONCURRENCY_BACKOFF", "0.5"))
+MAP_LATENCY_TOLERANCE = float(os.getenv("MAP_LATENCY_TOLERANCE", "2.0"))
+# 全局检索提前归约：已完成的 map 调用达到一定比例且得分不低于阈值的要点数量足够时，或 map 阶段超过截止秒数时，
+# 取消剩余的 map 调用，用已有要点开始流式 reduce；会改变回答内容，默认关闭（关闭时 map 阶段也没有截止时间）
+GLOBAL_EARLY_STOP_ENABLED = os.getenv("GLOBAL_EARLY_STOP_ENABLED", "false").lower() == "true"
+GLOBAL_EARLY_STOP_KEY_POINTS = int(os.getenv("GLOBAL_EARLY_STOP_KEY_POINTS", "8"))
+GLOBAL_EARLY_STOP_MIN_SCORE = int(os.getenv("GLOBAL_EARLY_STOP_MIN_SCORE", "60"))
+GLOBAL_EARLY_STOP_MIN_FRACTION = float(os.getenv("GLOBAL_EARLY_STOP_MIN_FRACTION", "0.5"))
+GLOBAL_MAP_DEADLINE = float(os.getenv("GLOBAL_MAP_DEADLINE", "20"))
+# 本地检索上下文构建线程池大小（查询向量化、LanceDB 检索、排序和 token 计数都在线程池中执行）
+CONTEXT_POOL_SIZE = int(os.getenv("CONTEXT_POOL_SIZE", "8"))
+# 语义缓存：相似问题直接复用之前的回答；相似但不同的问题可能得到别的问题的回答，默认关闭
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_MAX_MB = int(os.getenv("SEMANTIC_CACHE_MAX_MB", "64"))
+CACHE_REPLAY_CHUNK_CHARS = 16
+# 流式输出合并：把相邻 token 合并为一帧发送，达到等待毫秒数或字节数之一即发送（建议 20 毫秒 / 64 字节），均为 0 时逐 token 发送
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "0"))
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "0"))
+# 本地检索上下文按问题自适应：按实体向量得分的分布选择实体数和 token 预算（在最小值和最大值之间），并去掉文本单元中
+# 在全站大量重复的行（导航、页脚）和几乎相同的文本单元；关闭时固定使用最大值
+ADAPTIVE_CONTEXT_ENABLED = os.getenv("ADAPTIVE_CONTEXT_ENABLED", "true").lower() == "true"
+CONTEXT_MIN_TOKENS = int(os.getenv("CONTEXT_MIN_TOKENS", "200"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "400"))
+CONTEXT_MIN_ENTITIES = int(os.getenv("CONTEXT_MIN_ENTITIES", "3"))
+CONTEXT_MAX_ENTITIES = int(os.getenv("CONTEXT_MAX_ENTITIES", "10"))
+# 与最高得分相差不超过该值的实体视为相关（得分统一按余弦相似度计算，与向量库类型无关）
+CONTEXT_SCORE_MARGIN = float(os.getenv("CONTEXT_SCORE_MARGIN", "0.08"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+# 全局检索社区预筛选：加载索引时为各层级社区报告生成向量，查询时自顶向下逐层保留与问题最相关的比例（召回率），
+# 只把选中的社区报告送入 map 阶段；召回率为 1 时等同于不筛选。报告在线程中按批向量化（每次一个请求，不经过查询向量缓存），
+# 启用索引快照时向量保存在快照目录中，之后只为内容变化的报告重新向量化；批大小不能超过向量模型单次请求的条数上限
+# （text-embedding-v2 为 25），请求被拒绝（400）时批大小减半重试。未选中的社区不参与回答，默认关闭
+GLOBAL_PREFILTER_ENABLED = os.getenv("GLOBAL_PREFILTER_ENABLED", "false").lower() == "true"
+GLOBAL_PREFILTER_RECALL = float(os.getenv("GLOBAL_PREFILTER_RECALL", "0.7"))
+GLOBAL_PREFILTER_MIN_SCORE = float(os.getenv("GLOBAL_PREFILTER_MIN_SCORE", "0"))
+GLOBAL_PREFILTER_EMBED_BATCH_SIZE = int(os.getenv("GLOBAL_PREFILTER_EMBED_BATCH_SIZE", "16"))
+# 联系方式类问题（电话、邮箱、地址、网址）直接用加载索引时从声明中提取的事实回答，不调用大模型；问题过长、
+# 含有其他诉求或事实不明确时仍走本地检索；回答是固定模板而不是大模型生成的，默认关闭
+FACT_FAST_PATH_ENABLED = os.getenv("FACT_FAST_PATH_ENABLED", "false").lower() == "true"
+FACT_MAX_QUESTION_CHARS = int(os.getenv("FACT_MAX_QUESTION_CHARS", "40"))
+FACT_MIN_CONFIDENCE = float(os.getenv("FACT_MIN_CONFIDENCE", "0.7"))
+# 本地检索提示词布局：prefix 按 固定指令、角色、检索上下文、对话历史 的顺序组织消息并对上下文表格排序，便于上游命中前缀缓存；legacy 为原来的单条系统提示词
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "legacy")
+# 流式调用时请求上游返回 token 用量（stream_options.include_usage），用于统计前缀缓存命中的 token 数；上游不支持该参数时关闭
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+# 对话历史按 token 预算保留：超出预算时较早的轮次用缓存的摘要代替（摘要在后台生成，生成前直接丢弃），最近的轮次原样保留；预算为 0 时不压缩
+# HISTORY_MAX_MESSAGES 为保留的最多消息条数，超出部分直接丢弃
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "100"))
+# 相同问题（同一索引版本、系统提示和对话历史）的并发请求合并为一次检索和生成，后到的请求先回放已生成的内容
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+# 查询向量持久化缓存（SQLite 文件，多个 worker 共享，重启后仍然有效；置空则只使用内存缓存）
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096"))
+# 查询向量微批：并发请求的问题最多等待若干毫秒或凑满 N 条后合并为一次向量接口调用，批大小为 1 时关闭
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "16"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+# 索引热加载：轮询 INPUT_DIR 的间隔（秒，0 表示关闭文件监听），旧版本在途请求超过多少秒未结束时记录告警（仍等其结束后释放），管理接口令牌
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "0"))
+INDEX_DRAIN_TIMEOUT = float(os.getenv("INDEX_DRAIN_TIMEOUT", "600"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# 索引快照：首次加载后把解析好的对象写入 INPUT_DIR 下的快照目录，之后启动直接读取快照
+INDEX_SNAPSHOT_ENABLED = os.getenv("INDEX_SNAPSHOT_ENABLED", "true").lower() == "true"
+INDEX_SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR", "snapshot")
+# 实体向量检索后端：memory 为进程内 NumPy 矩阵（超过阈值且安装了 hnswlib/faiss 时使用近似索引），lancedb 为磁盘上的 LanceDB
+VECTOR_STORE = os.getenv("VECTOR_STORE", "memory")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
+VECTOR_STORE_ANN_THRESHOLD = int(os.getenv("VECTOR_STORE_ANN_THRESHOLD", "50000"))
+# worker 进程数，大于 1 时父进程预加载索引后 fork 出多个 worker 共享同一份内存
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+
+# 全局变量：索引注册表（按索引目录保存已加载的版本，包含本地/全局搜索引擎和问题生成器），以及各索引共用的模型和线程池
+index_registry = None
+llm = None
+token_encoder = None
+text_embedder = None
+context_executor = None
+http_clients = None
+history_compactor = None
+preloaded_index = None
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    ttl=SEMANTIC_CACHE_TTL,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    max_bytes=SEMANTIC_CACHE_MAX_MB * 1024 * 1024,
+)
+singleflight = SingleFlight()
+context_totals = ContextTotals()
+fact_matcher = FactMatcher(max_chars=FACT_MAX_QUESTION_CHARS, min_confidence=FACT_MIN_CONFIDENCE)
+map_limiter = AdaptiveLimiter(
+    initial=MAP_CONCURRENCY_INITIAL,
+    min_limit=MAP_CONCURRENCY_MIN,
+    max_limit=MAP_CONCURRENCY_MAX,
+    backoff=MAP_CONCURRENCY_BACKOFF,
+    latency_tolerance=MAP_LATENCY_TOLERANCE,
+) if MAP_CONCURRENCY_ADAPTIVE else None
+early_stop = EarlyStop(
+    min_key_points=GLOBAL_EARLY_STOP_KEY_POINTS,
+    min_score=GLOBAL_EARLY_STOP_MIN_SCORE,
+    min_fraction=GLOBAL_EARLY_STOP_MIN_FRACTION,
+    deadline=GLOBAL_MAP_DEADLINE,
+) if GLOBAL_EARLY_STOP_ENABLED else None
+llm_scheduler = LLMScheduler(
+    max_concurrency=max(1, LLM_MAX_CONCURRENCY // max(1, WEB_WORKERS)),
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE // max(1, WEB_WORKERS),
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeouts={
+        Priority.INTERACTIVE: LLM_QUEUE_TIMEOUT_INTERACTIVE,
+        Priority.MAP: LLM_QUEUE_TIMEOUT_MAP,
+        Priority.BATCH: LLM_QUEUE_TIMEOUT_BATCH,
+    },
+)
+
+
+def load_model_routes() -> dict:
+    """
+    读取模型 id 到索引目录和检索模式的映射
+    """
+    if not INDEX_REGISTRY_FILE:
+        return {
+            LOCAL_MODEL_ID: {"input_dir": INPUT_DIR, "mode": "local"},
+            GLOBAL_MODEL_ID: {"input_dir": INPUT_DIR, "mode": "global"},
+            FULL_MODEL_ID: {"input_dir": INPUT_DIR, "mode": "full"},
+        }
+    with open(INDEX_REGISTRY_FILE, encoding="utf-8") as f:
+        routes = json.load(f)
+    return {
+        model_id: {"input_dir": route["input_dir"], "mode": route.get("mode", "local")}
+        for model_id, route in routes.items()
+    }
 
-# 全局变量，用于存储搜索引擎和问题生成器
-local_search_engine = None
-global_search_engine = None
-question_generator = None
+
+MODEL_ROUTES = load_model_routes()
 
 
 # 数据模型
@@ -114,78 +304,283 @@ async def setup_llm_and_embedder():
     api_base_embedding = os.environ.get("API_BASE_EMBEDDING", "")
     # 获取模型名称
     llm_model = os.environ.get("GRAPHRAG_LLM_MODEL", "")
-    embedding_model = os.environ.get("GRAPHRAG_EMBEDDING_MODEL", "")
 
-    # 初始化ChatOpenAI实例
-    llm = ChatOpenAI(
+    # 初始化token编码器
+    token_encoder = tiktoken.get_encoding("cl100k_base")
+
+    # 大模型和向量接口共用同一组连接池，突发请求时复用已建立的连接
+    shared_http = SharedHttpClients(
+        [api_base, api_base_embedding],
+        max_connections_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+        max_keepalive_per_host=HTTP_MAX_KEEPALIVE_PER_HOST,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http2=HTTP_HTTP2,
+    )
+    if map_limiter is not None:
+        # 上游 429 会在客户端内部重试，通过响应钩子让 map 并发控制感知到限流
+        shared_http.async_client.event_hooks["response"].append(map_limiter.observe_response)
+
+    # 初始化ChatOpenAI实例，所有异步调用经过共享的调度器（按优先级排队、限制并发和 token 速率）
+    chat_llm = UsageTrackingChatOpenAI(
         api_key=api_key,
         api_base=api_base,
         model=llm_model,
         api_type=OpenaiApiType.OpenAI,
-        max_retries=20,
+        max_retries=LLM_MAX_RETRIES,
+        stream_usage=LLM_STREAM_USAGE,
+    )
+    sync_client, async_client = shared_http.openai_clients(api_key, api_base, LLM_MAX_RETRIES)
+    chat_llm.set_clients(sync_client=sync_client, async_client=async_client)
+    llm = ScheduledLLM(chat_llm, llm_scheduler)
+
+    # 初始化文本嵌入模型（带内存 LRU + SQLite 持久化缓存，重复问题不再请求向量接口；未命中缓存的问题跨请求合并批量向量化）
+    embedder = new_embedder()
+    sync_client, async_client = shared_http.openai_clients(api_key_embedding, api_base_embedding, 20)
+    embedder.set_clients(sync_client=sync_client, async_client=async_client)
+    if EMBEDDING_BATCH_MAX_SIZE > 1:
+        embedder = MicroBatchEmbedder(
+            embedder,
+            max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+        )
+    text_embedder = CachedTextEmbedder(
+        embedder,
+        db_path=EMBEDDING_CACHE_PATH or None,
+        max_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
     )
 
-    # 初始化token编码器
-    token_encoder = tiktoken.get_encoding("cl100k_base")
+    logger.info("LLM和嵌入器设置完成")
+    return llm, token_encoder, text_embedder, shared_http
+
 
-    # 初始化文本嵌入模型
-    text_embedder = OpenAIEmbedding(
-        api_key=api_key_embedding,
-        api_base=api_base_embedding,
+def new_embedder() -> OpenAIEmbedding:
+    """
+    按环境变量创建向量接口客户端（使用默认连接，服务中再替换为共享连接池）
+    """
+    api_key = os.environ.get("GRAPHRAG_API_KEY", "")
+    embedding_model = os.environ.get("GRAPHRAG_EMBEDDING_MODEL", "")
+    return OpenAIEmbedding(
+        api_key=os.environ.get("GRAPHRAG_API_KEY_EMBEDDING", api_key),
+        api_base=os.environ.get("API_BASE_EMBEDDING", ""),
         api_type=OpenaiApiType.OpenAI,
         model=embedding_model,
         deployment_name=embedding_model,
         max_retries=20,
     )
 
-    logger.info("LLM和嵌入器设置完成")
-    return llm, token_encoder, text_embedder
+
+def index_fingerprint(input_dir: str = INPUT_DIR) -> str:
+    """
+    根据索引目录下 parquet 文件的名称、大小和修改时间计算索引版本
+    """
+    digest = hashlib.sha1(json.dumps(parquet_fingerprints(input_dir)).encode())
+    return digest.hexdigest()[:16]
 
 
-async def load_context():
+async def load_context(input_dir: str = INPUT_DIR):
     """
-    加载上下文数据，包括实体、关系、报告、文本单元和协变量
+    加载上下文数据，包括实体、关系、报告、文本单元和协变量（在线程中执行，不阻塞事件循环）
     """
+    return await asyncio.to_thread(read_context, input_dir)
+
+
+def read_context(input_dir: str):
     logger.info("正在加载上下文数据")
+    timings = {}
     try:
-        entity_df = pd.read_parquet(f"{INPUT_DIR}/{ENTITY_TABLE}.parquet")
-        entity_embedding_df = pd.read_parquet(f"{INPUT_DIR}/{ENTITY_EMBEDDING_TABLE}.parquet")
-        entities = read_indexer_entities(entity_df, entity_embedding_df, COMMUNITY_LEVEL)
+        preloaded = take_preloaded_index(input_dir, timings)
+        if preloaded is not None:
+            objects, memory_bytes = preloaded["objects"], preloaded["memory_bytes"]
+            description_embedding_store, prepared = preloaded["vector_store"], preloaded["prepared"]
+        else:
+            objects = read_index_objects(input_dir, timings)
+            with stage(timings, "memory_estimate"):
+                memory_bytes = estimate_index_bytes(*index_collections(objects))
+            description_embedding_store, prepared = None, {}
+        if description_embedding_store is None:
+            with stage(timings, "vector_store"):
+                description_embedding_store = open_vector_store(input_dir, objects["entities"])
+
+        logger.info(f"声明记录数: {len(objects['claims'])}")
+        covariates = {"claims": objects["claims"]}
+
+        logger.info("上下文数据加载完成，各阶段耗时: " + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in timings.items()))
+        return (objects["entities"], objects["relationships"], objects["reports"], objects["text_units"],
+                description_embedding_store, covariates, objects["fact_index"], objects["community_tree"], memory_bytes,
+                prepared)
+    except Exception as e:
+        logger.error(f"加载上下文数据时出错: {str(e)}")
+        raise
 
-        description_embedding_store = LanceDBVectorStore(collection_name="entity_description_embeddings")
-        description_embedding_store.connect(db_uri=LANCEDB_URI)
-        store_entity_semantic_embeddings(entities=entities, vectorstore=description_embedding_store)
 
-        relationship_df = pd.read_parquet(f"{INPUT_DIR}/{RELATIONSHIP_TABLE}.parquet")
-        relationships = read_indexer_relationships(relationship_df)
+def take_preloaded_index(input_dir: str, timings: dict):
+    """
+    取出父进程预加载的索引（多进程模式），只使用一次且索引文件未变化时才有效
+    """
+    global preloaded_index
+    if preloaded_index is None:
+        return None
+    preloaded, preloaded_index = preloaded_index, None
+    with stage(timings, "fingerprint"):
+        fingerprints = parquet_fingerprints(input_dir)
+    if preloaded["input_dir"] == input_dir and preloaded["fingerprints"] == fingerprints:
+        return preloaded
+    return None
+
+
+def index_collections(objects: dict):
+    """
+    参与内存估算的索引对象集合
+    """
+    return (objects["entities"], objects["relationships"], objects["reports"], objects["text_units"],
+            {"claims": objects["claims"]})
 
-        report_df = pd.read_parquet(f"{INPUT_DIR}/{COMMUNITY_REPORT_TABLE}.parquet")
-        reports = read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
 
-        text_unit_df = pd.read_parquet(f"{INPUT_DIR}/{TEXT_UNIT_TABLE}.parquet")
-        text_units = read_indexer_text_units(text_unit_df)
+def read_index_objects(input_dir: str, timings: dict):
+    """
+    读取索引对象：优先使用索引快照，其次从 parquet 解析
+    """
+    with stage(timings, "fingerprint"):
+        fingerprints = parquet_fingerprints(input_dir)
+    snapshot_dir = os.path.join(input_dir, INDEX_SNAPSHOT_DIR)
+    if INDEX_SNAPSHOT_ENABLED:
+        with stage(timings, "snapshot_load"):
+            objects = load_snapshot(snapshot_dir, fingerprints, COMMUNITY_LEVEL)
+        if objects is not None:
+            return objects
+    with stage(timings, "parquet_read"):
+        entity_df = pd.read_parquet(f"{input_dir}/{ENTITY_TABLE}.parquet")
+        entity_embedding_df = pd.read_parquet(f"{input_dir}/{ENTITY_EMBEDDING_TABLE}.parquet")
+        relationship_df = pd.read_parquet(f"{input_dir}/{RELATIONSHIP_TABLE}.parquet")
+        report_df = pd.read_parquet(f"{input_dir}/{COMMUNITY_REPORT_TABLE}.parquet")
+        text_unit_df = pd.read_parquet(f"{input_dir}/{TEXT_UNIT_TABLE}.parquet")
+        covariate_df = pd.read_parquet(f"{input_dir}/{COVARIATE_TABLE}.parquet")
+    with stage(timings, "materialize"):
+        objects = {
+            "entities": read_indexer_entities(entity_df, entity_embedding_df, COMMUNITY_LEVEL),
+            "relationships": read_indexer_relationships(relationship_df),
+            "reports": read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL),
+            "text_units": read_indexer_text_units(text_unit_df),
+            "claims": read_indexer_covariates(covariate_df),
+        }
+        objects["community_tree"] = read_community_tree(report_df, entity_df, COMMUNITY_LEVEL, objects["reports"])
+        # 事实索引随快照保存，多进程时在父进程中构建，worker 不再遍历实体
+        objects["fact_index"] = FactIndex(extract_facts(covariate_df), (entity.title for entity in objects["entities"]))
+    if INDEX_SNAPSHOT_ENABLED:
+        with stage(timings, "snapshot_write"):
+            try:
+                write_snapshot(snapshot_dir, fingerprints, COMMUNITY_LEVEL, objects)
+            except Exception as e:
+                logger.error(f"写入索引快照失败: {str(e)}")
+    return objects
+
+
+def open_vector_store(input_dir: str, entities: list):
+    if VECTOR_STORE == "memory":
+        description_embedding_store = NumpyVectorStore(
+            collection_name="entity_description_embeddings",
+            dtype=VECTOR_STORE_DTYPE,
+            ann_threshold=VECTOR_STORE_ANN_THRESHOLD,
+        )
+        description_embedding_store.load_documents(entity_documents(entities))
+        return description_embedding_store
+    # 只写入新增、变化和删除的实体向量，内容未变化时直接打开已有的集合
+    description_embedding_store = IncrementalLanceDBVectorStore(collection_name="entity_description_embeddings")
+    description_embedding_store.connect(db_uri=f"{input_dir}/lancedb")
+    description_embedding_store.sync_documents(entity_documents(entities))
+    return description_embedding_store
 
-        covariate_df = pd.read_parquet(f"{INPUT_DIR}/{COVARIATE_TABLE}.parquet")
-        claims = read_indexer_covariates(covariate_df)
-        logger.info(f"声明记录数: {len(claims)}")
-        covariates = {"claims": claims}
 
-        logger.info("上下文数据加载完成")
-        return entities, relationships, reports, text_units, description_embedding_store, covariates
+def preload_index(input_dir: str = INPUT_DIR):
+    """
+    多进程模式下在父进程中加载索引对象、内存向量库矩阵、文本单元中的重复行和社区报告向量，fork 后各 worker 以写时复制的方式共享
+    """
+    global preloaded_index
+    timings = {}
+    objects = read_index_objects(input_dir, timings)
+    # 内存估算会遍历每个对象的属性并改动引用计数，在 fork 之前算好，worker 中不再触碰共享页
+    with stage(timings, "memory_estimate"):
+        memory_bytes = estimate_index_bytes(*index_collections(objects))
+    with stage(timings, "vector_store"):
+        vector_store = open_vector_store(input_dir, objects["entities"])
+    if VECTOR_STORE == "lancedb":
+        # 父进程负责写入向量库，worker 启动时只需打开未变化的集合（LanceDB 连接不跨进程共享）
+        vector_store = None
+    # 需要遍历全部索引对象的预处理也在 fork 之前完成，结果交给 worker 直接使用
+    prepared = {}
+    if ADAPTIVE_CONTEXT_ENABLED:
+        with stage(timings, "boilerplate"):
+            prepared["boilerplate"] = new_adaptive_context(tiktoken.get_encoding("cl100k_base")).fit(
+                objects["text_units"]).boilerplate
+    if GLOBAL_PREFILTER_ENABLED and objects["community_tree"].reports:
+        # 只由父进程调用向量接口和写入报告向量文件，worker 共享同一个归一化矩阵；失败时 worker 也不再重试
+        with stage(timings, "report_embeddings"):
+            embedder = new_embedder()
+            try:
+                prepared["report_vectors"] = embed_report_vectors(
+                    objects["community_tree"], embedder, report_embeddings_file(input_dir))
+            finally:
+                embedder.sync_client.close()
+    preloaded_index = {"input_dir": input_dir, "fingerprints": parquet_fingerprints(input_dir), "objects": objects,
+                       "memory_bytes": memory_bytes, "vector_store": vector_store, "prepared": prepared}
+    logger.info("父进程预加载索引完成，各阶段耗时: " + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in timings.items()))
+
+
+def report_embeddings_file(input_dir: str):
+    """
+    社区报告向量文件的路径，未启用索引快照时不保存
+    """
+    return os.path.join(input_dir, INDEX_SNAPSHOT_DIR, REPORT_EMBEDDINGS_FILE) if INDEX_SNAPSHOT_ENABLED else None
+
+
+def embed_report_vectors(community_tree, embedder: OpenAIEmbedding, cache_path):
+    """
+    为社区报告批量生成向量（阻塞调用），返回归一化矩阵和本次新向量化的数量；失败时返回 None，全局检索不做预筛选
+    """
+    try:
+        return embed_reports(
+            community_tree,
+            partial(embed_documents, embedder, batch_size=GLOBAL_PREFILTER_EMBED_BATCH_SIZE),
+            cache_path,
+            embedder.model,
+        )
     except Exception as e:
-        logger.error(f"加载上下文数据时出错: {str(e)}")
-        raise
+        logger.error(f"社区报告向量化失败，全局检索不做预筛选: {str(e)}")
+        return None
+
+
+def new_adaptive_context(token_encoder) -> AdaptiveContext:
+    """
+    按配置创建本地检索的自适应上下文（未统计重复行）
+    """
+    return AdaptiveContext(
+        token_encoder,
+        min_tokens=CONTEXT_MIN_TOKENS,
+        max_tokens=CONTEXT_MAX_TOKENS,
+        min_entities=CONTEXT_MIN_ENTITIES,
+        max_entities=CONTEXT_MAX_ENTITIES,
+        score_margin=CONTEXT_SCORE_MARGIN,
+        dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+        totals=context_totals,
+    )
 
 
 async def setup_search_engines(llm, token_encoder, text_embedder, entities, relationships, reports, text_units,
-                               description_embedding_store, covariates):
+                               description_embedding_store, covariates, executor=None, community_tree=None,
+                               report_embeddings_path=None, prepared=None):
     """
-    设置本地搜索引擎和全局搜索引擎
+    设置本地搜索引擎和全局搜索引擎，prepared 为父进程预先算好的结果（重复行、社区报告向量），有则直接使用
     """
+    prepared = prepared or {}
     logger.info("正在设置搜索引擎")
+    # 本地和全局检索共用同一批社区报告对象，两者构建上下文时都会读写报告的 attributes，用同一把锁串行
+    report_lock = threading.Lock()
 
     # 设置本地搜索引擎
-    local_context_builder = LocalSearchMixedContext(
+    local_context_builder = ThreadSafeMixedContext(
         community_reports=reports,
         text_units=text_units,
         entities=entities,
@@ -195,6 +590,7 @@ async def setup_search_engines(llm, token_encoder, text_embedder, entities, rela
         embedding_vectorstore_key=EntityVectorStoreKey.ID,
         text_embedder=text_embedder,
         token_encoder=token_encoder,
+        community_lock=report_lock,
     )
 
     local_context_params = {
@@ -202,16 +598,25 @@ async def setup_search_engines(llm, token_encoder, text_embedder, entities, rela
         "community_prop": 0.1,
         "conversation_history_max_turns": 5,
         "conversation_history_user_turns_only": True,
-        "top_k_mapped_entities": 10,
-        "top_k_relationships": 10,
+        "top_k_mapped_entities": CONTEXT_MAX_ENTITIES,
+        "top_k_relationships": CONTEXT_MAX_ENTITIES,
         "include_entity_rank": True,
         "include_relationship_weight": True,
         "include_community_rank": False,
         "return_candidate_context": False,
         "embedding_vectorstore_key": EntityVectorStoreKey.ID,
-        "max_tokens": 400,
+        "max_tokens": CONTEXT_MAX_TOKENS,
     }
 
+    adaptive_context = None
+    if ADAPTIVE_CONTEXT_ENABLED:
+        adaptive_context = new_adaptive_context(token_encoder)
+        if "boilerplate" in prepared:
+            adaptive_context.boilerplate = prepared["boilerplate"]
+        else:
+            # 统计重复行需要扫描全部文本单元，放到线程中执行，避免加载或热更新时阻塞在途的流式响应
+            await asyncio.to_thread(adaptive_context.fit, text_units)
+
     local_llm_params = {
         "max_tokens": 2_000,
         "temperature": 0.0,
@@ -224,6 +629,9 @@ async def setup_search_engines(llm, token_encoder, text_embedder, entities, rela
         llm_params=local_llm_params,
         context_builder_params=local_context_params,
         response_type="multiple paragraphs",
+        executor=executor,
+        prompt_layout=PROMPT_LAYOUT,
+        adaptive_context=adaptive_context,
     )
 
     # 设置全局搜索引擎
@@ -257,6 +665,29 @@ async def setup_search_engines(llm, token_encoder, text_embedder, entities, rela
         "temperature": 0.0,
     }
 
+    community_selector = None
+    if GLOBAL_PREFILTER_ENABLED and community_tree is not None and community_tree.reports:
+        if "report_vectors" in prepared:
+            report_vectors = prepared["report_vectors"]
+        else:
+            # 报告向量直接调用底层向量接口批量生成，不占用查询向量的微批和缓存
+            bulk_embedder = text_embedder.embedder
+            if isinstance(bulk_embedder, MicroBatchEmbedder):
+                bulk_embedder = bulk_embedder.embedder
+            report_vectors = await asyncio.to_thread(
+                embed_report_vectors, community_tree, bulk_embedder, report_embeddings_path)
+        if report_vectors is not None:
+            vectors, embedded = report_vectors
+            community_selector = CommunitySelector(
+                community_tree,
+                text_embedder,
+                vectors,
+                recall=GLOBAL_PREFILTER_RECALL,
+                min_score=GLOBAL_PREFILTER_MIN_SCORE,
+                embedded=embedded,
+            )
+            logger.info(f"社区报告向量就绪: {len(community_tree.reports)} 份，本次新向量化 {embedded} 份")
+
     global_search_engine = GlobalSearch(
         llm=llm,
         context_builder=global_context_builder,
@@ -267,8 +698,14 @@ async def setup_search_engines(llm, token_encoder, text_embedder, entities, rela
         allow_general_knowledge=False,
         json_mode=True,
         context_builder_params=global_context_builder_params,
-        concurrent_coroutines=32,
+        concurrent_coroutines=MAP_CONCURRENCY_MAX,
         response_type="multiple paragraphs",
+        executor=executor,
+        heartbeat_interval=MAP_HEARTBEAT_INTERVAL,
+        community_selector=community_selector,
+        map_limiter=map_limiter,
+        early_stop=early_stop,
+        context_lock=report_lock,
     )
 
     logger.info("搜索引擎设置完成")
@@ -294,25 +731,104 @@ def format_response(response):
     return '\n\n'.join(formatted_paragraphs)
 
 
+async def build_generation(input_dir: str = INPUT_DIR) -> IndexGeneration:
+    """
+    加载一个索引版本并在其上构建搜索引擎和问题生成器
+    """
+    start = time.time()
+    version = index_fingerprint(input_dir)
+    (entities, relationships, reports, text_units, description_embedding_store, covariates, fact_index,
+     community_tree, memory_bytes, prepared) = await load_context(input_dir)
+    memory_bytes += getattr(description_embedding_store, "nbytes", 0)
+    local_search_engine, global_search_engine, local_context_builder, local_llm_params, local_context_params = await setup_search_engines(
+        llm, token_encoder, text_embedder, entities, relationships, reports, text_units,
+        description_embedding_store, covariates, executor=context_executor, community_tree=community_tree,
+        report_embeddings_path=report_embeddings_file(input_dir),
+        prepared=prepared,
+    )
+    question_generator = LocalQuestionGen(
+        llm=llm,
+        context_builder=local_context_builder,
+        token_encoder=token_encoder,
+        llm_params=local_llm_params,
+        context_builder_params=local_context_params,
+    )
+    return IndexGeneration(
+        version=version,
+        local_search_engine=local_search_engine,
+        global_search_engine=global_search_engine,
+        question_generator=question_generator,
+        load_time=time.time() - start,
+        memory_bytes=memory_bytes,
+        fact_index=fact_index,
+    )
+
+
+async def reload_index(input_dir: str, force: bool = False):
+    """
+    在后台加载索引目录的新版本并原子替换当前版本，旧版本在在途请求结束后释放
+    """
+    generation = await index_registry.reload(input_dir, force=force)
+    logger.info(f"索引 {input_dir} 当前版本: {generation.version}")
+    return generation
+
+
+def retire_generation(generation: IndexGeneration):
+    # 被替换或淘汰的索引版本对应的语义缓存不再有效
+    semantic_cache.discard(lambda namespace: namespace[1] == generation.version)
+
+
+async def watch_index():
+    """
+    轮询已加载索引目录的 parquet 文件，指纹连续两次一致（写入完成）且与当前版本不同时热加载
+    """
+    pending_versions = {}
+    while True:
+        await asyncio.sleep(INDEX_WATCH_INTERVAL)
+        for input_dir, generation in index_registry.loaded().items():
+            try:
+                version = await asyncio.to_thread(index_fingerprint, input_dir)
+                if version == generation.version:
+                    pending_versions.pop(input_dir, None)
+                elif version == pending_versions.get(input_dir):
+                    await reload_index(input_dir)
+                    pending_versions.pop(input_dir, None)
+                else:
+                    pending_versions[input_dir] = version
+            except Exception as e:
+                logger.error(f"索引 {input_dir} 监听出错: {str(e)}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时执行
-    global local_search_engine, global_search_engine, question_generator
+    global index_registry, llm, token_encoder, text_embedder, context_executor, http_clients, history_compactor
+    watcher = None
     try:
         logger.info("正在初始化搜索引擎和问题生成器...")
-        llm, token_encoder, text_embedder = await setup_llm_and_embedder()
-        entities, relationships, reports, text_units, description_embedding_store, covariates = await load_context()
-        local_search_engine, global_search_engine, local_context_builder, local_llm_params, local_context_params = await setup_search_engines(
-            llm, token_encoder, text_embedder, entities, relationships, reports, text_units,
-            description_embedding_store, covariates
-        )
-        question_generator = LocalQuestionGen(
-            llm=llm,
-            context_builder=local_context_builder,
-            token_encoder=token_encoder,
-            llm_params=local_llm_params,
-            context_builder_params=local_context_params,
+        context_executor = ThreadPoolExecutor(max_workers=CONTEXT_POOL_SIZE, thread_name_prefix="context-builder")
+        llm, token_encoder, text_embedder, http_clients = await setup_llm_and_embedder()
+        if HISTORY_TOKEN_BUDGET > 0:
+            history_compactor = HistoryCompactor(
+                llm,
+                token_encoder,
+                budget_tokens=HISTORY_TOKEN_BUDGET,
+                summary_max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+                max_entries=HISTORY_SUMMARY_CACHE_SIZE,
+            )
+        index_registry = IndexRegistry(
+            load=build_generation,
+            fingerprint=index_fingerprint,
+            memory_budget=INDEX_MEMORY_BUDGET_MB * 1024 * 1024,
+            drain_timeout=INDEX_DRAIN_TIMEOUT,
+            on_retire=retire_generation,
         )
+        # 索引在首次请求时加载；多进程模式下父进程已预加载的索引直接装入
+        if preloaded_index is not None:
+            (await index_registry.acquire(preloaded_index["input_dir"])).release()
+        # 多进程模式下由父进程监听索引文件并替换 worker，worker 各自热加载会失去写时复制共享
+        if INDEX_WATCH_INTERVAL > 0 and supervisor_pid() is None:
+            watcher = asyncio.create_task(watch_index())
         logger.info("初始化完成。")
     except Exception as e:
         logger.error(f"初始化过程中出错: {str(e)}")
@@ -322,6 +838,10 @@ async def lifespan(app: FastAPI):
 
     # 关闭时执行
     logger.info("正在关闭...")
+    if watcher is not None:
+        watcher.cancel()
+    context_executor.shutdown(wait=False, cancel_futures=True)
+    await http_clients.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -329,12 +849,15 @@ app = FastAPI(lifespan=lifespan)
 
 # 在 chat_completions 函数中添加以下代码
 
-async def full_model_search(prompt: str):
+async def full_model_search(generation: IndexGeneration, prompt: str, conversation_turns: list):
     """
     执行全模型搜索，包括本地检索、全局检索和 Tavily 搜索
     """
-    local_result = await local_search_engine.asearch(prompt)
-    global_result = await global_search_engine.asearch(prompt)
+    # 本地检索和全局检索并发执行，总耗时取决于较慢的一个
+    local_result, global_result = await asyncio.gather(
+        generation.local_search_engine.asearch(query=prompt, messages=conversation_turns),
+        generation.global_search_engine.asearch(prompt),
+    )
     # tavily_result = await tavily_search(prompt)
 
     # 格式化结果
@@ -352,49 +875,300 @@ async def full_model_search(prompt: str):
     return formatted_result
 
 
+async def full_model_stream(generation: IndexGeneration, prompt: str, conversation_turns: list):
+    """
+    流式全模型搜索：本地检索和全局检索并发执行，本地检索结果边生成边返回；全局检索 map 阶段的进度心跳随到随发，
+    reduce 结果先暂存，本地检索结束后接着输出
+    """
+    queue = asyncio.Queue()
+
+    async def pump(name: str, source):
+        try:
+            async for item in source:
+                await queue.put((name, item))
+        except Exception as e:
+            await queue.put((name, e))
+        finally:
+            await queue.put((name, None))
+
+    tasks = [
+        asyncio.create_task(pump("local", generation.local_search_engine.astream_search(query=prompt, messages=conversation_turns))),
+        asyncio.create_task(pump("global", generation.global_search_engine.astream_search(prompt))),
+    ]
+    try:
+        yield "# 🔥🔥🔥综合搜索结果\n\n## 🔥🔥🔥本地检索结果\n"
+        global_pieces = []
+        running = {"local", "global"}
+        while running:
+            name, item = await queue.get()
+            if item is None:
+                running.discard(name)
+                if name == "local":
+                    yield "\n\n## 🔥🔥🔥全局检索结果\n"
+                    for piece in global_pieces:
+                        yield piece
+                continue
+            if isinstance(item, Exception):
+                if name == "local":
+                    raise item
+                logger.error(f"全局检索出错: {str(item)}")
+            elif isinstance(item, MapProgress):
+                yield item
+            elif isinstance(item, str):
+                if name == "global" and "local" in running:
+                    global_pieces.append(item)
+                else:
+                    yield item
+        yield "\n\n## 🔥🔥🔥Tavily 搜索结果\n"
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
 @app.post("/v1/chat/completions")
 async def chat_completions(request: ChatCompletionRequest):
+    # 请求 id 同时作为返回的 chunk id，日志中的 request_id 与客户端看到的 id 一致
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+    start_request(chunk_id)
+    timer = Timer()
+    log_event(
+        logger, "收到聊天完成请求",
+        model=request.model,
+        stream=request.stream,
+        messages=len(request.messages),
+        prompt_chars=len(request.messages[-1].content) if request.messages else 0,
+        total_chars=sum(len(message.content) for message in request.messages),
+        payload=payload(lambda: [message.model_dump() for message in request.messages]),
+    )
+    # 未知的模型 id 按默认站点的本地检索处理
+    route = MODEL_ROUTES.get(request.model) or MODEL_ROUTES.get(LOCAL_MODEL_ID)
+    if route is None:
+        raise HTTPException(status_code=404, detail=f"model {request.model} not found")
+    mode = route["mode"] if request.model in MODEL_ROUTES else "local"
+    # 请求固定使用开始时的索引版本，热加载切换或淘汰版本不影响在途请求
+    try:
+        generation = await index_registry.acquire(route["input_dir"])
+    except Exception as e:
+        logger.error(f"加载索引 {route['input_dir']} 失败: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"index for model {request.model} unavailable")
+    try:
+        response = await complete_chat(request, generation, mode, chunk_id)
+    except BaseException:
+        generation.release()
+        raise
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = generation.release_after(response.body_iterator)
+    else:
+        generation.release()
+        content = response["choices"][0]["delta"].get("content") or ""
+        log_event(logger, "聊天完成", mode=mode, duration_ms=timer.ms(), response_chars=len(content), response=payload(content))
+    return response
+
+
+async def complete_chat(request: ChatCompletionRequest, generation: IndexGeneration, mode: str, chunk_id: str):
+    local_search_engine = generation.local_search_engine
+    global_search_engine = generation.global_search_engine
     try:
-        logger.info(f"收到聊天完成请求: {request}")
         prompt = request.messages[-1].content
-        logger.info(f"处理提示: {prompt}")
         conversation_turns = [
             {"role": "system", "content": "你是湖南平安医械科技有限公司的智能助手"}
         ]
-        # 判断 request.messages 的长度是否大于 20，如果大于 20，则取最后 20 个元素
-        if len(request.messages) > 21:
-            messages_to_add = request.messages[-21:]
-        else:
-            messages_to_add = request.messages
+        # 消息条数只作为上限，实际按 token 预算在调用大模型前压缩
         conversation_turns += [
             {"role": message.role, "content": message.content}
-            for message in messages_to_add
+            for message in request.messages[-HISTORY_MAX_MESSAGES:]
         ]
-        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if mode == "full":
+            llm_scheduler.admit()
+            conversation_turns = await compact_history(conversation_turns)
+            if request.stream:
+                return sse_response(chunk_id, request.model, full_model_stream(generation, prompt, conversation_turns))
+            formatted_response = await full_model_search(generation, prompt, conversation_turns)
+            return build_response(chunk_id, request.model, formatted_response, "stop")
+        if mode == "global":
+            # 全局检索不使用对话历史，只按问题合并
+            flight_key = request_key(mode, generation.version, [{"role": "user", "content": prompt}])
+            pieces = coalesce(flight_key, admitted(lambda: global_search_engine.astream_search(prompt)))
+            if request.stream:
+                return sse_response(chunk_id, request.model, pieces)
+            response = "".join([piece async for piece in pieces if isinstance(piece, str)])
+            return build_response(chunk_id, request.model, format_response(response), "stop")
+
+        # 事实直答只用于首轮提问，追问（如“他们的电话呢”）的主语要结合历史判断，交给本地检索
+        first_turn = not any(message.role == "assistant" for message in request.messages)
+        if FACT_FAST_PATH_ENABLED and first_turn:
+            fact = fact_matcher.answer(generation.fact_index, prompt)
+            if fact is not None:
+                log_event(logger, "事实问题直接回答", subject=fact.subject, kinds=fact.kinds, confidence=fact.confidence)
+                return cached_completion(chunk_id, request, fact.text)
+
+        # 语义缓存只用于首轮提问，多轮对话的回答依赖历史内容
+        cache_namespace = None
+        query_embedding = None
+        if SEMANTIC_CACHE_ENABLED and first_turn:
+            system_prompt = next((m.content for m in request.messages if m.role == "system"), conversation_turns[0]["content"])
+            cache_namespace = (system_prompt, generation.version)
+            query_embedding = await local_search_engine.aembed_query(prompt)
+            cached = semantic_cache.lookup(cache_namespace, query_embedding)
+            if cached is not None:
+                return cached_completion(chunk_id, request, cached.answer)
+
+        async def generate_local():
+            tokens = []
+            turns = await compact_history(conversation_turns)
+            async for response in local_search_engine.astream_search(query=prompt, messages=turns):
+                if isinstance(response, str):
+                    tokens.append(response)
+                yield response
+            # 只有完整生成的回答才写入语义缓存，合并的请求只写一次
+            if cache_namespace is not None:
+                semantic_cache.store(cache_namespace, prompt, query_embedding, "".join(tokens))
+
+        # 按压缩前的对话合并（压缩结果由对话内容决定），合并到进行中请求的跟随者不再压缩历史
+        pieces = coalesce(request_key(mode, generation.version, conversation_turns), admitted(generate_local))
         if request.stream:
-            async def event_stream():
-                try:
-                    async for response in local_search_engine.astream_search(query=prompt, messages=conversation_turns):
-                        if isinstance(response, str):
-                            yield f"data: {json.dumps(build_response(chunk_id, request.model, response, None))}\n\n"
-                except Exception as e:
-                    logger.error(f"Error in event_stream: {str(e)}")
-                finally:
-                    final_chunk = build_response(chunk_id, request.model, None, "stop")
-                    yield f"data: {json.dumps(final_chunk)}\n\n"
-                    yield "data: [DONE]\n\n"
-
-            return StreamingResponse(event_stream(), media_type="text/event-stream")
-        else:
-            result = await local_search_engine.asearch(query=prompt, messages=conversation_turns)
-            formatted_response = format_response(result.response)
-            final_chunk = build_response(chunk_id, request.model, formatted_response, "stop")
-            return final_chunk
+            return sse_response(chunk_id, request.model, pieces)
+        response = "".join([piece async for piece in pieces if isinstance(piece, str)])
+        return build_response(chunk_id, request.model, format_response(response), "stop")
+    except LLMOverloaded as e:
+        logger.warning(f"大模型调用排队已满或超时，拒绝请求: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"处理聊天完成时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def compact_history(conversation_turns: list) -> list:
+    """
+    按 token 预算压缩对话历史，未开启时原样返回
+    """
+    if history_compactor is None:
+        return conversation_turns
+    return (await history_compactor.compact(conversation_turns)).turns
+
+
+def admitted(factory):
+    """
+    包装检索流的创建：只有真正开始新检索的请求才需要调用大模型，排队已满时直接拒绝；合并到进行中请求的跟随者不受影响
+    """
+    def start():
+        llm_scheduler.admit()
+        return factory()
+
+    return start
+
+
+def coalesce(key: str, factory):
+    """
+    相同 key 的进行中请求共享同一个检索和生成流，未开启合并时直接执行
+    """
+    if not SINGLEFLIGHT_ENABLED:
+        return factory()
+    return singleflight.stream(key, factory)
+
+
+def sse_response(chunk_id: str, model: str, pieces):
+    """
+    将文本片段的异步生成器包装为 OpenAI 兼容的 SSE 流式响应，map 阶段进度以 SSE 注释行作为心跳发送
+    """
+    # 每个请求只渲染一次 chunk 外层 JSON，逐帧只转义并拼接 delta 文本
+    encoder = SSEEncoder(chunk_id, model)
+
+    async def event_stream():
+        timer = Timer()
+        first_token_ms = None
+        chars = 0
+        frames = 0
+        try:
+            async for piece in coalesce_tokens(pieces, SSE_COALESCE_MS / 1000, SSE_COALESCE_BYTES):
+                if isinstance(piece, MapProgress):
+                    yield encoder.comment(f"map {piece.completed}/{piece.total}")
+                elif isinstance(piece, str) and piece:
+                    if first_token_ms is None:
+                        first_token_ms = timer.ms()
+                    chars += len(piece)
+                    frames += 1
+                    yield encoder.delta(piece)
+        except Exception as e:
+            logger.error(f"Error in event_stream: {str(e)}")
+        finally:
+            log_event(logger, "流式响应结束", model=model, duration_ms=timer.ms(), first_token_ms=first_token_ms,
+                      response_chars=chars, frames=frames)
+            yield encoder.stop
+            yield encoder.done
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+def cached_completion(chunk_id: str, request: ChatCompletionRequest, answer: str):
+    """
+    以与实时生成相同的格式返回缓存或预先计算的回答，流式模式下按小块回放为 SSE
+    """
+    if not request.stream:
+        return build_response(chunk_id, request.model, format_response(answer), "stop")
+
+    async def replay():
+        for start in range(0, len(answer), CACHE_REPLAY_CHUNK_CHARS):
+            yield answer[start:start + CACHE_REPLAY_CHUNK_CHARS]
+
+    return sse_response(chunk_id, request.model, replay())
+
+
+@app.get("/v1/stats")
+async def stats():
+    """
+    返回缓存等运行时统计信息
+    """
+    return JSONResponse(content={
+        "index": index_registry.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "embedding_cache": text_embedder.stats(),
+        "singleflight": singleflight.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "map_concurrency": map_limiter.stats() if map_limiter is not None else None,
+        "global_early_stop": early_stop.stats() if early_stop is not None else None,
+        "llm_usage": llm.llm.stats() if isinstance(getattr(llm, "llm", None), UsageTrackingChatOpenAI) else None,
+        "http_pools": http_clients.stats(),
+        "context": context_totals.stats(),
+        "facts": fact_matcher.stats(),
+        "global_prefilter": {
+            input_dir: generation.global_search_engine.community_selector.stats()
+            for input_dir, generation in index_registry.loaded().items()
+            if getattr(generation.global_search_engine, "community_selector", None) is not None
+        },
+        "history": history_compactor.stats() if history_compactor is not None else None,
+        "embedding_batches": text_embedder.embedder.stats() if isinstance(text_embedder.embedder, MicroBatchEmbedder) else None,
+    })
+
+
+@app.post("/admin/reload")
+async def admin_reload(force: bool = False, model: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    """
+    热加载索引：在后台加载指定模型（未指定时为所有已加载索引）的新版本并原子切换，不中断在途请求。
+    多进程模式下请求只会到达其中一个 worker，改为通知父进程重新预加载索引并替换全部 worker（所有索引都会重新加载）
+    """
+    if ADMIN_TOKEN and authorization != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="unauthorized")
+    if supervisor_pid() is not None:
+        request_reload()
+        logger.info("已通知父进程重新加载索引并替换 worker")
+        return JSONResponse(status_code=202, content={"status": "reloading", "scope": "all workers"})
+    if model is not None:
+        if model not in MODEL_ROUTES:
+            raise HTTPException(status_code=404, detail=f"model {model} not found")
+        input_dirs = [MODEL_ROUTES[model]["input_dir"]]
+    else:
+        input_dirs = list(index_registry.loaded())
+    try:
+        generations = [await reload_index(input_dir, force=force) for input_dir in input_dirs]
+    except Exception as e:
+        logger.error(f"热加载索引失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(content={input_dir: generation.stats() for input_dir, generation in zip(input_dirs, generations)})
+
+
 @app.get("/v1/models")
 async def list_models():
     """
@@ -403,13 +1177,14 @@ async def list_models():
     logger.info("收到模型列表请求")
     current_time = int(time.time())
     models = [
-        {"id": "graphrag-www_hnpamd_com_1", "object": "model", "created": current_time - 100000, "owned_by": "graphrag"}
+        {"id": model_id, "object": "model", "created": current_time - 100000, "owned_by": "graphrag"}
+        for model_id in MODEL_ROUTES
     ]
     response = {
         "object": "list",
         "data": models
     }
-    logger.info(f"发送模型列表: {response}")
+    log_event(logger, "发送模型列表", models=len(models))
     return JSONResponse(content=response)
 
 
@@ -439,4 +1214,10 @@ if __name__ == "__main__":
     import uvicorn
 
     logger.info(f"在端口 {PORT} 上启动服务器")
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    if WEB_WORKERS > 1:
+        serve_prefork(app, host="0.0.0.0", port=PORT, workers=WEB_WORKERS,
+                      preload=preload_index if INPUT_DIR else None,
+                      version=partial(index_fingerprint, INPUT_DIR) if INPUT_DIR else None,
+                      watch_interval=INDEX_WATCH_INTERVAL)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -362,8 +362,11 @@ async def full_model_search(prompt: str):
     """
     执行全模型搜索，包括本地检索、全局检索和 Tavily 搜索
     """
-    local_result = await local_search_engine.asearch(prompt)
-    global_result = await global_search_engine.asearch(prompt)
+    # 本地检索和全局检索并发执行，总耗时取决于较慢的一个
+    local_result, global_result = await asyncio.gather(
+        local_search_engine.asearch(prompt),
+        global_search_engine.asearch(prompt),
+    )
     # tavily_result = await tavily_search(prompt)
 
     # 格式化结果
@@ -0,0 +1,3 @@
+# 热加载索引（MODEL 指定模型对应的索引，不指定则重新加载所有已加载的索引），不重启进程、不中断在途请求；
+# 多 worker 模式下由父进程重新预加载索引并替换全部 worker，接口返回 202
+curl -s -X POST -H "Authorization: Bearer ${ADMIN_TOKEN}" "http://127.0.0.1:8012/admin/reload?force=${FORCE:-false}${MODEL:+&model=${MODEL}}"
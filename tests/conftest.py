@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the service modules import each other as top-level modules (app/ is the working directory in production)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
@@ -0,0 +1,94 @@
+import math
+
+import pytest
+
+import my_cache
+from my_cache import SemanticCache
+
+
+def at(degrees):
+    """A unit vector ``degrees`` away from [1, 0]; its cosine similarity to it is cos(degrees)."""
+    return [math.cos(math.radians(degrees)), math.sin(math.radians(degrees))]
+
+
+def test_semantic_cache_hits_at_the_threshold_and_misses_below_it():
+    cache = SemanticCache(threshold=math.cos(math.radians(10)))
+    cache.store("ns", "上海分公司的电话", [1.0, 0.0], "电话是 021-1234")
+    assert cache.lookup("ns", at(9.9)).answer == "电话是 021-1234"
+    # unnormalized query vectors are compared by direction
+    assert cache.lookup("ns", [5.0, 0.0]).query == "上海分公司的电话"
+    assert cache.lookup("ns", at(10.5)) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_semantic_cache_returns_the_closest_entry():
+    cache = SemanticCache(threshold=0.9)
+    cache.store("ns", "a", at(0), "A")
+    cache.store("ns", "b", at(20), "B")
+    assert cache.lookup("ns", at(15)).answer == "B"
+    assert cache.lookup("ns", at(5)).answer == "A"
+
+
+def test_semantic_cache_namespaces_are_isolated():
+    cache = SemanticCache(threshold=0.95)
+    cache.store(("prompt", "v1"), "q", [1.0, 0.0], "old index")
+    cache.store(("prompt", "v2"), "q", [1.0, 0.0], "new index")
+    assert cache.lookup(("prompt", "v1"), [1.0, 0.0]).answer == "old index"
+    assert cache.lookup(("prompt", "v2"), [1.0, 0.0]).answer == "new index"
+    assert cache.lookup(("other", "v2"), [1.0, 0.0]) is None
+    cache.discard(lambda namespace: namespace[1] == "v1")
+    assert cache.lookup(("prompt", "v1"), [1.0, 0.0]) is None
+    assert cache.lookup(("prompt", "v2"), [1.0, 0.0]).answer == "new index"
+
+
+def test_semantic_cache_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(my_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(threshold=0.95, ttl=60)
+    cache.store("ns", "q", [1.0, 0.0], "answer")
+    now[0] += 59
+    assert cache.lookup("ns", [1.0, 0.0]) is not None
+    now[0] += 2
+    assert cache.lookup("ns", [1.0, 0.0]) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+    assert cache.stats()["evictions"] == 1
+
+
+def test_semantic_cache_evicts_least_recently_used_by_count():
+    cache = SemanticCache(threshold=0.99, max_entries=2)
+    cache.store("ns", "a", at(0), "A")
+    cache.store("ns", "b", at(45), "B")
+    # touching A makes B the least recently used
+    assert cache.lookup("ns", at(0)).answer == "A"
+    cache.store("other", "c", at(90), "C")
+    assert cache.lookup("ns", at(45)) is None
+    assert cache.lookup("ns", at(0)).answer == "A"
+    assert cache.lookup("other", at(90)).answer == "C"
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_semantic_cache_evicts_by_bytes_and_skips_oversized_answers():
+    # each entry: 8 bytes of float32 vector + 1 byte query + 100 bytes answer
+    cache = SemanticCache(threshold=0.99, max_bytes=250)
+    cache.store("ns", "a", at(0), "x" * 100)
+    cache.store("ns", "b", at(45), "y" * 100)
+    assert cache.stats()["bytes"] == 218
+    cache.store("ns", "c", at(90), "z" * 100)
+    assert cache.stats()["bytes"] == 218
+    assert cache.lookup("ns", at(0)) is None
+    assert cache.lookup("ns", at(90)) is not None
+
+    cache.store("ns", "d", at(30), "w" * 300)
+    assert cache.lookup("ns", at(30)) is None
+    assert cache.stats()["entries"] == 2
+
+
+@pytest.mark.parametrize("embedding, answer", [([], "A"), ([0.0, 0.0], "A"), ([1.0, 0.0], "")])
+def test_semantic_cache_ignores_empty_vectors_and_answers(embedding, answer):
+    cache = SemanticCache()
+    cache.store("ns", "q", embedding, answer)
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup("ns", embedding) is None
@@ -0,0 +1,75 @@
+import numpy as np
+
+from graphrag.model import CommunityReport
+
+from my_community import CommunitySelector, CommunityTree
+
+
+class _Embedder:
+    def embed(self, text):
+        return [3.0, 0.0]
+
+
+def report(community_id):
+    return CommunityReport(id=community_id, short_id=community_id, title=community_id, community_id=community_id)
+
+
+# roots A, B and C; A has children A1 and A2, B has child B1; the leaves and C are selectable
+VECTORS = {
+    "A": [1.0, 0.0],
+    "B": [0.0, 1.0],
+    "C": [0.7, 0.7],
+    "A1": [1.0, 0.1],
+    "A2": [0.1, 1.0],
+    "B1": [0.0, 1.0],
+}
+
+
+def selector(**kwargs):
+    tree = CommunityTree(
+        reports=[report(community_id) for community_id in VECTORS],
+        parents={"A1": "A", "A2": "A", "B1": "B", "A": None, "B": None, "C": None},
+        selectable={"C", "A1", "A2", "B1"},
+    )
+    vectors = np.asarray(list(VECTORS.values()), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return CommunitySelector(tree, _Embedder(), vectors, **kwargs)
+
+
+def selected(selector, query="q"):
+    reports, stats = selector.select(query)
+    return [report.community_id for report in reports], stats
+
+
+def test_select_walks_down_from_the_kept_roots_only():
+    ids, stats = selected(selector(recall=0.5, min_keep=1))
+    # roots: A (1.0) and C (0.71) kept, B dropped; under A only the best child A1
+    assert ids == ["C", "A1"]
+    assert stats["communities_scored"] == 5
+    assert stats["communities_selected"] == 2
+    assert stats["communities_total"] == 4
+    assert stats["top_score"] == 1.0
+
+
+def test_select_full_recall_selects_every_selectable_report():
+    ids, stats = selected(selector(recall=1.0))
+    assert sorted(ids) == ["A1", "A2", "B1", "C"]
+    assert stats["communities_scored"] == 6
+
+
+def test_select_keeps_at_least_min_keep_per_level():
+    ids, _ = selected(selector(recall=0.1, min_keep=2))
+    assert ids == ["C", "A1", "A2"]
+
+
+def test_select_drops_communities_below_min_score():
+    ids, _ = selected(selector(recall=1.0, min_score=0.5))
+    assert ids == ["C", "A1"]
+
+
+def test_select_keeps_the_best_community_when_none_reaches_min_score():
+    sel = selector(recall=1.0, min_score=2.0)
+    ids, _ = selected(sel)
+    assert ids == ["A1"]
+    assert sel.stats()["queries"] == 1
+    assert sel.stats()["avg_selected"] == 1.0
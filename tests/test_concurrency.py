@@ -0,0 +1,169 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from my_concurrency import AdaptiveLimiter, _current_slot
+from my_scheduler import LLMOverloaded, on_grant
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def saturated(limiter: AdaptiveLimiter) -> None:
+    limiter.active = int(limiter.limit)
+
+
+def test_acquire_waits_at_the_limit_and_release_wakes_in_order():
+    async def main():
+        limiter = AdaptiveLimiter(initial=2, min_limit=1)
+        await limiter.acquire()
+        await limiter.acquire()
+        order = []
+
+        async def wait(name):
+            await limiter.acquire()
+            order.append(name)
+
+        tasks = [asyncio.create_task(wait("first")), asyncio.create_task(wait("second"))]
+        await settle()
+        assert order == []
+        limiter.release(0.1, exc=asyncio.CancelledError())
+        await settle()
+        assert order == ["first"]
+        assert limiter.active == 2
+        limiter.release(0.1, exc=asyncio.CancelledError())
+        await asyncio.gather(*tasks)
+        assert order == ["first", "second"]
+
+    run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        limiter = AdaptiveLimiter(initial=1, min_limit=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.stats()["waiting"] == 0
+        limiter.release(0.1, exc=asyncio.CancelledError())
+        assert limiter.active == 0
+
+    run(main())
+
+
+def test_additive_increase_only_while_the_limit_is_used_up():
+    limiter = AdaptiveLimiter(initial=4, max_limit=8)
+    limiter.active = 1
+    limiter.release(0.1)
+    assert limiter.limit == 4
+    saturated(limiter)
+    limiter.release(0.1)
+    assert limiter.limit == pytest.approx(4.25)
+    for _ in range(100):
+        saturated(limiter)
+        limiter.release(0.1)
+    assert limiter.limit == 8
+
+
+def test_throttled_call_halves_the_limit_once_per_baseline_window():
+    limiter = AdaptiveLimiter(initial=16, min_limit=2, backoff=0.5)
+    saturated(limiter)
+    limiter.release(0.01)
+    assert limiter.baseline == pytest.approx(0.01)
+    limiter.active = 3
+    limiter.release(0.01, throttled=True)
+    assert limiter.limit == pytest.approx(8.03125)
+    # the rest of the same burst does not compound the decrease
+    limiter.active = 2
+    limiter.release(0.01, throttled=True)
+    assert limiter.limit == pytest.approx(8.03125)
+    assert limiter.throttled == 2
+    assert limiter.decreases == 1
+    time.sleep(0.02)
+    limiter.active = 1
+    limiter.release(0.01, throttled=True)
+    assert limiter.limit == pytest.approx(4.015625)
+
+
+def test_decrease_never_goes_below_the_minimum():
+    limiter = AdaptiveLimiter(initial=4, min_limit=3, backoff=0.5)
+    limiter.active = 1
+    limiter.release(0.01, throttled=True)
+    assert limiter.limit == 3
+
+
+def test_timeouts_and_latency_spikes_decrease_the_limit():
+    from openai import APITimeoutError
+
+    limiter = AdaptiveLimiter(initial=16, backoff=0.5, latency_tolerance=2.0)
+    limiter.active = 1
+    limiter.release(0.01)
+    limiter.active = 1
+    limiter.release(0.05)
+    assert limiter.spikes == 1
+    assert limiter.limit == 8
+    # a spike is not folded into the baseline
+    assert limiter.baseline == pytest.approx(0.01)
+    time.sleep(0.02)
+    limiter.active = 1
+    limiter.release(0.01, exc=APITimeoutError(request=SimpleNamespace()))
+    assert limiter.timeouts == 1
+    assert limiter.limit == 4
+
+
+def test_baseline_follows_faster_calls_quickly_and_slower_ones_slowly():
+    limiter = AdaptiveLimiter(initial=4, smoothing=0.05, latency_tolerance=10)
+    limiter.active = 1
+    limiter.release(1.0)
+    limiter.active = 1
+    limiter.release(0.5)
+    assert limiter.baseline == pytest.approx(0.75)
+    limiter.active = 1
+    limiter.release(1.75)
+    assert limiter.baseline == pytest.approx(0.8)
+
+
+def test_local_rejections_and_cancellations_leave_the_limit_alone():
+    limiter = AdaptiveLimiter(initial=8)
+    limiter.active = 2
+    limiter.release(30.0, exc=LLMOverloaded("queue full", 1))
+    limiter.release(30.0, exc=asyncio.CancelledError())
+    assert limiter.limit == 8
+    assert limiter.decreases == 0
+    assert limiter.baseline is None
+
+
+def test_retried_429_marks_the_slot_throttled():
+    async def main():
+        limiter = AdaptiveLimiter(initial=8, backoff=0.5)
+        async with limiter:
+            await AdaptiveLimiter.observe_response(SimpleNamespace(status_code=200))
+            assert not _current_slot.get().throttled
+            await AdaptiveLimiter.observe_response(SimpleNamespace(status_code=429))
+        assert limiter.throttled == 1
+        assert limiter.limit == 4
+
+    run(main())
+
+
+def test_latency_is_measured_from_the_scheduler_grant():
+    async def main():
+        limiter = AdaptiveLimiter(initial=8)
+        async with limiter:
+            await asyncio.sleep(0.05)
+            # time queued in the LLMScheduler before this point is not upstream latency
+            on_grant.get()()
+        assert limiter.latency < 0.04
+
+    run(main())
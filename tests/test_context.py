@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+import pytest
+
+from graphrag.model import TextUnit
+from graphrag.vector_stores.lancedb import LanceDBVectorStore
+
+from my_context import AdaptiveContext, cosine_score
+
+
+class _Encoder:
+    def encode(self, text):
+        return text.split()
+
+
+def context(**kwargs):
+    return AdaptiveContext(_Encoder(), **kwargs)
+
+
+@pytest.mark.parametrize("degrees", [0, 20, 60, 90, 150])
+def test_cosine_score_converts_lancedb_scores_of_unit_vectors(degrees):
+    u = np.array([1.0, 0.0])
+    v = np.array([math.cos(math.radians(degrees)), math.sin(math.radians(degrees))])
+    # graphrag's LanceDB store reports 1 - squared L2 distance
+    lancedb_score = 1 - float(np.sum((u - v) ** 2))
+    assert cosine_score(LanceDBVectorStore(collection_name="entities"), lancedb_score) == pytest.approx(float(u @ v))
+
+
+def test_cosine_score_passes_other_stores_through():
+    assert cosine_score(object(), 0.42) == 0.42
+
+
+def test_plan_without_scores_uses_the_full_budget():
+    assert context().plan([]) == (10, 400)
+
+
+def test_plan_single_sharp_match_gets_the_minimum():
+    assert context().plan([0.9, 0.6, 0.55, 0.5]) == (3, 200)
+
+
+def test_plan_many_close_matches_are_capped_at_the_maximum():
+    assert context().plan([0.8] * 20) == (10, 400)
+
+
+def test_plan_scales_tokens_linearly_between_the_bounds():
+    # 6 scores within the 0.08 margin: 3 of the 7 steps between 3 and 10 entities
+    entities, tokens = context().plan([0.80, 0.79, 0.78, 0.77, 0.76, 0.75, 0.6])
+    assert entities == 6
+    assert tokens == int(200 + 200 * 3 / 7)
+
+
+def test_plan_ignores_matches_below_min_score():
+    assert context(min_score=0.7).plan([0.72, 0.71, 0.70, 0.69, 0.68, 0.67])[0] == 3
+    assert context(min_score=0.5).plan([0.72, 0.71, 0.70, 0.69, 0.68, 0.67])[0] == 6
+
+
+NAVIGATION = "首页 | 产品中心 | 联系我们"
+
+
+def fitted():
+    units = [TextUnit(id=str(i), short_id=str(i), text=f"第 {i} 页的正文\n{NAVIGATION}\n") for i in range(6)]
+    return context().fit(units)
+
+
+def test_fit_collects_lines_repeated_across_text_units():
+    assert fitted().boilerplate == frozenset({NAVIGATION})
+
+
+def test_compress_strips_boilerplate_and_duplicate_rows_from_sources_only():
+    text = "\n".join([
+        "-----Entities-----",
+        "id|entity|description",
+        f"1|公司|{NAVIGATION}",
+        "",
+        "-----Sources-----",
+        "id|text",
+        "11|公司成立于 2001 年，总部位于上海",
+        NAVIGATION,
+        f"12|{NAVIGATION}",
+        "13|公司成立于 2001 年，总部位于上海",
+        NAVIGATION,
+        "14|客服电话 400-000-0000",
+        "",
+        "-----Relationships-----",
+        "id|source|target",
+    ])
+    compressed, kept_ids, removed_lines, removed_rows = fitted().compress(text)
+    assert compressed == "\n".join([
+        "-----Entities-----",
+        "id|entity|description",
+        f"1|公司|{NAVIGATION}",
+        "",
+        "-----Sources-----",
+        "id|text",
+        "11|公司成立于 2001 年，总部位于上海",
+        "14|客服电话 400-000-0000",
+        "",
+        "-----Relationships-----",
+        "id|source|target",
+    ])
+    assert kept_ids == {"11", "14"}
+    assert removed_lines == 3
+    assert removed_rows == 2
+
+
+def test_compress_leaves_text_without_anything_to_remove_unchanged():
+    text = "-----Sources-----\nid|text\n1|甲\n2|乙"
+    assert fitted().compress(text) == (text, {"1", "2"}, 0, 0)
+    assert fitted().compress("-----Entities-----\nid|entity") == ("-----Entities-----\nid|entity", set(), 0, 0)
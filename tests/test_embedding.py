@@ -0,0 +1,163 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from my_embedding import MicroBatchEmbedder, embed_documents
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class _Encoder:
+    def encode(self, text):
+        return text.split()
+
+
+class _Embeddings:
+    """``embeddings.create`` that rejects requests with more than ``limit`` inputs, like DashScope."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.requests = []
+
+    def create(self, input, model):
+        self.requests.append(len(input))
+        if len(input) > self.limit:
+            request = httpx.Request("POST", "http://embedding/v1/embeddings")
+            raise openai.BadRequestError("batch size is invalid", response=httpx.Response(400, request=request), body=None)
+        data = [type("Item", (), {"index": i, "embedding": [float(len(text)), 1.0]}) for i, text in enumerate(input)]
+        return type("Response", (), {"data": data})
+
+
+class _Embedder:
+    def __init__(self, limit):
+        self.model = "text-embedding-v2"
+        self.max_tokens = 8191
+        self.max_retries = 3
+        self.retry_error_types = (openai.RateLimitError,)
+        self.token_encoder = _Encoder()
+        self.embeddings = _Embeddings(limit)
+        self.sync_client = type("Client", (), {"embeddings": self.embeddings})
+
+
+def test_embed_documents_halves_a_rejected_batch_and_keeps_the_smaller_size():
+    embedder = _Embedder(limit=25)
+    texts = ["x" * n for n in range(1, 101)]
+    vectors = embed_documents(embedder, texts, batch_size=64)
+    # 64 rejected, then 32 rejected, then batches of 16
+    assert embedder.embeddings.requests == [64, 32, 16, 16, 16, 16, 16, 16, 4]
+    assert len(vectors) == 100
+    assert vectors[0] == pytest.approx([1 / 2 ** 0.5, 1 / 2 ** 0.5])
+    assert vectors[99][0] > 0.99
+
+
+def test_embed_documents_raises_when_a_single_text_is_rejected():
+    embedder = _Embedder(limit=0)
+    with pytest.raises(openai.BadRequestError):
+        embed_documents(embedder, ["a", "b"])
+    assert embedder.embeddings.requests == [2, 1]
+
+
+class _Batcher(MicroBatchEmbedder):
+    """Records the batches it would send; the vector of a text is ``[len(text), pid]``."""
+
+    def __init__(self, fail=False, **kwargs):
+        super().__init__(_Embedder(limit=100), **kwargs)
+        self.fail = fail
+        self.sent = []
+        self.sent_lock = threading.Lock()
+
+    def _embed_batch(self, texts):
+        with self.sent_lock:
+            self.sent.append(list(texts))
+        if self.fail:
+            raise RuntimeError("embedding endpoint down")
+        return [[float(len(text)), float(os.getpid())] for text in texts]
+
+
+def test_micro_batch_embedder_splits_at_max_batch_size():
+    async def main():
+        embedder = _Batcher(max_batch_size=4, max_wait_ms=1000)
+        start = time.perf_counter()
+        texts = ["x" * n for n in range(1, 9)]
+        vectors = await asyncio.gather(*(embedder.aembed(text) for text in texts))
+        # full batches go out without waiting for max_wait
+        assert time.perf_counter() - start < 0.5
+        assert [len(batch) for batch in embedder.sent] == [4, 4]
+        assert [vector[0] for vector in vectors] == list(range(1, 9))
+        assert embedder.stats()["batch_sizes"] == {4: 2}
+
+    run(main())
+
+
+def test_micro_batch_embedder_sends_a_partial_batch_after_max_wait():
+    async def main():
+        embedder = _Batcher(max_batch_size=16, max_wait_ms=50)
+        start = time.perf_counter()
+        vectors = await asyncio.gather(*(embedder.aembed(text) for text in ["a", "bb", "ccc"]))
+        assert time.perf_counter() - start >= 0.045
+        assert embedder.sent == [["a", "bb", "ccc"]]
+        assert [vector[0] for vector in vectors] == [1, 2, 3]
+
+    run(main())
+
+
+def test_micro_batch_embedder_routes_each_vector_to_its_caller():
+    embedder = _Batcher(max_batch_size=16, max_wait_ms=20)
+    texts = ["a", "bb", "a", "dddd", "bb", "eeeee"]
+    results = [None] * len(texts)
+
+    def call(i):
+        results[i] = embedder.embed(texts[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [vector[0] for vector in results] == [len(text) for text in texts]
+    # a text asked for twice in one batch is sent once
+    assert all(len(batch) == len(set(batch)) for batch in embedder.sent)
+    assert embedder.stats()["texts"] == len(texts)
+
+
+def test_micro_batch_embedder_fails_every_waiter_of_a_failed_batch():
+    async def main():
+        embedder = _Batcher(fail=True, max_batch_size=16, max_wait_ms=20)
+        results = await asyncio.gather(*(embedder.aembed(text) for text in ["a", "b", "c"]), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert embedder.stats()["errors"] == len(embedder.sent) == 1
+        # the next batch is sent as usual
+        embedder.fail = False
+        assert (await embedder.aembed("dd"))[0] == 2
+
+    run(main())
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_micro_batch_embedder_restarts_its_dispatcher_after_fork():
+    embedder = _Batcher(max_batch_size=16, max_wait_ms=1)
+    assert embedder.embed("parent")[1] == os.getpid()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # a child left without a dispatcher would wait forever
+        signal.alarm(5)
+        try:
+            vector = embedder.embed("child")
+            os.write(write, f"{int(vector[1])}".encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        answer = pipe.read()
+    os.waitpid(pid, 0)
+    assert answer == str(pid)
+    assert embedder.embed("parent again")[1] == os.getpid()
@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from my_facts import Fact, FactIndex, FactMatcher, extract_facts, find_contacts
+
+COMPANY = "湖南平安医械科技有限公司"
+
+
+def index(extra=(), entities=()):
+    facts = [
+        Fact(COMPANY, "phone", "0731-12345678"),
+        Fact(COMPANY, "phone", "0731 12345678"),
+        Fact(COMPANY, "email", "service@example.com"),
+        Fact(COMPANY, "address", "长沙市岳麓区麓谷大道100号"),
+        Fact(COMPANY, "address", "湖南省长沙市岳麓区麓谷大道100号"),
+        *extra,
+    ]
+    return FactIndex(facts, entities)
+
+
+def test_find_contacts_extracts_each_kind():
+    found = find_contacts("电话：0731-12345678，邮箱 Service@Example.com，官网 www.example.com/，地址：湖南省长沙市岳麓区麓谷大道100号。")
+    assert ("phone", "0731-12345678") in found
+    assert ("email", "service@example.com") in found
+    assert ("website", "www.example.com") in found
+    assert ("address", "湖南省长沙市岳麓区麓谷大道100号") in found
+
+
+def test_extract_facts_reads_the_claim_columns():
+    df = pd.DataFrame({
+        "subject_id": [COMPANY, None],
+        "description": ["联系电话 400-123-4567", "电话 400-765-4321"],
+        "source_text": [None, None],
+    })
+    assert extract_facts(df) == [Fact(COMPANY, "phone", "400-123-4567")]
+
+
+def test_index_merges_formatting_variants_and_contained_addresses():
+    facts = index()
+    assert facts.values[COMPANY]["phone"] == {"0731-12345678": 2}
+    assert facts.values[COMPANY]["address"] == {"湖南省长沙市岳麓区麓谷大道100号": 2}
+    assert facts.primary == COMPANY
+    assert facts.primary_share == 1.0
+
+
+@pytest.mark.parametrize("question, kinds", [
+    ("你们的电话是多少", ["phone"]),
+    ("公司邮箱", ["email"]),
+    ("你们公司在哪里", ["address"]),
+    ("where is your company located?", ["address"]),
+    ("怎么联系你们", ["phone", "email"]),
+])
+def test_short_contact_questions_are_answered(question, kinds):
+    answer = FactMatcher().answer(index(), question)
+    assert answer is not None
+    assert answer.kinds == kinds
+    assert answer.subject == COMPANY
+    assert answer.confidence >= 0.7
+
+
+@pytest.mark.parametrize("question", [
+    "产品在哪里生产",
+    "哪里可以维修呢",
+    "血压计的价格和电话",
+    "这个产品的功能有哪些，怎么联系售后",
+    "请介绍一下贵公司的发展历史以及主要产品线和电话",
+    "hotel booking",
+])
+def test_other_questions_go_to_local_search(question):
+    assert FactMatcher().answer(index(), question) is None
+
+
+def test_question_about_another_entity_is_not_answered_with_the_owner_details():
+    facts = index(entities=[COMPANY, "长沙分公司"])
+    assert FactMatcher().answer(facts, "长沙分公司电话") is None
+
+
+def test_unnamed_subject_confidence_follows_the_primary_share():
+    # the owner holds 5 of 11 contact facts: sqrt(5 / 11) is below the threshold
+    others = [Fact(f"经销商{i}", "phone", f"0731-8765432{i}") for i in range(6)]
+    matcher = FactMatcher()
+    assert matcher.answer(index(others), "电话") is None
+    named = matcher.answer(index(others), f"{COMPANY}电话")
+    assert named is not None and named.confidence == 1.0
+    assert matcher.stats()["answered"] == 1
+    assert matcher.stats()["low_confidence"] == 1
+
+
+def test_tied_values_lower_the_confidence():
+    tied = [Fact(COMPANY, "email", "sales@example.com")]
+    answer = FactMatcher(min_confidence=0.5).answer(index(tied), "邮箱")
+    assert answer.confidence == pytest.approx(0.9)
+    assert "service@example.com" in answer.text and "sales@example.com" in answer.text
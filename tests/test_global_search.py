@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.search import NO_DATA_ANSWER
+
+from my_global_search import EarlyStop, GlobalSearch, MapProgress, SearchUsage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class _Encoder:
+    def encode(self, text):
+        return text.split()
+
+
+class _ContextBuilder:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def build_context(self, conversation_history=None, **kwargs):
+        return list(self.chunks), {"reports": len(self.chunks)}
+
+
+class _LLM:
+    def __init__(self):
+        self.prompts = []
+
+    async def astream_generate(self, messages, callbacks=None, **kwargs):
+        self.prompts.append(messages[0]["content"])
+        for token in ["答", "案"]:
+            yield token
+
+
+class _Search(GlobalSearch):
+    """Map calls answer from ``answers`` (chunk -> key point scores); chunks without one never finish."""
+
+    def __init__(self, answers, chunks, **kwargs):
+        self.llm_stub = _LLM()
+        super().__init__(
+            llm=self.llm_stub,
+            context_builder=_ContextBuilder(chunks),
+            token_encoder=_Encoder(),
+            json_mode=False,
+            **kwargs,
+        )
+        self.answers = answers
+        self.cancelled = []
+
+    async def _map_response_single_batch(self, context_data, query, **llm_kwargs):
+        try:
+            if context_data not in self.answers:
+                await asyncio.Event().wait()
+            await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            self.cancelled.append(context_data)
+            raise
+        points = [{"answer": f"{context_data} 要点 {i}", "score": score} for i, score in enumerate(self.answers[context_data])]
+        return SearchResult(
+            response=points, context_data=context_data, context_text=context_data,
+            completion_time=0.0, llm_calls=1, prompt_tokens=10,
+        )
+
+
+async def collect(search, query="问题"):
+    return [response async for response in search.astream_search(query)]
+
+
+def test_early_stop_reasons():
+    policy = EarlyStop(min_key_points=8, min_fraction=0.5, deadline=20)
+    assert policy.reason(completed=4, total=4, key_points=0, elapsed=0) == "complete"
+    assert policy.reason(completed=2, total=4, key_points=8, elapsed=0) == "key_points"
+    # enough key points but not enough of the calls done yet
+    assert policy.reason(completed=1, total=4, key_points=20, elapsed=0) is None
+    assert policy.reason(completed=1, total=4, key_points=0, elapsed=20) == "deadline"
+    # past the deadline the first answer is still awaited
+    assert policy.reason(completed=0, total=4, key_points=0, elapsed=30) is None
+
+
+def test_early_stop_counts_key_points_at_or_above_min_score():
+    policy = EarlyStop(min_score=60)
+    result = SearchResult(
+        response=[{"score": 60}, {"score": 59}, {"score": "80"}, "text", {"score": 100}],
+        context_data={}, context_text="", completion_time=0.0, llm_calls=1, prompt_tokens=0,
+    )
+    assert policy.key_points(result) == 2
+    result.response = "not json"
+    assert policy.key_points(result) == 0
+
+
+def test_global_search_completes_the_map_phase_when_early_stop_never_triggers():
+    async def main():
+        policy = EarlyStop(min_key_points=100)
+        search = _Search({"a": [80], "b": [70], "c": [0]}, ["a", "b", "c"], early_stop=policy)
+        responses = await collect(search)
+        assert responses[0] == {"reports": 3}
+        assert responses[1] == MapProgress(completed=0, total=3)
+        assert MapProgress(completed=3, total=3) in responses
+        assert [response for response in responses if isinstance(response, str)] == ["答", "案"]
+        assert search.cancelled == []
+        assert policy.stats() == {"queries": 1, "stopped_early": 0, "skipped_calls": 0, "saved_seconds_est": 0.0}
+
+    run(main())
+
+
+def test_global_search_key_points_cancel_the_pending_map_calls():
+    async def main():
+        policy = EarlyStop(min_key_points=8, min_score=60, min_fraction=0.5, deadline=60)
+        search = _Search({"a": [80] * 4, "b": [90] * 4}, ["a", "b", "c", "d"], early_stop=policy)
+        responses = await collect(search)
+        await settle()
+        assert sorted(search.cancelled) == ["c", "d"]
+        assert policy.stats()["stopped_early"] == 1
+        assert policy.stats()["skipped_calls"] == 2
+        # the reduce only saw the key points that arrived
+        assert "a 要点 0" in search.llm_stub.prompts[0] and "c 要点" not in search.llm_stub.prompts[0]
+        assert responses[-1] == SearchUsage(
+            llm_calls=3, prompt_tokens=20 + len(search.llm_stub.prompts[0].split())
+        )
+
+    run(main())
+
+
+def test_global_search_deadline_cancels_the_pending_map_calls():
+    async def main():
+        policy = EarlyStop(min_key_points=8, deadline=0.05)
+        search = _Search({"a": [80]}, ["a", "b", "c"], early_stop=policy, heartbeat_interval=1.0)
+        responses = await asyncio.wait_for(collect(search), timeout=5)
+        await settle()
+        assert sorted(search.cancelled) == ["b", "c"]
+        assert policy.stats()["skipped_calls"] == 2
+        assert responses[-1].llm_calls == 2
+
+    run(main())
+
+
+def test_global_search_cancels_the_map_calls_when_the_stream_is_closed():
+    async def main():
+        search = _Search({}, ["a", "b"])
+        stream = search.astream_search("问题")
+        assert await stream.__anext__() == {"reports": 2}
+        assert await stream.__anext__() == MapProgress(completed=0, total=2)
+        await settle()
+        await stream.aclose()
+        await settle()
+        assert sorted(search.cancelled) == ["a", "b"]
+
+    run(main())
+
+
+def test_global_search_usage_without_key_points_has_no_reduce_call():
+    async def main():
+        search = _Search({"a": [0], "b": [0]}, ["a", "b"])
+        result = await search.asearch("问题")
+        assert result.response == NO_DATA_ANSWER
+        assert search.llm_stub.prompts == []
+        assert (result.llm_calls, result.prompt_tokens) == (2, 20)
+        assert result.context_data == {"reports": 2}
+
+    run(main())
+
+
+@pytest.mark.parametrize("scores", [[80, 70], [50]])
+def test_global_search_asearch_totals_match_the_streamed_usage(scores):
+    async def main():
+        search = _Search({"a": scores, "b": scores}, ["a", "b"])
+        result = await search.asearch("问题")
+        assert result.response == "答案"
+        assert result.llm_calls == 3
+        assert result.prompt_tokens == 20 + len(search.llm_stub.prompts[0].split())
+
+    run(main())
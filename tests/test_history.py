@@ -0,0 +1,136 @@
+import asyncio
+
+from my_history import HistoryCompactor
+from my_scheduler import Priority, llm_priority
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def drain(compactor):
+    """Wait until the background summaries have finished."""
+    for _ in range(500):
+        await asyncio.sleep(0.01)
+        if compactor.stats()["summaries_pending"] == 0:
+            return
+    raise AssertionError("summary still pending")
+
+
+class _Encoder:
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class _LLM:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    async def agenerate(self, messages, streaming=True, callbacks=None, **kwargs):
+        self.calls.append(llm_priority.get())
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return "摘要"
+
+
+def conversation(exchanges):
+    """A system message, ``exchanges`` user/assistant pairs of 10 words each, and the current question."""
+    turns = [{"role": "system", "content": "system prompt"}]
+    for i in range(exchanges):
+        turns.append({"role": "user", "content": f"question{i} " + "w " * 9})
+        turns.append({"role": "assistant", "content": f"answer{i} " + "w " * 9})
+    turns.append({"role": "user", "content": "current question"})
+    return turns
+
+
+# every history message is 10 words + 4 overhead = 14 tokens
+def compactor(llm):
+    return HistoryCompactor(llm, _Encoder(), budget_tokens=100, summary_max_tokens=10)
+
+
+def test_history_under_budget_is_returned_unchanged():
+    async def main():
+        llm = _LLM()
+        history = compactor(llm)
+        turns = conversation(3)
+        result = await history.compact(turns)
+        assert result.turns is turns
+        assert result.tokens_before == result.tokens_after
+        await drain(history)
+        assert llm.calls == []
+
+    run(main())
+
+
+def test_history_split_keeps_system_and_current_message():
+    async def main():
+        llm = _LLM()
+        history = compactor(llm)
+        turns = conversation(5)
+        result = await history.compact(turns)
+        # no summary yet: the older turns are dropped and the last 50 tokens (3 messages) kept
+        assert result.turns == [turns[0]] + turns[8:]
+        assert result.summarized == 7
+        assert not result.summary_cached
+        assert result.tokens_after < result.tokens_before
+        await drain(history)
+        assert llm.calls == [Priority.BATCH]
+
+        result = await history.compact(turns)
+        assert result.summary_cached
+        assert result.turns[0] == turns[0]
+        assert result.turns[1] == {"role": "system", "content": "此前对话摘要：\n摘要"}
+        assert result.turns[2:] == turns[8:]
+
+    run(main())
+
+
+def test_history_cached_summary_serves_a_grown_conversation_without_llm_call():
+    async def main():
+        llm = _LLM()
+        history = compactor(llm)
+        await history.compact(conversation(5))
+        await drain(history)
+        assert len(llm.calls) == 1
+
+        grown = conversation(6)
+        result = await history.compact(grown)
+        assert result.summary_cached
+        assert result.summarized == 7
+        assert result.turns[2:] == grown[8:]
+        await drain(history)
+        assert len(llm.calls) == 1
+        assert history.stats()["summary_hits"] == 1
+
+    run(main())
+
+
+def test_history_summary_failure_keeps_dropping_older_turns():
+    async def main():
+        llm = _LLM(fail=True)
+        history = compactor(llm)
+        turns = conversation(5)
+        for _ in range(2):
+            result = await history.compact(turns)
+            assert result.turns == [turns[0]] + turns[8:]
+            assert not result.summary_cached
+            await drain(history)
+        assert history.stats()["summary_failures"] == 2
+        assert history.stats()["summaries"] == 0
+
+    run(main())
+
+
+def test_history_concurrent_requests_share_one_summary_call():
+    async def main():
+        llm = _LLM()
+        history = compactor(llm)
+        await asyncio.gather(*(history.compact(conversation(5)) for _ in range(3)))
+        await drain(history)
+        assert len(llm.calls) == 1
+
+    run(main())
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+import pytest
+
+from my_index import IndexGeneration
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def generation(version="v1"):
+    return IndexGeneration(version, object(), object(), object(), memory_bytes=2 ** 20)
+
+
+def test_generation_closes_on_retire_when_idle():
+    async def main():
+        current = generation()
+        current.retire(drain_timeout=10)
+        assert current.closed
+        assert current.local_search_engine is None
+        assert current.global_search_engine is None
+        assert current.question_generator is None
+
+    run(main())
+
+
+def test_generation_stays_open_until_the_last_request_releases_it():
+    async def main():
+        current = generation()
+        first = current.acquire()
+        current.acquire()
+        assert first is current and current.active == 2
+        current.retire()
+        assert current.retired and not current.closed
+        assert current.local_search_engine is not None
+        current.release()
+        assert not current.closed
+        current.release()
+        assert current.closed and current.active == 0
+
+    run(main())
+
+
+def test_release_without_retire_keeps_the_generation_open():
+    current = generation()
+    current.acquire()
+    current.release()
+    assert not current.closed
+
+
+def test_release_after_releases_when_the_stream_ends_or_is_abandoned():
+    async def body():
+        yield "a"
+        yield "b"
+
+    async def main():
+        finished = generation()
+        finished.acquire()
+        finished.retire()
+        assert [item async for item in finished.release_after(body())] == ["a", "b"]
+        assert finished.closed
+
+        abandoned = generation()
+        abandoned.acquire()
+        abandoned.retire()
+        stream = abandoned.release_after(body())
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        assert abandoned.closed
+
+    run(main())
+
+
+def test_drain_timeout_only_logs_and_the_generation_still_closes_on_release(caplog):
+    async def main():
+        current = generation()
+        current.acquire()
+        with caplog.at_level(logging.WARNING, logger="my_index"):
+            current.retire(drain_timeout=0.01)
+            await asyncio.sleep(0.05)
+        assert not current.closed
+        assert current.local_search_engine is not None
+        assert "v1" in caplog.text
+        current.release()
+        assert current.closed
+
+    run(main())
+
+
+def test_close_before_the_drain_timeout_cancels_it(caplog):
+    async def main():
+        current = generation()
+        current.acquire()
+        with caplog.at_level(logging.WARNING, logger="my_index"):
+            current.retire(drain_timeout=0.01)
+            current.release()
+            await asyncio.sleep(0.05)
+        assert current.closed
+        assert not [record for record in caplog.records if record.levelno >= logging.WARNING]
+
+    run(main())
+
+
+def test_generation_stats():
+    current = generation()
+    current.acquire()
+    stats = current.stats()
+    assert stats["version"] == "v1"
+    assert stats["active_requests"] == 1
+    assert stats["memory_mb"] == pytest.approx(1.0)
+    assert stats["facts"] == 0
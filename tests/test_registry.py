@@ -0,0 +1,141 @@
+import asyncio
+
+from my_index import IndexGeneration
+from my_registry import IndexRegistry
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Loader:
+    """Builds stub generations of ``sizes[input_dir]`` bytes once ``release`` is set."""
+
+    def __init__(self, sizes=None):
+        self.sizes = sizes or {}
+        self.versions = {}
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, input_dir):
+        self.calls.append(input_dir)
+        await self.release.wait()
+        return IndexGeneration(
+            self.fingerprint(input_dir), object(), object(), object(), memory_bytes=self.sizes.get(input_dir, 100)
+        )
+
+    def fingerprint(self, input_dir):
+        return self.versions.get(input_dir, f"{input_dir}-v1")
+
+
+def test_concurrent_first_requests_share_one_load():
+    async def main():
+        loader = Loader()
+        loader.release.clear()
+        registry = IndexRegistry(loader, loader.fingerprint)
+        requests = [asyncio.create_task(registry.acquire("site-a")) for _ in range(5)]
+        await settle()
+        assert loader.calls == ["site-a"]
+        assert registry.stats()["loading"] == ["site-a"]
+        loader.release.set()
+        generations = await asyncio.gather(*requests)
+        assert all(generation is generations[0] for generation in generations)
+        assert generations[0].active == 5
+        assert registry.loads == 1
+        assert registry.stats()["loading"] == []
+
+    run(main())
+
+
+def test_cancelled_first_request_does_not_cancel_the_shared_load():
+    async def main():
+        loader = Loader()
+        loader.release.clear()
+        registry = IndexRegistry(loader, loader.fingerprint)
+        first = asyncio.create_task(registry.acquire("site-a"))
+        second = asyncio.create_task(registry.acquire("site-a"))
+        await settle()
+        first.cancel()
+        await settle()
+        loader.release.set()
+        generation = await second
+        assert generation.active == 1
+        assert loader.calls == ["site-a"]
+
+    run(main())
+
+
+def test_reload_swaps_in_a_new_version_and_retires_the_old_one():
+    async def main():
+        loader = Loader()
+        retired = []
+        registry = IndexRegistry(loader, loader.fingerprint, on_retire=retired.append)
+        old = await registry.acquire("site-a")
+        assert await registry.reload("site-a") is old
+        assert loader.calls == ["site-a"]
+
+        loader.versions["site-a"] = "site-a-v2"
+        new = await registry.reload("site-a")
+        assert new.version == "site-a-v2"
+        assert retired == [old]
+        # the request still holding the old generation keeps it open until it finishes
+        assert old.retired and not old.closed
+        old.release()
+        assert old.closed
+        assert (await registry.acquire("site-a")) is new
+
+    run(main())
+
+
+def test_eviction_retires_least_recently_used_until_within_budget():
+    async def main():
+        loader = Loader(sizes={"a": 400, "b": 400, "c": 400})
+        retired = []
+        registry = IndexRegistry(loader, loader.fingerprint, memory_budget=1000, on_retire=retired.append)
+        a = await registry.acquire("a")
+        b = await registry.acquire("b")
+        # touching a makes b the least recently used
+        await registry.acquire("a")
+        await registry.acquire("c")
+        assert list(registry.loaded()) == ["a", "c"]
+        assert retired == [b]
+        assert registry.evictions == 1
+        assert registry.memory_bytes() == 800
+        # a request still holding b keeps it open
+        assert b.retired and not b.closed
+        b.release()
+        assert b.closed
+        assert not a.retired
+
+    run(main())
+
+
+def test_an_index_over_the_budget_on_its_own_stays_loaded():
+    async def main():
+        loader = Loader(sizes={"a": 300, "huge": 5000})
+        registry = IndexRegistry(loader, loader.fingerprint, memory_budget=1000)
+        a = await registry.acquire("a")
+        huge = await registry.acquire("huge")
+        assert list(registry.loaded()) == ["huge"]
+        assert a.retired
+        assert not huge.retired
+
+    run(main())
+
+
+def test_zero_budget_disables_eviction():
+    async def main():
+        loader = Loader(sizes={"a": 10 ** 9, "b": 10 ** 9})
+        registry = IndexRegistry(loader, loader.fingerprint, memory_budget=0)
+        await registry.acquire("a")
+        await registry.acquire("b")
+        assert list(registry.loaded()) == ["a", "b"]
+        assert registry.evictions == 0
+
+    run(main())
@@ -0,0 +1,200 @@
+import asyncio
+import time
+
+import pytest
+
+from my_scheduler import LLMOverloaded, LLMScheduler, Priority, ScheduledLLM, llm_priority, priority, reported_usage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_grants_immediately_below_the_concurrency_limit():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=2)
+        await scheduler.acquire(10, Priority.INTERACTIVE)
+        await scheduler.acquire(10, Priority.MAP)
+        assert scheduler.active == 2
+        assert scheduler.admitted == 2
+        scheduler.release()
+        scheduler.release()
+        assert scheduler.active == 0
+
+    run(main())
+
+
+def test_waiters_are_served_by_priority_then_fifo():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1)
+        await scheduler.acquire(1, Priority.INTERACTIVE)
+        order = []
+
+        async def call(name, prio):
+            await scheduler.acquire(1, prio)
+            order.append(name)
+            scheduler.release()
+
+        tasks = [
+            asyncio.create_task(call("batch", Priority.BATCH)),
+            asyncio.create_task(call("map-1", Priority.MAP)),
+            asyncio.create_task(call("interactive-1", Priority.INTERACTIVE)),
+            asyncio.create_task(call("map-2", Priority.MAP)),
+            asyncio.create_task(call("interactive-2", Priority.INTERACTIVE)),
+        ]
+        await settle()
+        assert order == []
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert order == ["interactive-1", "interactive-2", "map-1", "map-2", "batch"]
+
+    run(main())
+
+
+def test_admit_counts_only_waiters_at_or_above_the_priority():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=2)
+        await scheduler.acquire(1, Priority.INTERACTIVE)
+        maps = [asyncio.create_task(scheduler.acquire(1, Priority.MAP)) for _ in range(3)]
+        await settle()
+        # queued map calls never block interactive admission
+        scheduler.admit()
+        interactive = [asyncio.create_task(scheduler.acquire(1, Priority.INTERACTIVE)) for _ in range(2)]
+        await settle()
+        with pytest.raises(LLMOverloaded) as excinfo:
+            scheduler.admit()
+        assert excinfo.value.retry_after >= 1
+        assert scheduler.rejected == 1
+        # a third interactive waiter is rejected on entry rather than queued
+        with pytest.raises(LLMOverloaded):
+            await scheduler.acquire(1, Priority.INTERACTIVE)
+        for task in maps + interactive:
+            task.cancel()
+        await asyncio.gather(*maps, *interactive, return_exceptions=True)
+        assert scheduler.stats()["queued"] == {"interactive": 0, "map": 0, "batch": 0}
+
+    run(main())
+
+
+def test_queue_deadline_raises_and_leaves_the_queue():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, queue_timeouts={Priority.INTERACTIVE: 1, Priority.MAP: 0.05})
+        await scheduler.acquire(1, Priority.INTERACTIVE)
+        with pytest.raises(LLMOverloaded):
+            await scheduler.acquire(1, Priority.MAP)
+        assert scheduler.timed_out == 1
+        assert scheduler._queue == []
+        scheduler.release()
+        assert scheduler.active == 0
+
+    run(main())
+
+
+def test_cancelled_waiter_is_removed_and_does_not_take_a_slot():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1)
+        await scheduler.acquire(1, Priority.INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire(1, Priority.INTERACTIVE))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler._queue == []
+        scheduler.release()
+        assert scheduler.active == 0
+
+    run(main())
+
+
+def test_token_budget_delays_calls_until_the_bucket_refills():
+    async def main():
+        # 6000 tokens per minute refill at 100 tokens per second
+        scheduler = LLMScheduler(max_concurrency=10, tokens_per_minute=6000)
+        await scheduler.acquire(6000, Priority.INTERACTIVE)
+        start = time.monotonic()
+        await scheduler.acquire(10, Priority.INTERACTIVE)
+        assert time.monotonic() - start >= 0.05
+        assert scheduler.active == 2
+
+    run(main())
+
+
+def test_release_refunds_unused_tokens():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=10, tokens_per_minute=6000)
+        await scheduler.acquire(5000, Priority.INTERACTIVE)
+        scheduler.release(refund_tokens=4000)
+        assert scheduler.stats()["tokens_available"] >= 5000
+
+    run(main())
+
+
+def test_call_larger_than_the_bucket_runs_once_the_bucket_is_full():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=10, tokens_per_minute=600)
+        await asyncio.wait_for(scheduler.acquire(10_000, Priority.INTERACTIVE), 1)
+        assert scheduler.active == 1
+
+    run(main())
+
+
+def test_priority_context_sets_the_class_of_calls_and_tasks_inside():
+    async def main():
+        seen = {}
+
+        async def probe(name):
+            seen[name] = llm_priority.get()
+
+        with priority(Priority.BATCH):
+            task = asyncio.create_task(probe("task"))
+        await task
+        await probe("outside")
+        assert seen == {"task": Priority.BATCH, "outside": Priority.INTERACTIVE}
+
+    run(main())
+
+
+class _LLM:
+    def __init__(self, usage=None):
+        self.calls = []
+        self.usage = usage
+
+    async def agenerate(self, messages, streaming=True, callbacks=None, **kwargs):
+        self.calls.append(llm_priority.get())
+        if self.usage is not None:
+            reported_usage.set(self.usage)
+        return "one two"
+
+    async def astream_generate(self, messages, callbacks=None, **kwargs):
+        for token in ["one", "two"]:
+            yield token
+
+
+def test_scheduled_llm_reserves_prompt_plus_max_tokens_and_refunds_the_rest():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=6000)
+        llm = ScheduledLLM(_LLM(), scheduler)
+        messages = [{"role": "user", "content": "a b c"}]
+        assert await llm.agenerate(messages, max_tokens=100) == "one two"
+        # 3 prompt + 100 reserved (5 chars at 2 per token), 3 + 4 used (7 chars)
+        assert 5990 <= scheduler.stats()["tokens_available"] <= 6000
+        assert [token async for token in llm.astream_generate(messages, max_tokens=100)] == ["one", "two"]
+        assert scheduler.active == 0
+
+    run(main())
+
+
+def test_scheduled_llm_settles_against_the_usage_the_backend_reported():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=6000)
+        llm = ScheduledLLM(_LLM(usage=(400, 600)), scheduler)
+        await llm.agenerate("x" * 20, max_tokens=100)
+        # 10 + 100 reserved, but the backend reported 1000 used
+        assert 4990 <= scheduler.stats()["tokens_available"] <= 5010
+
+    run(main())
@@ -0,0 +1,175 @@
+import asyncio
+import gc
+
+import pytest
+
+from my_singleflight import SingleFlight, request_key
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Source:
+    """Async generator factory that yields ``items`` as ``release`` lets them through."""
+
+    def __init__(self, items):
+        self.items = items
+        self.starts = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    def __call__(self):
+        self.starts += 1
+        return self._run()
+
+    async def _run(self):
+        try:
+            for item in self.items:
+                await self.release.wait()
+                yield item
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_identical_requests_share_one_source():
+    async def main():
+        flights = SingleFlight()
+        source = Source(["a", "b", "c"])
+        first = flights.stream("k", source)
+        second = flights.stream("k", source)
+        source.release.set()
+        assert await asyncio.gather(collect(first), collect(second)) == [["a", "b", "c"]] * 2
+        assert source.starts == 1
+        assert flights.stats()["leaders"] == 1
+        assert flights.stats()["followers"] == 1
+
+    run(main())
+
+
+def test_late_subscriber_replays_what_was_already_emitted():
+    async def main():
+        flights = SingleFlight()
+        source = Source(["a", "b", "c"])
+        first = flights.stream("k", source)
+        source.release.set()
+        assert await first.__anext__() == "a"
+        second = flights.stream("k", source)
+        assert await collect(second) == ["a", "b", "c"]
+        assert await collect(first) == ["b", "c"]
+        assert source.starts == 1
+
+    run(main())
+
+
+def test_finished_flight_is_removed_and_the_next_request_starts_a_new_one():
+    async def main():
+        flights = SingleFlight()
+        source = Source(["a"])
+        source.release.set()
+        assert await collect(flights.stream("k", source)) == ["a"]
+        await settle()
+        assert flights.stats()["in_flight"] == 0
+        assert await collect(flights.stream("k", source)) == ["a"]
+        assert source.starts == 2
+
+    run(main())
+
+
+def test_source_is_cancelled_when_every_subscriber_leaves():
+    async def main():
+        flights = SingleFlight()
+        source = Source(["a", "b"])
+        first = flights.stream("k", source)
+        second = flights.stream("k", source)
+        await settle()
+        await first.aclose()
+        await settle()
+        assert not source.cancelled
+        await second.aclose()
+        await settle()
+        assert source.cancelled
+        assert flights.stats()["in_flight"] == 0
+
+    run(main())
+
+
+def test_subscriber_counts_before_its_first_iteration():
+    async def main():
+        flights = SingleFlight()
+        source = Source(["a", "b"])
+        first = flights.stream("k", source)
+        # the second response body has not been iterated yet when the first client disconnects
+        second = flights.stream("k", source)
+        await first.aclose()
+        await settle()
+        assert not source.cancelled
+        source.release.set()
+        assert await collect(second) == ["a", "b"]
+
+    run(main())
+
+
+def test_abandoned_subscription_is_released_when_collected():
+    async def main():
+        flights = SingleFlight()
+        source = Source(["a"])
+        subscription = flights.stream("k", source)
+        await settle()
+        del subscription
+        gc.collect()
+        await settle()
+        assert source.cancelled
+
+    run(main())
+
+
+def test_source_error_reaches_every_subscriber():
+    async def main():
+        flights = SingleFlight()
+
+        async def failing():
+            yield "a"
+            raise ValueError("upstream failed")
+
+        first = flights.stream("k", failing)
+        second = flights.stream("k", failing)
+        for subscription in (first, second):
+            assert await subscription.__anext__() == "a"
+            with pytest.raises(ValueError):
+                await subscription.__anext__()
+        await settle()
+        assert flights.stats()["in_flight"] == 0
+
+    run(main())
+
+
+def test_factory_error_starts_no_flight():
+    async def main():
+        flights = SingleFlight()
+
+        def rejected():
+            raise RuntimeError("queue full")
+
+        with pytest.raises(RuntimeError):
+            flights.stream("k", rejected)
+        assert flights.stats() == {"in_flight": 0, "leaders": 0, "followers": 0, "coalesced_rate": 0.0}
+
+    run(main())
+
+
+def test_request_key_normalizes_whitespace_and_width():
+    messages = [{"role": "user", "content": "公司  电话？"}]
+    assert request_key("local", "v1", messages) == request_key("local", "v1", [{"role": "user", "content": "公司 电话?"}])
+    assert request_key("local", "v1", messages) != request_key("global", "v1", messages)
+    assert request_key("local", "v1", messages) != request_key("local", "v2", messages)
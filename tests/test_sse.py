@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+
+from my_sse import SSEEncoder, coalesce_tokens
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def baseline_chunk(chunk_id, model, line, reason, created):
+    """The frame the original handler wrote: ``json.dumps`` of build_response's chunk."""
+    chunk = {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": line} if line else {}, "finish_reason": reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+@pytest.mark.parametrize("text", [
+    "你好",
+    "plain ascii",
+    'quotes " and \\ backslash',
+    "line\nbreak\ttab\r\x01",
+    "emoji 😀 and  ",
+    "</script>",
+])
+def test_sse_encoder_delta_matches_the_baseline_chunk(text):
+    encoder = SSEEncoder("chatcmpl-1", "graphrag-local-search:latest", created=1700000000)
+    assert encoder.delta(text) == baseline_chunk("chatcmpl-1", "graphrag-local-search:latest", text, None, 1700000000)
+
+
+def test_sse_encoder_stop_and_done_frames_match_the_baseline():
+    encoder = SSEEncoder('id "quoted"', "模型", created=1700000000)
+    assert encoder.stop == baseline_chunk('id "quoted"', "模型", "", "stop", 1700000000)
+    assert encoder.done == b"data: [DONE]\n\n"
+    assert encoder.comment("map 1/4") == b": map 1/4\n\n"
+
+
+async def timed(items):
+    """Yields strings as they are; a float item sleeps that many seconds instead."""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+async def collect(pieces, max_delay, max_bytes):
+    return [piece async for piece in coalesce_tokens(pieces, max_delay, max_bytes)]
+
+
+def test_coalesce_with_both_limits_at_zero_passes_pieces_through():
+    assert run(collect(timed(["a", "b", 1, "c"]), 0, 0)) == ["a", "b", 1, "c"]
+
+
+def test_coalesce_merges_pieces_until_max_bytes():
+    # "好" is 3 UTF-8 bytes
+    pieces = run(collect(timed(["好", "好", "a", "好", "b"]), 10.0, 6))
+    assert pieces == ["好好", "a好b"]
+
+
+def test_coalesce_flushes_after_max_delay_while_upstream_is_silent():
+    pieces = run(collect(timed(["a", "b", 0.1, "c", "d"]), 0.02, 1000))
+    assert pieces == ["ab", "cd"]
+
+
+def test_coalesce_flushes_before_passing_other_items_through():
+    marker = object()
+    pieces = run(collect(timed(["a", "b", marker, "c"]), 10.0, 1000))
+    assert pieces == ["ab", marker, "c"]
+
+
+def test_coalesce_without_delay_merges_only_pieces_already_arrived():
+    pieces = run(collect(timed(["a", "b", 0.01, "c"]), 0, 1000))
+    assert "".join(pieces) == "abc"
+    assert pieces[-1] == "c"
+
+
+def test_coalesce_reraises_upstream_errors_after_flushing():
+    async def failing():
+        yield "a"
+        raise ValueError("upstream failed")
+
+    async def main():
+        seen = []
+        with pytest.raises(ValueError, match="upstream failed"):
+            async for piece in coalesce_tokens(failing(), 10.0, 1000):
+                seen.append(piece)
+        return seen
+
+    assert run(main()) == ["a"]
+
+
+def test_coalesce_propagates_upstream_cancellation():
+    async def cancelled():
+        yield "a"
+        raise asyncio.CancelledError()
+
+    async def main():
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(collect(cancelled(), 10.0, 1000), timeout=5)
+
+    run(main())
+
+
+def test_coalesce_cancels_the_upstream_when_closed():
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            while True:
+                yield "a"
+                await asyncio.sleep(0.001)
+        finally:
+            closed.set()
+
+    async def main():
+        stream = coalesce_tokens(endless(), 0.005, 1000)
+        assert (await stream.__anext__()).startswith("a")
+        await stream.aclose()
+        await asyncio.wait_for(closed.wait(), timeout=1)
+
+    run(main())
@@ -0,0 +1,206 @@
+"""
+本地 OpenAI 兼容的大模型和向量接口替身，用于在不访问真实网关的情况下压测 app/web.py
+
+支持 /v1/chat/completions（流式和非流式，流式时按 stream_options.include_usage 返回用量）、/v1/embeddings 和 /v1/models。
+首 token 延迟、生成速度、输出长度、错误率、限流率和并发上限都可配置；全局检索 map 阶段（response_format 为 json_object）
+返回带评分要点的 JSON，reduce 和本地检索返回普通文本。向量按文本哈希生成，同一文本总是得到同一向量。
+
+用法：
+    python tools/bench/mock_openai.py --port 9000 --ttft-ms 400 --tokens-per-second 40 --error-rate 0.01
+然后以 API_BASE=http://127.0.0.1:9000/v1、API_BASE_EMBEDDING=http://127.0.0.1:9000/v1 启动 app/web.py；
+--embedding-dim 需与索引中实体向量的维度一致
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+VOCAB = ["湖南", "平安", "医械", "公司", "产品", "的", "用于", "医疗", "器械", "服务", "，", "。", "我们", "提供", "质量", "\n"]
+
+
+class MockState:
+    """
+    当前并发数和按状态码统计的请求数
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.active = 0
+        self.counts = {}
+        self.rng = random.Random(args.seed)
+
+    def count(self, kind: str):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI()
+    state = MockState(args)
+
+    def injected_error():
+        """
+        按配置的概率或并发上限返回 429/500，未命中时返回 None
+        """
+        if args.max_concurrency and state.active > args.max_concurrency:
+            return error_response(429, "concurrency limit exceeded")
+        roll = state.rng.random()
+        if roll < args.rate_limit_rate:
+            return error_response(429, "rate limited")
+        if roll < args.rate_limit_rate + args.error_rate:
+            return error_response(500, "injected server error")
+        return None
+
+    def error_response(status: int, message: str):
+        state.count(str(status))
+        headers = {"Retry-After": "1"} if status == 429 else None
+        return JSONResponse({"error": {"message": message, "type": "mock_error", "code": status}}, status, headers=headers)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state.active += 1
+        streaming = False
+        try:
+            error = injected_error()
+            if error is not None:
+                return error
+            state.count("chat")
+            text = completion_text(body, args, state.rng)
+            prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 2
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text),
+                     "total_tokens": prompt_tokens + len(text), "prompt_tokens_details": {"cached_tokens": 0}}
+            if not body.get("stream"):
+                await asyncio.sleep(args.ttft_ms / 1000 + len(text) / args.tokens_per_second)
+                return completion_body(body, text, usage)
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            response = StreamingResponse(stream_body(body, text, usage if include_usage else None),
+                                         media_type="text/event-stream")
+            # 流式请求的并发数在响应体发送完后才减少
+            streaming = True
+            return response
+        finally:
+            if not streaming:
+                state.active -= 1
+
+    async def stream_body(body, text, usage):
+        try:
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+            await asyncio.sleep(args.ttft_ms / 1000)
+            for token in text:
+                yield sse(chunk(chunk_id, body, {"content": token}, None))
+                await asyncio.sleep(1 / args.tokens_per_second)
+            yield sse(chunk(chunk_id, body, {}, "stop"))
+            if usage is not None:
+                yield sse({**chunk(chunk_id, body, {}, None), "choices": [], "usage": usage})
+            yield b"data: [DONE]\n\n"
+        finally:
+            state.active -= 1
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        state.active += 1
+        try:
+            error = injected_error()
+            if error is not None:
+                return error
+            state.count("embeddings")
+            await asyncio.sleep(args.embedding_latency_ms / 1000)
+            data = [{"object": "embedding", "index": i, "embedding": embed(item, args.embedding_dim)}
+                    for i, item in enumerate(inputs)]
+            tokens = sum(len(str(item)) for item in inputs)
+            return {"object": "list", "data": data, "model": body.get("model", "mock-embedding"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+        finally:
+            state.active -= 1
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"active": state.active, "counts": state.counts}
+
+    return app
+
+
+def completion_text(body: dict, args, rng: random.Random) -> list[str]:
+    """
+    生成回答的 token 列表；map 阶段（要求 JSON 输出）返回带评分的要点
+    """
+    limit = body.get("max_tokens") or args.output_tokens
+    count = max(1, min(args.output_tokens, limit))
+    words = [rng.choice(VOCAB) for _ in range(count)]
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        points = [{"description": "".join(words[i::3]) + " [Data: Reports (1)]", "score": rng.randint(0, 100)}
+                  for i in range(3)]
+        text = json.dumps({"points": points}, ensure_ascii=False)
+        # 按约 4 个字符一个 token 切分 JSON，保持流式和非流式的生成耗时与普通回答相近
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+    return words
+
+
+def completion_body(body: dict, tokens: list[str], usage: dict) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def chunk(chunk_id: str, body: dict, delta: dict, finish_reason) -> dict:
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def sse(data: dict) -> bytes:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+def embed(text, dim: int) -> list[float]:
+    """
+    以文本的哈希为种子生成单位向量
+    """
+    seed = int.from_bytes(hashlib.sha256(str(text).encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft-ms", type=float, default=300, help="首 token 延迟（毫秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="每个请求的生成速度")
+    parser.add_argument("--output-tokens", type=int, default=200, help="回答 token 数（不超过请求的 max_tokens）")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="超过该并发数的请求返回 429，0 表示不限制")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+压测回放：从 JSONL 问题集按逐级增加的并发驱动 /v1/chat/completions，记录每个请求的延迟、首 token 时间和错误
+
+问题集每行一个 JSON：{"question": "...", "model": 可选，覆盖 --model, "history": 可选，此前的对话消息列表}
+每个并发档位循环使用问题集发送 --requests 个请求（至少每个并发各一个），流式和非流式分别压测（--mode both），
+结束后按档位打印 p50/p95/p99 延迟、TTFT、吞吐和错误率。
+
+用法：
+    python tools/bench/mock_openai.py --port 9000 &
+    API_BASE=http://127.0.0.1:9000/v1 API_BASE_EMBEDDING=http://127.0.0.1:9000/v1 python app/web.py &
+    python tools/bench/replay.py --concurrency 1,4,16,32 --requests 100 --output results.jsonl
+非流式请求的 TTFT 记为完整响应的延迟
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from report import format_table, summarize  # noqa: E402
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.jsonl")
+
+
+def load_questions(path):
+    with open(path, encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    if not questions:
+        raise SystemExit(f"问题集 {path} 为空")
+    return questions
+
+
+async def send(client, args, item, stream, concurrency):
+    """
+    发送一个请求并返回其记录；流式请求以第一个非空 delta 的到达时间为 TTFT
+    """
+    messages = list(item.get("history") or []) + [{"role": "user", "content": item["question"]}]
+    body = {"model": item.get("model") or args.model, "messages": messages, "stream": stream}
+    record = {"concurrency": concurrency, "stream": stream, "question": item["question"],
+              "start": time.time(), "ttft_ms": None, "chars": 0, "status": None, "error": None}
+    start = time.perf_counter()
+    try:
+        if stream:
+            async with client.stream("POST", "/v1/chat/completions", json=body) as response:
+                record["status"] = response.status_code
+                if response.status_code != 200:
+                    await response.aread()
+                    record["error"] = f"http_{response.status_code}"
+                else:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: ") or line == "data: [DONE]":
+                            continue
+                        choices = json.loads(line[6:]).get("choices") or [{}]
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            if record["ttft_ms"] is None:
+                                record["ttft_ms"] = (time.perf_counter() - start) * 1000
+                            record["chars"] += len(content)
+        else:
+            response = await client.post("/v1/chat/completions", json=body)
+            record["status"] = response.status_code
+            if response.status_code != 200:
+                record["error"] = f"http_{response.status_code}"
+            else:
+                choices = response.json().get("choices") or [{}]
+                message = choices[0].get("message") or choices[0].get("delta") or {}
+                record["chars"] = len(message.get("content") or "")
+                record["ttft_ms"] = (time.perf_counter() - start) * 1000
+    except httpx.TimeoutException:
+        record["error"] = "timeout"
+    except Exception as e:
+        record["error"] = type(e).__name__
+    record["latency_ms"] = (time.perf_counter() - start) * 1000
+    record["end"] = time.time()
+    if record["error"] is None and record["chars"] == 0:
+        record["error"] = "empty_response"
+    return record
+
+
+async def run_level(client, args, questions, concurrency, stream):
+    """
+    以固定并发发送一个档位的请求：concurrency 个协程依次领取下一个问题
+    """
+    total = max(args.requests, concurrency)
+    next_index = iter(range(total))
+    records = []
+
+    async def worker():
+        for index in next_index:
+            records.append(await send(client, args, questions[index % len(questions)], stream, concurrency))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return records, time.perf_counter() - start
+
+
+async def run(args):
+    questions = load_questions(args.questions)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    modes = {"stream": [True], "non-stream": [False], "both": [True, False]}[args.mode]
+    limits = httpx.Limits(max_connections=max(levels) * 2, max_keepalive_connections=max(levels) * 2)
+    summaries = []
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            for _ in range(args.warmup):
+                await send(client, args, questions[0], False, 0)
+            for stream in modes:
+                for concurrency in levels:
+                    records, wall_seconds = await run_level(client, args, questions, concurrency, stream)
+                    summary = summarize(records, wall_seconds)
+                    summary["mode"] = "stream" if stream else "non-stream"
+                    summaries.append(summary)
+                    print(f"[{summary['mode']}] 并发 {concurrency}: {summary['requests']} 个请求，"
+                          f"{summary['throughput_rps']:.2f} req/s，错误率 {summary['error_rate']:.1%}", file=sys.stderr)
+                    if output is not None:
+                        for record in records:
+                            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8012")
+    parser.add_argument("--model", default="graphrag-www_hnpamd_com_1")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="逗号分隔的并发档位")
+    parser.add_argument("--requests", type=int, default=50, help="每个档位的请求数")
+    parser.add_argument("--mode", choices=["stream", "non-stream", "both"], default="both")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--warmup", type=int, default=1, help="正式压测前发送的预热请求数（不计入结果）")
+    parser.add_argument("--output", help="逐请求记录的 JSONL 输出文件，可用 report.py 重新汇总")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 而不是表格")
+    args = parser.parse_args()
+
+    summaries = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summaries, ensure_ascii=False, indent=2))
+        return
+    for mode in ("stream", "non-stream"):
+        rows = [summary for summary in summaries if summary["mode"] == mode]
+        if rows:
+            print(f"\n== {mode} ==")
+            print(format_table(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+压测结果汇总：按并发档位统计延迟、首 token 时间（TTFT）的 p50/p95/p99、吞吐和错误率
+
+replay.py 压测结束时直接打印汇总，也可以对其 --output 保存的逐请求记录重新汇总：
+    python tools/bench/report.py results.jsonl
+"""
+import argparse
+import json
+import math
+from collections import defaultdict
+
+COLUMNS = [
+    ("concurrency", "并发", "{:>4}"),
+    ("requests", "请求数", "{:>6}"),
+    ("error_rate", "错误率", "{:>7.1%}"),
+    ("throughput_rps", "吞吐 req/s", "{:>10.2f}"),
+    ("chars_per_second", "字符/s", "{:>8.0f}"),
+    ("latency_p50_ms", "延迟p50", "{:>8.0f}"),
+    ("latency_p95_ms", "延迟p95", "{:>8.0f}"),
+    ("latency_p99_ms", "延迟p99", "{:>8.0f}"),
+    ("ttft_p50_ms", "TTFT p50", "{:>8.0f}"),
+    ("ttft_p95_ms", "TTFT p95", "{:>8.0f}"),
+    ("ttft_p99_ms", "TTFT p99", "{:>8.0f}"),
+]
+
+
+def percentile(values, q):
+    """
+    最近秩百分位数，values 为空时返回 None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(records, wall_seconds=None):
+    """
+    汇总一个并发档位的逐请求记录；吞吐按该档位的实际耗时计算，未给出时取最早开始到最晚结束的时间
+    """
+    ok = [r for r in records if r["error"] is None]
+    latencies = [r["latency_ms"] for r in ok]
+    ttfts = [r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]
+    if wall_seconds is None and records:
+        wall_seconds = max(r["end"] for r in records) - min(r["start"] for r in records)
+    wall_seconds = wall_seconds or 0.0
+    errors = defaultdict(int)
+    for r in records:
+        if r["error"] is not None:
+            errors[r["error"]] += 1
+    summary = {
+        "concurrency": records[0]["concurrency"] if records else 0,
+        "requests": len(records),
+        "errors": dict(errors),
+        "error_rate": (len(records) - len(ok)) / len(records) if records else 0.0,
+        "throughput_rps": len(ok) / wall_seconds if wall_seconds else 0.0,
+        "chars_per_second": sum(r["chars"] for r in ok) / wall_seconds if wall_seconds else 0.0,
+        "wall_seconds": round(wall_seconds, 2),
+    }
+    for q in (50, 95, 99):
+        summary[f"latency_p{q}_ms"] = percentile(latencies, q)
+        summary[f"ttft_p{q}_ms"] = percentile(ttfts, q)
+    return summary
+
+
+def format_table(summaries):
+    lines = [" ".join(title.rjust(len(fmt.format(0))) for _, title, fmt in COLUMNS)]
+    for summary in summaries:
+        cells = []
+        for key, _, fmt in COLUMNS:
+            value = summary.get(key)
+            width = len(fmt.format(0))
+            cells.append("-".rjust(width) if value is None else fmt.format(value))
+        lines.append(" ".join(cells))
+    for summary in summaries:
+        if summary["errors"]:
+            lines.append(f"并发 {summary['concurrency']} 的错误: {summary['errors']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("results", help="replay.py --output 写出的逐请求记录")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 而不是表格")
+    args = parser.parse_args()
+
+    levels = defaultdict(list)
+    with open(args.results, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                levels[(record["stream"], record["concurrency"])].append(record)
+    summaries = []
+    for stream, concurrency in sorted(levels, key=lambda key: (not key[0], key[1])):
+        summary = summarize(levels[(stream, concurrency)])
+        summary["mode"] = "stream" if stream else "non-stream"
+        summaries.append(summary)
+    if args.json:
+        print(json.dumps(summaries, ensure_ascii=False, indent=2))
+        return
+    for mode in ("stream", "non-stream"):
+        rows = [summary for summary in summaries if summary["mode"] == mode]
+        if rows:
+            print(f"\n== {mode} ==")
+            print(format_table(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+SSE 流式编码基准：对比逐帧 json.dumps、预渲染外层 JSON 的 SSEEncoder，以及按字节合并后的帧在单核上的吞吐（tokens/s）
+
+用法：
+    python tools/bench_sse.py --tokens 200000 --coalesce-bytes 64
+运行前会先校验 SSEEncoder 的输出与原实现逐字节一致
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from my_sse import SSEEncoder, coalesce_tokens  # noqa: E402
+
+CHUNK_ID = "chatcmpl-bench"
+MODEL = "graphrag-local-search:latest"
+CREATED = 1_700_000_000
+VOCAB = ["数据", "社区", "的", "实体", " graph", " the", " report", "，", "。", "\n", " \"quoted\"", " 42", "关系", "摘要"]
+
+
+def build_response(line, reason, created=CREATED):
+    """
+    web.build_response 的副本（固定 created），作为原实现的基准
+    """
+    chunk = {
+        "id": CHUNK_ID,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": MODEL,
+        "choices": [{"index": 0, "delta": {"content": line} if line else {}, "finish_reason": reason}],
+    }
+    return chunk
+
+
+def baseline_frame(token):
+    return f"data: {json.dumps(build_response(token, None))}\n\n".encode()
+
+
+def verify(tokens):
+    encoder = SSEEncoder(CHUNK_ID, MODEL, created=CREATED)
+    for token in tokens:
+        assert encoder.delta(token) == baseline_frame(token), token
+    assert encoder.stop == f"data: {json.dumps(build_response(None, 'stop'))}\n\n".encode()
+
+
+def bench(name, run, count):
+    start = time.perf_counter()
+    total_bytes = run()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {count / elapsed:>12,.0f} tokens/s {total_bytes / elapsed / 1e6:>8.1f} MB/s")
+
+
+async def token_stream(tokens):
+    for token in tokens:
+        yield token
+
+
+async def coalesced_bytes(tokens, max_bytes):
+    encoder = SSEEncoder(CHUNK_ID, MODEL, created=CREATED)
+    total = 0
+    # 这里只测编码开销，时间阈值设得足够大，由字节阈值触发发送
+    async for piece in coalesce_tokens(token_stream(tokens), 3600.0, max_bytes):
+        total += len(encoder.delta(piece))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=200_000)
+    parser.add_argument("--coalesce-bytes", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tokens = [rng.choice(VOCAB) for _ in range(args.tokens)]
+    verify(tokens[:1000])
+
+    encoder = SSEEncoder(CHUNK_ID, MODEL, created=CREATED)
+    bench("json.dumps per frame", lambda: sum(len(baseline_frame(t)) for t in tokens), len(tokens))
+    bench("SSEEncoder.delta", lambda: sum(len(encoder.delta(t)) for t in tokens), len(tokens))
+    bench(f"coalesced ({args.coalesce_bytes} bytes)",
+          lambda: asyncio.run(coalesced_bytes(tokens, args.coalesce_bytes)), len(tokens))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+实体向量检索基准：对比 LanceDB 与进程内 NumPy 向量库（float32/float16，以及可选的近似索引）的召回率和延迟
+
+用法：
+    python tools/bench_vector_store.py --input-dir <索引 output 目录>
+    python tools/bench_vector_store.py --entities 100000 --dim 1536
+召回率以 float32 精确检索的结果为基准
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from graphrag.vector_stores import VectorStoreDocument  # noqa: E402
+from graphrag.vector_stores.lancedb import LanceDBVectorStore  # noqa: E402
+from my_vector_store import NumpyVectorStore  # noqa: E402
+
+
+def load_vectors(args):
+    """
+    从索引目录读取实体描述向量，或生成随机的单位向量
+    """
+    if args.input_dir:
+        df = pd.read_parquet(os.path.join(args.input_dir, "create_final_entities.parquet"))
+        df = df[df["description_embedding"].notna()]
+        vectors = np.asarray(df["description_embedding"].tolist(), dtype=np.float32)
+        ids = df["id"].astype(str).tolist()
+    else:
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((args.entities, args.dim), dtype=np.float32)
+        ids = [f"e{i}" for i in range(args.entities)]
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return ids, vectors
+
+
+def make_queries(vectors, count, seed):
+    # 在已有向量附近加噪声作为查询，接近真实问题命中某几个实体的情况
+    rng = np.random.default_rng(seed + 1)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    queries = picks + 0.5 * rng.standard_normal(picks.shape, dtype=np.float32) / np.sqrt(vectors.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def run(name, store, queries, k, truth, batch_size):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        hits = store.similarity_search_by_vector(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - start)
+        results.append([str(hit.document.id) for hit in hits])
+    batch_qps = None
+    if hasattr(store, "search_batch"):
+        start = time.perf_counter()
+        for begin in range(0, len(queries), batch_size):
+            store.search_batch(queries[begin:begin + batch_size], k=k)
+        batch_qps = len(queries) / (time.perf_counter() - start)
+    recall = np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]) if truth else 1.0
+    print(
+        f"{name:<24} recall@{k}={recall:.4f}  p50={percentile_ms(latencies, 50):.2f}ms  "
+        f"p99={percentile_ms(latencies, 99):.2f}ms  "
+        + (f"batch({batch_size}) {batch_qps:.0f} q/s" if batch_qps else "")
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="实体向量检索基准")
+    parser.add_argument("--input-dir", help="GraphRAG 索引 output 目录，不指定则使用随机向量")
+    parser.add_argument("--entities", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20, help="本地检索默认 top_k_mapped_entities=10，过采样 2 倍")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--ann-threshold", type=int, default=0, help="大于 0 时额外测试近似索引")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ids, vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.seed)
+    documents = [
+        VectorStoreDocument(id=entity_id, text="", vector=vector, attributes={})
+        for entity_id, vector in zip(ids, vectors)
+    ]
+    print(f"实体数 {len(ids)}，维度 {vectors.shape[1]}，查询数 {len(queries)}")
+
+    start = time.perf_counter()
+    exact = NumpyVectorStore(collection_name="bench", ann_threshold=len(ids) + 1)
+    exact.load_documents(documents)
+    print(f"numpy float32 加载耗时 {time.perf_counter() - start:.2f}s，矩阵 {exact.nbytes / 2 ** 20:.1f} MB")
+    truth = run("numpy float32 (exact)", exact, queries, args.k, None, args.batch_size)
+
+    half = NumpyVectorStore(collection_name="bench", dtype="float16", ann_threshold=len(ids) + 1)
+    half.load_documents(documents)
+    run("numpy float16 (exact)", half, queries, args.k, truth, args.batch_size)
+
+    if args.ann_threshold:
+        start = time.perf_counter()
+        ann = NumpyVectorStore(collection_name="bench", ann_threshold=args.ann_threshold)
+        ann.load_documents(documents)
+        print(f"近似索引构建耗时 {time.perf_counter() - start:.2f}s")
+        run(f"numpy + {type(ann.ann_index).__name__}", ann, queries, args.k, truth, args.batch_size)
+
+    with tempfile.TemporaryDirectory() as db_uri:
+        start = time.perf_counter()
+        lance = LanceDBVectorStore(collection_name="bench")
+        lance.connect(db_uri=db_uri)
+        lance.load_documents([
+            VectorStoreDocument(id=d.id, text=d.text, vector=d.vector.tolist(), attributes={}) for d in documents
+        ])
+        print(f"lancedb 加载耗时 {time.perf_counter() - start:.2f}s")
+        run("lancedb", lance, queries, args.k, truth, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()